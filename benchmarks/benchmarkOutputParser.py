@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+'''
+Benchmark of the Betashape output parser (CmdBetaShape.get_data_from_folder).
+The single-read parser is compared with the previous one, based on np.loadtxt.
+'''
+import numpy as np
+import argparse
+import tempfile
+import time
+import os
+
+from base import base_utilities as bu
+from process import wrappers
+
+
+def legacy_read_header(fname):
+    with open(fname,"r",encoding="ISO-8859-1") as f:
+        nrow = 1
+        header = f.readline()
+        compact = header.replace(" ","")
+        while compact[:6] != "E(keV)":
+            text = f.readline()
+            compact = text.replace(" ","")
+            header+=text
+            nrow +=1
+    return header.split("\n")[:-1], nrow
+
+
+def legacy_get_data(fname):
+    '''
+    The parser used before the single-read one: the file is opened three times.
+    '''
+    header, nrow = legacy_read_header(fname)
+    with open(fname,"r",encoding="ISO-8859-1") as f:
+        a = np.array(f.readlines())
+        index = np.where(a=='\n')[0]
+    nrows1 = index[index>nrow][0] - nrow
+    data1 = np.loadtxt(fname,skiprows=nrow,max_rows=nrows1)
+    nrow2 = index[index>nrow][-1] +2
+    data2 = np.loadtxt(fname,skiprows=nrow2)
+    return data1, data2
+
+
+def legacy_get_data_from_folder(folder_name):
+    full_files = sorted(os.listdir(folder_name))
+    output_list = []
+    pos = np.intersect1d(bu.locate_word(np.array(full_files),"trans"),bu.locate_word(np.array(full_files),"myEstep"))
+    for i in pos:
+        fname = folder_name+"/"+full_files[i]
+        data_beta, data_nu = legacy_get_data(fname)
+        output_message = legacy_read_header(fname.replace("_myEstep",""))[0]
+        output_list.append({"data_beta":data_beta,"data_nu":data_nu,"output_message":output_message})
+    return output_list
+
+
+def write_output(fname,emax,step=1.,intensity=50.):
+    '''
+    Write a file with the layout of a Betashape "_myEstep" output (header, electron block, neutrino block).
+    '''
+    e = np.arange(0,emax,step)
+    y = e*(emax-e)**2/emax**4
+    with open(fname,"w",encoding="ISO-8859-1") as f:
+        f.write("Synthetic Betashape output\nIntensity: "+str(intensity)+" (3)\nCalculation of allowed transition\n")
+        for k, block in enumerate([y,y[::-1]]):
+            if k == 1:
+                f.write("\nNeutrino spectrum\n\n")
+            f.write("E(keV)  dN/dEcalc.  Unc.  dN/dE(norm)\n")
+            for a, b in zip(e,block):
+                f.write("%.3f  %.6e  %.6e  %.6e\n" % (a,b,0.01*b,b))
+            f.write("%.3f  0.0  0.0  0.0\n" % emax)
+    return
+
+
+def generate(path,n_folders=20,n_trans=5,step=1.):
+    rng = np.random.default_rng(1)
+    for i in range(n_folders):
+        folder = bu.fix_path(path)+"N"+str(i)
+        os.mkdir(folder)
+        for j in range(n_trans):
+            emax = rng.uniform(1000,12000)
+            write_output(folder+"/N"+str(i)+"_trans"+str(j)+"_myEstep.bs",emax,step=step)
+            write_output(folder+"/N"+str(i)+"_trans"+str(j)+".bs",emax,step=10.)
+    return
+
+
+def main():
+    usage='benchmarkOutputParser.py -d /path/to/betashape/outputs'
+    parser = argparse.ArgumentParser(description='Benchmark the parser of the Betashape outputs', usage=usage)
+    parser.add_argument("-d", "--dir"   , dest="dir"   , type=str , help="folder with the Betashape output folders (one for each nuclide). If None, synthetic outputs are generated", default = None, required = False)
+    parser.add_argument("-n", "--n_folders"   , dest="n_folders"   , type=int , help="number of synthetic nuclide folders", default = 20, required = False)
+    parser.add_argument("-s", "--step"   , dest="step"   , type=float , help="energy step (keV) of the synthetic outputs", default = 1., required = False)
+    parser.add_argument("-r", "--repeat"   , dest="repeat"   , type=int , help="number of repetitions", default = 3, required = False)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temp:
+        path = args.dir
+        if path is None:
+            bu.log("Generating "+str(args.n_folders)+" synthetic output folders...",level=0)
+            generate(temp,n_folders=args.n_folders,step=args.step)
+            path = temp
+        path = bu.fix_path(path)
+        folders = [path+f for f in sorted(os.listdir(path)) if os.path.isdir(path+f)]
+
+        cmd = wrappers.CmdBetaShape()
+        bu.log("Checking the results on "+str(len(folders))+" folders...",level=0)
+        for folder in folders:
+            new = cmd.get_data_from_folder(folder)
+            old = legacy_get_data_from_folder(folder)
+            for a, b in zip(new,old):
+                assert np.array_equal(a["data_beta"],b["data_beta"]) & np.array_equal(a["data_nu"],b["data_nu"])
+                assert a["output_message"] == b["output_message"]
+        bu.log("Same results",level=1)
+
+        for label, function in [("np.loadtxt parser",legacy_get_data_from_folder),("single-read parser",cmd.get_data_from_folder)]:
+            times = []
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                for folder in folders:
+                    function(folder)
+                times.append(time.perf_counter()-start)
+            bu.log(label+": best of "+str(args.repeat)+" = "+"{:.3f}".format(min(times))+" s",level=0)
+    return
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+'''
+Latency and throughput of the total spectrum queries answered by a SpectrumServer (see rw/spectrum_server.py) on the
+local host, compared with a LazyReader opened for each query. The server runs in its own process, the clients in
+threads of this one. The total spectrum returned by the server is checked against LazyReader.get_total_spectrum.
+'''
+import numpy as np
+import multiprocessing
+import argparse
+import tempfile
+import time
+import os
+from concurrent import futures
+
+from base import base_utilities as bu
+from rw import lazy_handler
+from rw import spectrum_server
+from benchmarkStorage import write
+
+
+LABELS = {"labels" : ["cumulative_thermal_fy_235u"], "labels_unc" : ["unc_ct_235u"], "ffs" : [1.]}
+
+
+def serve(fname,queue):
+    server = spectrum_server.SpectrumServer(spectrum_server.SpectrumDatabase(fname))
+    queue.put(server.get_url())
+    server.serve_forever()
+
+
+def latency(function,n_queries):
+    times = []
+    for _ in range(n_queries):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter()-start)
+    times = np.array(times)*1e3
+    return "median "+"{:.2f}".format(np.median(times))+" ms, p95 "+"{:.2f}".format(np.percentile(times,95))+" ms"
+
+
+def main():
+    usage='benchmarkServer.py -n 200 -t 1 2 4 8'
+    parser = argparse.ArgumentParser(description='Benchmark the spectrum server on the local host', usage=usage)
+    parser.add_argument("-lp", "--lazy_path"   , dest="lazy"   , type=str , help="path to the lazy file (synthetic nuclides if None)", default = None, required = False)
+    parser.add_argument("-n", "--n_nuclides"   , dest="n_nuclides"   , type=int , help="number of synthetic nuclides", default = 200, required = False)
+    parser.add_argument("-q", "--n_queries"   , dest="n_queries"   , type=int , help="number of queries", default = 200, required = False)
+    parser.add_argument("-t", "--n_threads"   , dest="n_threads"   , type=int , nargs="+", help="numbers of client threads", default = [1,2,4,8], required = False)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temp:
+        fname = args.lazy
+        if fname is None:
+            fname = os.path.join(temp,"bench.lazy")
+            bu.log("Writing "+str(args.n_nuclides)+" synthetic nuclides...",level=0)
+            lazy_handler.LazyWriter(fname=fname).set_general_info({"E_step" : 1.})
+            write(fname,np.arange(args.n_nuclides))
+
+        def cold():
+            LR = lazy_handler.LazyReader(fname)
+            _, spectra, spectra_er, posOK, _ = LR.get_nu_spectra()
+            return LR.get_total_spectrum(spectra=spectra,spectra_er=spectra_er,posOK=posOK,**LABELS)
+        bu.log("LazyReader opened for each query:",level=0)
+        bu.log(latency(cold,3),level=1)
+        reference = cold()
+
+        queue = multiprocessing.Queue()
+        process = multiprocessing.Process(target=serve,args=(fname,queue),daemon=True)
+        start = time.perf_counter()
+        process.start()
+        try:
+            client = spectrum_server.SpectrumClient(queue.get(timeout=600))
+            info = client.get_info()
+            bu.log("Server started in "+"{:.2f}".format(time.perf_counter()-start)+" s ("+str(len(info["nuclides"]))+" spectra)",level=0)
+            _, spectrum, spectrum_err = client.get_total_spectrum(**LABELS)
+            assert np.allclose(spectrum,reference[0],rtol=1e-10,atol=0) and np.allclose(spectrum_err,reference[1],rtol=1e-10,atol=0)
+
+            E_min, E_max, _ = info["energy"]
+            queries = {"whole spectrum" : {},
+                       "half of the nuclides" : {"nuclides" : info["nuclides"][::2]},
+                       "window and bins" : {"E_min" : (E_min+E_max)/2, "edges" : np.linspace((E_min+E_max)/2,E_max,101)}}
+            bu.log("Latency ("+str(args.n_queries)+" queries):",level=0)
+            for label, query in queries.items():
+                bu.log(label+": "+latency(lambda: client.get_total_spectrum(**LABELS,**query),args.n_queries),level=1)
+
+            bu.log("Throughput (whole spectrum):",level=0)
+            for n_threads in args.n_threads:
+                start = time.perf_counter()
+                with futures.ThreadPoolExecutor(max_workers=n_threads) as pool:
+                    results = list(pool.map(lambda _: client.get_total_spectrum(**LABELS)[1],range(args.n_queries)))
+                elapsed = time.perf_counter()-start
+                assert all([np.array_equal(el,spectrum) for el in results])
+                bu.log(str(n_threads)+" threads: "+"{:.1f}".format(args.n_queries/elapsed)+" queries/s",level=1)
+            bu.log("Same results",level=0)
+        finally:
+            process.terminate()
+            process.join()
+    return
+
+
+if __name__ == "__main__":
+    main()
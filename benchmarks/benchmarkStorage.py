@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+'''
+Benchmark of the storage backends of the .lazy files (HDF5 file and directory store, see rw/storage.py).
+Writes (serial for HDF5, parallel processes for the directory store), conversion and reads (serial and with threads)
+are timed, and the spectra read from the two backends are compared.
+'''
+import numpy as np
+import argparse
+import tempfile
+import time
+import os
+from concurrent import futures
+
+from base import base_utilities as bu
+from rw import lazy_handler
+from rw import storage
+
+
+def nuclide(i,length=12000):
+    '''
+    Synthetic nuclide: info parameters and a spectrum with its uncertainty.
+    '''
+    rng = np.random.default_rng(i)
+    q = rng.uniform(1000,length)
+    e = np.arange(length,dtype=float)
+    spectrum = np.where(e < q,e**2*(q-e)**2,0.)
+    spectrum = spectrum/np.sum(spectrum)
+    info = {"z" : 30+i%40, "n" : 40+i%50, "m" : 0, "Q" : q, "tag" : "synthetic",
+            "cumulative_thermal_fy_235u" : rng.uniform(1e-6,1e-2), "unc_ct_235u" : 1e-5}
+    return "N"+str(i), info, {"dN_dE_tot" : spectrum, "unc_dN_dE" : 0.1*spectrum}
+
+
+def write(fname,indices,backend=None):
+    LW = lazy_handler.LazyWriter(fname=fname,backend=backend)
+    for i in indices:
+        name, info, data = nuclide(i)
+        LW.write_nuclide_data(nuclide_name=name,dtype="info",dictionary=info)
+        LW.write_nuclide_data(nuclide_name=name,dtype="data",dictionary=data)
+    return
+
+
+def read_parallel(fname,n_threads):
+    LR = lazy_handler.LazyReader(fname)
+    blocks = np.array_split(np.arange(len(LR.get_nuclides_list())),n_threads)
+    with futures.ThreadPoolExecutor(max_workers=n_threads) as pool:
+        return [el for el in pool.map(lambda block: LR.get_nu_spectra(nuclides=block,unc_BR=False)[1],blocks)]
+
+
+def timed(label,function,repeat=1):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        times.append(time.perf_counter()-start)
+    bu.log(label+": "+"{:.3f}".format(min(times))+" s",level=1)
+    return result
+
+
+def main():
+    usage='benchmarkStorage.py -n 200 -w 4'
+    parser = argparse.ArgumentParser(description='Benchmark the storage backends of the .lazy files', usage=usage)
+    parser.add_argument("-n", "--n_nuclides"   , dest="n_nuclides"   , type=int , help="number of synthetic nuclides", default = 200, required = False)
+    parser.add_argument("-w", "--n_workers"   , dest="n_workers"   , type=int , help="number of parallel writers and readers", default = 4, required = False)
+    parser.add_argument("-r", "--repeat"   , dest="repeat"   , type=int , help="number of repetitions of the reads", default = 3, required = False)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temp:
+        h5 = os.path.join(temp,"bench.lazy")
+        store = os.path.join(temp,"bench.lazyd")
+        converted = os.path.join(temp,"converted.lazyd")
+        indices = np.arange(args.n_nuclides)
+
+        bu.log("Writing "+str(args.n_nuclides)+" synthetic nuclides...",level=0)
+        lazy_handler.LazyWriter(fname=h5).set_general_info({"E_step" : 1.})
+        timed("HDF5, 1 writer",lambda: write(h5,indices))
+        lazy_handler.LazyWriter(fname=store,backend="directory").set_general_info({"E_step" : 1.})
+        with futures.ProcessPoolExecutor(max_workers=args.n_workers) as pool:
+            timed("directory store, "+str(args.n_workers)+" writers",
+                  lambda: list(pool.map(write,[store]*args.n_workers,np.array_split(indices,args.n_workers))))
+        timed("conversion HDF5 -> directory store",lambda: storage.convert(h5,converted))
+
+        bu.log("Checking the results...",level=0)
+        reference = lazy_handler.LazyReader(h5).get_nu_spectra(unc_BR=False)
+        for fname in [store,converted]:
+            result = lazy_handler.LazyReader(fname).get_nu_spectra(unc_BR=False)
+            for a, b in zip(reference,result):
+                assert np.array_equal(a,b)
+        bu.log("Same results",level=1)
+
+        bu.log("Reading...",level=0)
+        for label, fname in [("HDF5",h5),("directory store",store)]:
+            timed(label+", get_table",lambda: lazy_handler.LazyReader(fname).get_table(),args.repeat)
+            timed(label+", get_nu_spectra",lambda: lazy_handler.LazyReader(fname).get_nu_spectra(unc_BR=False),args.repeat)
+            timed(label+", get_nu_spectra with "+str(args.n_workers)+" threads",lambda: read_parallel(fname,args.n_workers),args.repeat)
+    return
+
+
+if __name__ == "__main__":
+    main()
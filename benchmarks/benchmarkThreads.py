@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+'''
+Multithreaded throughput of a LazyReader shared by several threads, as in a threaded web service: each request
+reads one nuclide and the spectra of a few random nuclides. The reader reads the file (HDF5 reads are serialized by
+h5py) or the arrays preloaded in memory (see LazyReader.preload). The results of every request are checked against
+a serial run.
+'''
+import numpy as np
+import argparse
+import tempfile
+import time
+import os
+from concurrent import futures
+
+from base import base_utilities as bu
+from rw import lazy_handler
+from benchmarkStorage import write
+
+
+def request(reader,names,seed,size):
+    rng = np.random.default_rng(seed)
+    nuclide = reader.get_nuclide(name=names[rng.integers(len(names))])
+    _, spectra, spectra_er, posOK, _ = reader.get_nu_spectra(unc_BR=False,nuclides=np.sort(rng.choice(len(names),size,replace=False)))
+    return nuclide["lazy_name"], spectra, spectra_er, posOK
+
+
+def run(reader,names,seeds,size,n_threads):
+    with futures.ThreadPoolExecutor(max_workers=n_threads) as pool:
+        return list(pool.map(lambda seed: request(reader,names,seed,size),seeds))
+
+
+def same(a,b):
+    return all([(x[0] == y[0]) and all([np.array_equal(u,v) for u, v in zip(x[1:],y[1:])]) for x, y in zip(a,b)])
+
+
+def main():
+    usage='benchmarkThreads.py -n 200 -t 1 2 4 8'
+    parser = argparse.ArgumentParser(description='Benchmark a LazyReader shared by several threads', usage=usage)
+    parser.add_argument("-lp", "--lazy_path"   , dest="lazy"   , type=str , help="path to the lazy file (synthetic nuclides if None)", default = None, required = False)
+    parser.add_argument("-n", "--n_nuclides"   , dest="n_nuclides"   , type=int , help="number of synthetic nuclides", default = 200, required = False)
+    parser.add_argument("-q", "--n_requests"   , dest="n_requests"   , type=int , help="number of requests", default = 400, required = False)
+    parser.add_argument("-s", "--size"   , dest="size"   , type=int , help="number of spectra read by each request", default = 10, required = False)
+    parser.add_argument("-t", "--n_threads"   , dest="n_threads"   , type=int , nargs="+", help="numbers of threads", default = [1,2,4,8], required = False)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temp:
+        fname = args.lazy
+        if fname is None:
+            fname = os.path.join(temp,"bench.lazy")
+            bu.log("Writing "+str(args.n_nuclides)+" synthetic nuclides...",level=0)
+            lazy_handler.LazyWriter(fname=fname).set_general_info({"E_step" : 1.})
+            write(fname,np.arange(args.n_nuclides))
+
+        start = time.perf_counter()
+        memory = lazy_handler.LazyReader(fname,preload=True)
+        bu.log("Preloading: "+"{:.2f}".format(time.perf_counter()-start)+" s",level=0)
+        names = memory.get_nuclides_list()
+        size = min(args.size,len(names))
+        seeds = np.arange(args.n_requests)
+        reference = [request(lazy_handler.LazyReader(fname),names,seed,size) for seed in seeds[:20]]
+
+        for label, reader in [("file",lazy_handler.LazyReader(fname)),("preloaded",memory)]:
+            bu.log("Reader on the "+label+" ("+str(args.n_requests)+" requests, "+str(size)+" spectra each):",level=0)
+            for n_threads in args.n_threads:
+                start = time.perf_counter()
+                results = run(reader,names,seeds,size,n_threads)
+                elapsed = time.perf_counter()-start
+                assert same(reference,results[:len(reference)])
+                bu.log(str(n_threads)+" threads: "+"{:.1f}".format(args.n_requests/elapsed)+" requests/s",level=1)
+        bu.log("Same results",level=0)
+    return
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+import numpy as np
+import pandas as pd
+import argparse
+import time
+
+from base import base_utilities as bu
+from rw import lazy_handler
+
+
+def main():
+
+    usage='compareLazyFiles.py -a /path/to/reference.lazy -b /path/to/new.lazy'
+    parser = argparse.ArgumentParser(description='Compare two .lazy files: nuclides, parameters, spectra and impact on the total spectrum (see LazyReader.compare)', usage=usage)
+
+    parser.add_argument("-a", "--reference"   , dest="reference"   , type=str , help="path to the reference lazy file", default = None, required = True)
+    parser.add_argument("-b", "--new"   , dest="new"   , type=str , help="path to the lazy file to compare", default = None, required = True)
+    parser.add_argument("-rt", "--rtol"   , dest="rtol"   , type=float , help="relative tolerance for the parameters and the spectra", default = 1e-12, required = False)
+    parser.add_argument("-emin", "--E_min"   , dest="E_min"   , type=float , help="lowest energy (keV) of the spectra", default = 0, required = False)
+    parser.add_argument("-emax", "--E_max"   , dest="E_max"   , type=float , help="highest energy (keV) of the spectra", default = 12e3, required = False)
+    parser.add_argument("-n", "--n_top"   , dest="n_top"   , type=int , help="number of nuclides with the largest impact on the total spectrum to show", default = 20, required = False)
+    parser.add_argument("-o", "--output"   , dest="output"   , type=str , help="path to a .csv file with the comparison of each nuclide", default = None, required = False)
+
+    args = parser.parse_args()
+
+    bu.log("Comparing "+args.new+" with "+args.reference,level=0)
+    start = time.perf_counter()
+    comparison = lazy_handler.LazyReader(args.reference).compare(args.new,rtol=args.rtol,E_min=args.E_min,E_max=args.E_max)
+    nuclides = comparison["nuclides"]
+    bu.log(str(len(nuclides["lazy_name"]))+" nuclides compared in "+"{:.2f}".format(time.perf_counter()-start)+" s",level=1)
+
+    bu.log("Nuclides:",level=0)
+    for label, mask in [("only in "+args.reference,~nuclides["in_other"]),("only in "+args.new,~nuclides["in_self"])]:
+        bu.log(str(np.sum(mask))+" "+label+(": "+", ".join(nuclides["lazy_name"][mask]) if 0 < np.sum(mask) <= 50 else ""),level=1)
+    changed = nuclides["in_self"] & nuclides["in_other"] & nuclides["spectrum_changed"]
+    bu.log(str(np.sum(changed))+" with a different spectrum, largest relative difference "+
+           "{:.2e}".format(np.max(nuclides["spectrum_max_rel"][changed],initial=0)),level=1)
+    bu.log(str(np.sum(nuclides["changed_parameters"] != ""))+" with different parameters",level=1)
+
+    if len(comparison["parameters"]) > 0:
+        bu.log("Parameters:",level=0)
+        for key, value in comparison["parameters"].items():
+            if value["only_in"] is not None:
+                bu.log(key+": only in "+(args.reference if value["only_in"] == "self" else args.new)+", "+str(value["n_changed"])+" nuclides",level=1)
+            else:
+                bu.log(key+": "+str(value["n_changed"])+" nuclides, max difference "+"{:.3e}".format(value["max_abs"])+
+                       " (relative "+"{:.2e}".format(value["max_rel"])+")",level=1)
+
+    bu.log("Total spectrum: max difference "+"{:.2e}".format(comparison["total_max_rel"])+" of its peak",level=0)
+    order = np.argsort(nuclides["total_impact"])[::-1][:args.n_top]
+    for i in order[nuclides["total_impact"][order] > 0]:
+        bu.log(bu.entry(nuclides["lazy_name"][i],10)+"{:.2e}".format(nuclides["total_impact"][i])+"   "+nuclides["changed_parameters"][i],level=1)
+
+    if args.output is not None:
+        pd.DataFrame(nuclides).to_csv(args.output,index=False)
+        bu.log("Comparison of each nuclide written in "+args.output,level=0)
+    bu.log("Done!",level=0)
+    return
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,33 @@
+#!/usr/bin/env python
+import argparse
+
+from base import base_utilities as bu
+from rw import lazy_handler
+from rw import storage
+
+
+def main():
+
+    usage='convertLazyFile.py -i /path/to/.lazy/file -o /path/to/output -b directory'
+    parser = argparse.ArgumentParser(description='Convert a .lazy file between the storage backends (HDF5 file or directory store)', usage=usage)
+
+    parser.add_argument("-i", "--input"   , dest="input"   , type=str , help="path to the lazy file to convert", default = None, required = True)
+    parser.add_argument("-o", "--output"   , dest="output"   , type=str , help="path to the converted lazy file", default = None, required = True)
+    parser.add_argument("-b", "--backend"   , dest="backend"   , type=str , help="backend of the converted file", default = "directory", choices=list(storage.BACKENDS.keys()), required = False)
+
+    args = parser.parse_args()
+
+    if storage.exists(args.output,backend=args.backend):
+        bu.log("Error: "+args.output+" already exists",level=0)
+        return
+
+    bu.log("Converting "+args.input+" into "+args.output+" ("+args.backend+")",level=0)
+    storage.convert(args.input,args.output,backend=args.backend)
+    LR = lazy_handler.LazyReader(args.output)
+    bu.log(str(len(LR.get_nuclides_list()))+" nuclides in "+args.output,level=1)
+    bu.log("Done!",level=0)
+    return
+
+
+if __name__ == "__main__":
+    main()
@@ -4,12 +4,16 @@ import argparse
 from os import listdir
 import periodictable
 import os
+import re
+import functools
 
 
 from base import base_utilities as bu
 from rw import endf_reader
 from rw import lazy_handler
 from process import wrappers
+from process.cache import ResultCache
+from process import pipeline
 
 def lazy_to_ensdf(list_of_names=None,dtype=".ensdf"):
 
@@ -127,6 +131,141 @@ def create_dict(z = None,a=None,m=0,nfile=None,
 
         
 
+def write_spectrum(LW,lazy_name,dizio,tag=None,Emax=None):
+    '''
+    Write the spectrum of a nuclide, its tag and its end-point energy in the .lazy file.
+    '''
+    LW.write_nuclide_data(nuclide_name = lazy_name,dtype="data",dictionary=dizio)
+    LW.write_nuclide_data(nuclide_name = lazy_name,dtype="info",vname="tag", vvalue = tag)
+    LW.write_nuclide_data(nuclide_name = lazy_name,dtype="info",vname="Emax", vvalue = Emax)
+    return
+
+
+def get_runner(CmdBEtashape,args):
+    '''
+    Return the function used to run betashape on a dictionary of jobs (see CmdBetaShape.evaluate_decays).
+    The worker processes are started here, once for all the stages.
+    '''
+    if args.runner == "async":
+        runner = wrappers.AsyncBetaShape(CmdBEtashape,max_running=args.n_workers,timeout=args.timeout,retries=args.retries)
+        return runner.evaluate_decays
+    CmdBEtashape.start_workers(args.n_workers)
+    return functools.partial(CmdBEtashape.evaluate_decays,n_workers=args.n_workers,timeout=args.timeout)
+
+
+def is_done(manifest,lazy_name,stage,input_hash):
+    '''
+    Check the manifest: True if the stage was completed for the nuclide with the same inputs, False if it
+    failed or its inputs changed, None if the manifest has no entry for it (e.g. file built without manifest).
+    '''
+    entry = manifest.get(lazy_name,{}).get(stage)
+    if entry is None:
+        return None
+    return (entry["state"] in ["done","empty"]) & (entry["hash"] == input_hash)
+
+
+def get_state(manifest,stage,lazy_name,input_hash):
+    '''
+    Compare the fingerprint of the inputs of a stage with the manifest: "new", "changed", "failed" or "unchanged".
+    '''
+    entry = manifest.get(lazy_name,{}).get(stage)
+    if entry is None:
+        return "new"
+    if entry["hash"] != input_hash:
+        return "changed"
+    if entry["state"] == "failed":
+        return "failed"
+    return "unchanged"
+
+
+def get_diff(manifest,stage,fingerprints):
+    '''
+    Compare the fingerprints of the inputs of a stage ({nuclide : hash}) with the manifest, log a summary and
+    return {nuclide : "new" | "changed" | "failed" | "unchanged"}.
+    '''
+    diff = {name : get_state(manifest,stage,name,input_hash) for name, input_hash in fingerprints.items()}
+    states = list(diff.values())
+    bu.log(stage+": "+", ".join([str(states.count(el))+" "+el for el in ["new","changed","failed","unchanged"]]),level=1)
+    return diff
+
+
+def in_range(lazy_name,a_range=None):
+    '''
+    True if the mass number of the nuclide (e.g. 95 for 95Sr, 90 for 90Rb_1m) is in a_range = (A_min, A_max), extremes included.
+    If a_range is None, every nuclide is accepted.
+    '''
+    if a_range is None:
+        return True
+    a = int(re.findall(r"\d+",lazy_name)[0])
+    return (a >= a_range[0]) & (a <= a_range[1])
+
+
+def read_text(fname):
+    '''
+    Return the content of a text file, or an empty string if it does not exist.
+    '''
+    if os.path.isfile(fname) is False:
+        return ""
+    with open(fname,"r",encoding="ISO-8859-1") as f:
+        return f.read()
+
+
+def write_result(LW,lazy_name,dizio,tag=None,stage=None,input_hash=""):
+    '''
+    Write the spectrum of a nuclide and record the stage as done in the manifest.
+    '''
+    write_spectrum(LW,lazy_name,dizio,tag=tag,Emax=np.max(dizio["transition_Emax"]))
+    LW.write_manifest(lazy_name,stage,"done",input_hash)
+    return
+
+
+def delete_spectrum(LW,lazy_name):
+    '''
+    Remove the spectrum of a nuclide, its tag and its end-point energy from the .lazy file.
+    '''
+    LW.delete_nuclide_data(lazy_name,dtype="data")
+    LW.delete_nuclide_data(lazy_name,dtype="info",vname="tag")
+    LW.delete_nuclide_data(lazy_name,dtype="info",vname="Emax")
+    return
+
+
+def get_converter(CmdBEtashape,LW,metastables=None,tag=None,stage=None,hashes=None,args=None):
+    '''
+    Return the function which turns the result of a betashape job into a task for the writer thread (see process.pipeline).
+    If metastables is None, the ground state (key 0) of the betashape output is used.
+    The outcome of each job is recorded in the manifest under *stage* with the input hash in *hashes*.
+    '''
+    def convert(lazy_name,res_diz,error):
+        input_hash = hashes[lazy_name]
+        if error is not None:
+            bu.log(str(lazy_name)+": betashape failed: "+repr(error),level=2)
+            return functools.partial(LW.write_manifest,lazy_name,stage,"failed",input_hash)
+        metastable = 0 if metastables is None else metastables[lazy_name]
+        if metastable not in res_diz.keys():
+            bu.log(str(lazy_name)+": no data found for the nuclide",level=2)
+            return functools.partial(LW.write_manifest,lazy_name,stage,"empty",input_hash)
+        res_list = res_diz[metastable]  #FIXME
+        dizio = CmdBEtashape.convert_output_into_dic(res_list,tipo=args.type,sparse=True)
+        bu.log(str(lazy_name)+": betashape done",level=2)
+        return functools.partial(write_result,LW,lazy_name,dizio,tag=tag,stage=stage,input_hash=input_hash)
+    return convert
+
+
+def run_pipeline(CmdBEtashape,LW,parse,convert,items,args):
+    '''
+    Run the parsers, betashape and the writer on *items* at the same time (see process.pipeline.BuildPipeline).
+    With the swmr option, the spectra are written in a SWMR session (see LazyWriter.start_swmr), so the file can be read meanwhile.
+    '''
+    bu.log("Processing "+str(len(items))+" nuclides with "+str(args.n_parsers)+" parsers and "+str(args.n_workers)+" betashape workers ("+args.runner+")...",level=1)
+    pipe = pipeline.BuildPipeline(parse=parse,evaluate_decays=get_runner(CmdBEtashape,args),convert=convert,
+                                  n_parsers=args.n_parsers,maxsize=args.queue_size,report_every=args.report_every)
+    if args.swmr == 0:
+        return pipe.run(items)
+    with LW.start_swmr(nuclides=items):
+        bu.log("SWMR session open: the spectra can be read while they are written",level=2)
+        return pipe.run(items)
+
+
 def main():
     
     usage='createLazyFile.py -lp /path/to/.lazy/file -jp /path/to/JEFF/file -esp /path/to/ensdf/folder -ep /path/to/ENDFB/file -bp /path/to/betashape/folder'
@@ -143,16 +282,47 @@ def main():
     parser.add_argument("-bc", "--betashape_config"   , dest="betashape_config"   , type=str , help="input parameters for betashape", default = "myEstep=1 nu=1", required = False)
     parser.add_argument("-fix", "--ensdf_fix"   , dest="fix"   , type=int , help="try to fix the missing/theoretical spectra", default = 1, required = False)
     parser.add_argument("-ovr", "--overwrite"   , dest="overwrite"   , type=int , help="overwrite existing data", default = 1, required = False)
+    parser.add_argument("-inc", "--incremental"   , dest="incremental"   , type=int , help="process only the nuclides whose input data changed since the last build", default = 0, required = False)
+    parser.add_argument("-nw", "--n_workers"   , dest="n_workers"   , type=int , help="number of betashape processes running in parallel", default = 1, required = False)
+    parser.add_argument("-to", "--timeout"   , dest="timeout"   , type=float , help="maximum time (s) for each betashape run", default = None, required = False)
+    parser.add_argument("-rn", "--runner"   , dest="runner"   , type=str , help="pool (process pool) or async (asyncio subprocesses)", default = "pool", choices=["pool","async"], required = False)
+    parser.add_argument("-rt", "--retries"   , dest="retries"   , type=int , help="number of retries for a betashape run which timed out (async runner only)", default = 2, required = False)
+    parser.add_argument("-np", "--n_parsers"   , dest="n_parsers"   , type=int , help="number of threads reading the input data while betashape runs", default = 2, required = False)
+    parser.add_argument("-qs", "--queue_size"   , dest="queue_size"   , type=int , help="maximum number of items waiting between two stages of the build", default = 64, required = False)
+    parser.add_argument("-re", "--report_every"   , dest="report_every"   , type=float , help="interval (s) between two reports on the progress of the build", default = 30, required = False)
+    parser.add_argument("-cp", "--cache_path"   , dest="cache_path"   , type=str , help="path to the folder where the betashape results are cached", default = None, required = False)
+    parser.add_argument("-cs", "--cache_size"   , dest="cache_size"   , type=float , help="maximum size (MB) of the betashape cache", default = 1024, required = False)
+    parser.add_argument("-ar", "--a_range"   , dest="a_range"   , type=str , help="process only the nuclides with mass number in A_min:A_max (sharded build, see mergeLazyShards.py)", default = None, required = False)
+    parser.add_argument("-sw", "--swmr"   , dest="swmr"   , type=int , help="write the spectra in a SWMR session, so the file can be read during the build (HDF5 only)", default = 0, required = False)
+    parser.add_argument("-fp", "--float_precision"   , dest="float_precision"   , type=int , help="precision (bits) of the stored spectra: 64 or 32 (half of the size)", default = 64, choices=[32,64], required = False)
     parser.add_argument("-t", "--type"   , dest="type"   , type=str , help="select data_beta for evaluating the electron spectra or data_nu for evaluating the neutrino spectra", default = "data_nu", required = False)
 
         
     args = parser.parse_args()    
     overwrite = bool(args.overwrite)
     fix = bool(args.fix)
+    incremental = bool(args.incremental)
+    if incremental is True:
+        overwrite = False
+    a_range = None
+    if args.a_range is not None:
+        a_range = [int(el) for el in args.a_range.split(":")]
+        bu.log("Sharded build: only the nuclides with "+str(a_range[0])+" <= A <= "+str(a_range[1])+" will be processed",level=0)
 
     
     
-    LW =lazy_handler.LazyWriter(fname=args.lazy)   
+    spectra_dtype = "float32" if args.float_precision == 32 else None
+    LW =lazy_handler.LazyWriter(fname=args.lazy,spectra_dtype=spectra_dtype)   
+    # settings of the betashape stages, part of the fingerprint of each nuclide: a rebuild with other settings (e.g. -fp)
+    # processes the nuclides again. The default float64 is left out, so the manifests written before -fp stay valid
+    settings = [args.betashape_config,args.beta_r,args.type]+([spectra_dtype] if spectra_dtype is not None else [])
+    LR =lazy_handler.LazyReader(args.lazy)  
+    
+    manifest = LR.get_manifest()
+    if (overwrite is False) & (len(manifest) > 0):
+        bu.log("Manifest found in "+args.lazy+": completed stages with unchanged inputs will be skipped",level=0)
+    if (incremental is True) & (len(manifest) == 0):
+        bu.log("No manifest found in "+args.lazy+": every nuclide will be processed",level=0)
     
     #Process the Jeff file
     if args.jeff is not None:
@@ -162,11 +332,26 @@ def main():
         
         if "0n" in diz_JEFF.keys(): #remove neutron data
             del diz_JEFF["0n"]
+        diz_JEFF = {key : value for key, value in diz_JEFF.items() if in_range(key,a_range)}
         bu.log(str(len(diz_JEFF.keys())) + " nuclides found with cfy greater than 0", level = 1)
         
+        fingerprints = {key : bu.get_hash(value) for key, value in diz_JEFF.items()}
+        get_diff(manifest,"cfy",fingerprints)
+        
+        if incremental is True:
+            removed = [key for key in manifest.keys() if ("cfy" in manifest[key]) & (key not in diz_JEFF) & in_range(key,a_range)]
+            bu.log(str(len(removed))+" nuclides are no longer in the jeff data, I will remove them", level = 1)
+            for key in removed:
+                LW.delete_nuclide_data(key)
+                LW.delete_manifest(key)
+        
         bu.log("Writing jeff data on " + args.lazy, level = 1)
         for key, value in diz_JEFF.items():
+            input_hash = fingerprints[key]
+            if (overwrite is False) & (is_done(manifest,key,"cfy",input_hash) is True):
+                continue
             LW.write_nuclide_data(nuclide_name=key,dtype="info",dictionary=value) 
+            LW.write_manifest(key,"cfy","done",input_hash)
         if args.jeff_r is not None:
             LW.set_general_info({"JEFF_release": args.jeff_r})
          
@@ -174,26 +359,34 @@ def main():
         
     else:
         bu.log("jeff path not given, I will assume cfy data are already present in "+args.lazy, level=0)
-     
-    LR =lazy_handler.LazyReader(args.lazy)  
     
     #Process the ENSDF file(s)
     if args.ensdf is not None:  
         bu.log("Processing the ensdf data in "+bu.fix_path(args.ensdf),level=0)
         lista, _ = get_ensdf_file(lname=args.lazy,ensdf_path=bu.fix_path(args.ensdf))
         diz_ensdf = {}
+        diz_text = {}
         R =endf_reader.EnsdfReader()
         
         for el in lista:
             nfile = bu.fix_path(args.ensdf)+el
             R.open_file(nfile)
             diz_ensdf.update(R.get_dict())   
+            diz_text.update(R.get_datasets())
+        diz_ensdf = {key : value for key, value in diz_ensdf.items() if in_range(key,a_range)}
         bu.log(str(len(diz_ensdf.keys())) + " nuclides with cfy > 0 have an associated ensdf file", level = 1)
         bu.log("I will save their Q and half-life data", level = 2)
         
+        fingerprints = {key : bu.get_hash(diz_text.get(key,""),value) for key, value in diz_ensdf.items()}
+        get_diff(manifest,"ensdf",fingerprints)
+        
         bu.log("Writing ensdf data on " + args.lazy, level = 1)
         for key, value in diz_ensdf.items():
+            input_hash = fingerprints[key]
+            if (overwrite is False) & (is_done(manifest,key,"ensdf",input_hash) is True):
+                continue
             LW.write_nuclide_data(nuclide_name=key,dtype="info",dictionary=value) 
+            LW.write_manifest(key,"ensdf","done",input_hash)
     else:
        bu.log("ensdf path not given, I will assume Q data are already present in "+args.lazy, level=0)  
        
@@ -213,6 +406,10 @@ def main():
         bu.log("Options: " +args.betashape_config,level=1)
         bu.log("Dummy output directory: " +CmdBEtashape._save_path,level=1)
         
+        if args.cache_path is not None:
+            CmdBEtashape.set_cache(ResultCache(args.cache_path,max_size=int(args.cache_size*2**20)),version=args.beta_r if args.beta_r != "" else None)
+            bu.log("Cache directory: " +args.cache_path,level=1)
+        
         Estep = float(args.betashape_config[args.betashape_config.find("myEstep=")+8:].split(" ")[0]) # in keV
         LW.set_general_info({"E_step": Estep})
         
@@ -232,61 +429,59 @@ def main():
         for el in periodictable.elements: 
             symbol_list.append(el.symbol)
                 
-        c = 1
-        cmax = len(LR.get_nuclides_list())   
-        for el in LR.get_nuclides_list():
-            bu.log("["+str(c)+"/"+str(cmax)+"] Processing " +str(el),level=1)
-            nuc =LR.get_nuclide(el)
-            
-
-            if ("dN_dE_tot" in nuc.keys()) & (overwrite is False): #FIXME
-                bu.log("Aldready processed, I will skip it", level=2)
-                c +=1
-                continue
-            
-            
+        infos = {key : value for key, value in LR.get_nuclides_info().items() if in_range(key,a_range)}
+        hashes = {}
+        
+        def parse_endf(el):
+            nuc = infos[el]
             if "z" not in nuc.keys():
-                bu.log("No cumulative fission yield found", level=2)
-                c +=1
-                continue
-                
+                bu.log(str(el)+": no cumulative fission yield found", level=2)
+                return []
             _,tag, data = ER.get_element(z=nuc["z"],a=nuc["n"]+nuc["z"],m=nuc["m"])
+            input_hash = bu.get_hash(data,*settings)
+            hashes[el] = input_hash
+
+            if overwrite is False:
+                done = is_done(manifest,el,"endf_b",input_hash)
+                if done is None: # no manifest entry, look at the data
+                    done = nuc["has_data"] #FIXME
+                if done is True:
+                    bu.log(str(el)+": aldready processed, I will skip it", level=2)
+                    return []
+            
+            tasks = []
+            if (incremental is True) & (get_state(manifest,"endf_b",el,input_hash) == "changed") & (nuc.get("tag") in ["endf_b","endf_b_c"]):
+                bu.log(str(el)+": the endf-B data changed, I will remove the old spectrum", level=2)
+                tasks.append(("write",el,functools.partial(delete_spectrum,LW,el)))
             
             if tag is None:
-                bu.log("No data was found in the database",level=2)
+                bu.log(str(el)+": no data was found in the database",level=2)
+                tasks.append(("write",el,functools.partial(LW.write_manifest,el,"endf_b","empty",input_hash)))
                 
             elif tag == "discreet":
-                bu.log("Running betashape...",level=2)
-                dic = create_dict(z=int(nuc["z"]),a=int(nuc["n"]+nuc["z"]),m=int(nuc["m"]),data=data,symbol_list=symbol_list,example_dic=example_dic)
-                res_diz = CmdBEtashape.evaluate_decay(dic,boptions=args.betashape_config)
-                
-                res_list = res_diz[0]  #FIXME
-                dizio = CmdBEtashape.convert_output_into_dic(res_list,tipo=args.type)
-                
-                bu.log("Writing data...",level=2)
-                LW.write_nuclide_data(nuclide_name = nuc["lazy_name"],dtype="data",dictionary=dizio)
-                LW.write_nuclide_data(nuclide_name = nuc["lazy_name"],dtype="info",vname="tag", vvalue = "endf_b")
-                LW.write_nuclide_data(nuclide_name = nuc["lazy_name"],dtype="info",vname="Emax", vvalue = np.max(dizio["transition_Emax"]))
+                bu.log(str(el)+": queued for betashape",level=2)
+                dic = create_dict(z=int(nuc["z"]),a=int(nuc["n"]+nuc["z"]),m=int(nuc["m"]),data=data,symbol_list=symbol_list,example_dic=dict(example_dic))
+                tasks.append(("job",el,{"dictionary":dic,"boptions":args.betashape_config}))
                                 
                 #salva i dati in continuo
 
             elif tag == "continuum":
-                bu.log("No experimental data, just theoretical calculation",level=2)
+                bu.log(str(el)+": no experimental data, just theoretical calculation",level=2)
                 energy = data[:,0].astype(float)*1e3 #in keV
                 nu_spectrum = np.interp(np.arange(0,energy[-1]+Estep,Estep),energy,data[:,2].astype(float))
                 dizio = {"dN_dE_tot" : nu_spectrum/(np.sum(nu_spectrum)*Estep),
                          "unc_dN_dE" : np.zeros(len(nu_spectrum)),
                          "transition_Emax" : energy[-1],
                          "dN_dE_tot_c" : nu_spectrum}
-                         
-                bu.log("Writing data...",level=2)
-                LW.write_nuclide_data(nuclide_name = nuc["lazy_name"],dtype="data",dictionary=dizio)
-                LW.write_nuclide_data(nuclide_name = nuc["lazy_name"],dtype="info",vname="tag", vvalue = "endf_b_c")
-                LW.write_nuclide_data(nuclide_name = nuc["lazy_name"],dtype="info",vname="Emax", vvalue = energy[-1])
-
+                tasks.append(("write",el,functools.partial(write_result,LW,el,dizio,tag="endf_b_c",stage="endf_b",input_hash=input_hash)))
+            return tasks
             
-            c+=1
+        convert = get_converter(CmdBEtashape,LW,metastables=None,tag="endf_b",stage="endf_b",hashes=hashes,args=args)
+        run_pipeline(CmdBEtashape,LW,parse_endf,convert,list(infos.keys()),args)
+        diff = get_diff(manifest,"endf_b",hashes)
+        endf_changed = [el for el, state in diff.items() if state == "changed"]
     else:
+        endf_changed = []
         bu.log("endf path not given. Neutrino spectra will not be evaluated", level=0)
          
 
@@ -298,70 +493,52 @@ def main():
             return
          
 
-        c = 1
-        cmax = len(LR.get_nuclides_list())   
-        
-        ensdf_lazy_names = lazy_to_ensdf(list_of_names=LR.get_nuclides_list())
+        infos = {key : value for key, value in LR.get_nuclides_info().items() if in_range(key,a_range)}
+        metastables = {}
+        hashes = {}
         
-        for el in LR.get_nuclides_list():
-            bu.log("["+str(c)+"/"+str(cmax)+"] Processing " +str(el),level=1)  
-            nuc =LR.get_nuclide(el)
-            
+        def parse_fix(el):
+            nuc = infos[el]
             if "z" not in nuc.keys():
-                bu.log("No cumulative fission yield found", level=2)
-                c +=1
-                continue
+                bu.log(str(el)+": no cumulative fission yield found", level=2)
+                return []
                 
+            ensdf_name = lazy_to_ensdf(list_of_names=[nuc["lazy_name"]])[0]
+            input_hash = bu.get_hash(read_text(args.ensdf + ensdf_name),*settings)
+            done = is_done(manifest,el,"ensdf-fix",input_hash)
+            if el in endf_changed: # the spectrum from endf-B may have changed, the fix must be evaluated again
+                done = False
+            if (overwrite is False) & (done is True):
+                bu.log(str(el)+": aldready processed, I will skip it", level=2)
+                hashes[el] = input_hash
+                return []
                 
-            
             if "tag" not in nuc.keys():
-                bu.log("Nu spectrum not found",level=2)
+                bu.log(str(el)+": nu spectrum not found",level=2)
                                                
-                if os.path.isfile(args.ensdf + lazy_to_ensdf(list_of_names=[nuc["lazy_name"]])[0]):
-                    bu.log("An ensdf may file exist!", level=3)
-                    res_diz =CmdBEtashape.evaluate_decay(ensdf_path=args.ensdf,ensdf_name=lazy_to_ensdf(list_of_names=[nuc["lazy_name"]])[0],boptions=args.betashape_config)
-                    metastable = int(nuc["m"])
-                    
-                    if metastable in res_diz.keys():                      
-                        res_list = res_diz[metastable]  #FIXME
-                        dizio = CmdBEtashape.convert_output_into_dic(res_list,tipo=args.type)
-                        bu.log("Writing data...",level=4)
-                        LW.write_nuclide_data(nuclide_name = nuc["lazy_name"],dtype="data",dictionary=dizio)
-                        LW.write_nuclide_data(nuclide_name = nuc["lazy_name"],dtype="info",vname="tag", vvalue = "ensdf") 
-                        LW.write_nuclide_data(nuclide_name = nuc["lazy_name"],dtype="info",vname="Emax", vvalue = np.max(dizio["transition_Emax"]))
-                    else:
-                        bu.log("No data found for the nuclide",level=3)   
-                    
-                else:
-                    bu.log("No ensdf file was found.", level=3)  
-                    
-            elif (nuc["tag"] == "ensdf") & (overwrite is False):
-                bu.log("Aldready processed, I will skip it", level=2)
-                c +=1
-                continue
+            elif nuc["tag"] == "ensdf":
+                if (overwrite is True) | (done is not False):
+                    bu.log(str(el)+": aldready processed, I will skip it", level=2)
+                    return []
+                bu.log(str(el)+": the ensdf data changed, I will process it again",level=2)
                 
             elif nuc["tag"] == "endf_b_c":                    
-                bu.log("Theoretical spectrum found, i will try to overwrite it with ensdf data",level=2) 
+                bu.log(str(el)+": theoretical spectrum found, i will try to overwrite it with ensdf data",level=2) 
+                
+            else:
+                return []
+                
+            hashes[el] = input_hash
+            if os.path.isfile(args.ensdf + ensdf_name):
+                bu.log(str(el)+": an ensdf may file exist! Queued for betashape", level=2)
+                metastables[el] = int(nuc["m"])
+                return [("job",el,{"ensdf_path":args.ensdf,"ensdf_name":ensdf_name,"boptions":args.betashape_config})]
+            bu.log(str(el)+": no ensdf file was found.", level=2)  
+            return [("write",el,functools.partial(LW.write_manifest,el,"ensdf-fix","empty",input_hash))]
                 
-                if os.path.isfile(args.ensdf + lazy_to_ensdf(list_of_names=[nuc["lazy_name"]])[0]):
-                    bu.log("An ensdf may file exist!", level=3)
-                    res_diz =CmdBEtashape.evaluate_decay(ensdf_path=args.ensdf,ensdf_name=lazy_to_ensdf(list_of_names=[nuc["lazy_name"]])[0],boptions=args.betashape_config)
-                    metastable = int(nuc["m"])
-                    
-                    if metastable in res_diz.keys():                      
-                        res_list = res_diz[metastable]  #FIXME
-                        dizio = CmdBEtashape.convert_output_into_dic(res_list,tipo=args.type)
-                        bu.log("Writing data...",level=4)
-                        LW.write_nuclide_data(nuclide_name = nuc["lazy_name"],dtype="data",dictionary=dizio)
-                        LW.write_nuclide_data(nuclide_name = nuc["lazy_name"],dtype="info",vname="tag", vvalue = "ensdf") 
-                        LW.write_nuclide_data(nuclide_name = nuc["lazy_name"],dtype="info",vname="Emax", vvalue = np.max(dizio["transition_Emax"]))
-                    else:
-                        bu.log("No data found for the nuclide",level=3)   
-                    
-                else:
-                    bu.log("No ensdf file was found.",level=3)       
-                    
-            c += 1   
+        convert = get_converter(CmdBEtashape,LW,metastables=metastables,tag="ensdf",stage="ensdf-fix",hashes=hashes,args=args)
+        run_pipeline(CmdBEtashape,LW,parse_fix,convert,list(infos.keys()),args)
+        get_diff(manifest,"ensdf-fix",hashes)
     else:
         bu.log("No fixing with ensdf data", level=0)  
     
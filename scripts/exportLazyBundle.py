@@ -0,0 +1,42 @@
+#!/usr/bin/env python
+import argparse
+import time
+
+from base import base_utilities as bu
+from rw import shared_spectra
+
+
+def main():
+
+    usage='exportLazyBundle.py -lp /path/to/.lazy/file -o /path/to/bundle'
+    parser = argparse.ArgumentParser(description='Export the spectra and the parameters of a .lazy file in a bundle of .npy files, memory-mapped at loading (see SharedSpectra.load)', usage=usage)
+
+    parser.add_argument("-lp", "--lazy_path"   , dest="lazy"   , type=str , help="path to the lazy file", default = None, required = True)
+    parser.add_argument("-o", "--output"   , dest="output"   , type=str , help="path to the bundle folder", default = None, required = True)
+    parser.add_argument("-emin", "--E_min"   , dest="E_min"   , type=float , help="lowest energy (keV) of the spectra", default = 0, required = False)
+    parser.add_argument("-emax", "--E_max"   , dest="E_max"   , type=float , help="highest energy (keV) of the spectra", default = 12e3, required = False)
+    parser.add_argument("-ub", "--unc_BR"   , dest="unc_BR"   , type=int , help="evaluate the uncertainties of the spectra with the uncertainties of the branching ratios", default = 1, required = False)
+    parser.add_argument("-du", "--default_unc"   , dest="default_unc"   , type=float , help="relative uncertainty used when it is unknown", default = 0.2, required = False)
+    parser.add_argument("-fn", "--force_normalization"   , dest="force_normalization"   , type=int , help="normalize the spectra", default = 1, required = False)
+    parser.add_argument("-tn", "--thr_norm"   , dest="thr_norm"   , type=float , help="normalize only the spectra with integral greater than thr_norm", default = 0.99, required = False)
+    parser.add_argument("-fp", "--float_precision"   , dest="float_precision"   , type=int , help="precision (bits) of the exported spectra: 64 or 32 (half of the size)", default = 64, choices=[32,64], required = False)
+
+    args = parser.parse_args()
+
+    bu.log("Exporting "+args.lazy+" to "+args.output,level=0)
+    start = time.perf_counter()
+    manifest = shared_spectra.SharedSpectra.export(args.lazy,args.output,E_min=args.E_min,E_max=args.E_max,unc_BR=bool(args.unc_BR),
+                                                   default_unc=args.default_unc,force_normalization=bool(args.force_normalization),thr_norm=args.thr_norm,
+                                                   dtype="float32" if args.float_precision == 32 else None)
+    bu.log(str(manifest["arrays"]["spectra"]["shape"][0])+" spectra, "+str(len(manifest["arrays"]))+" arrays written in "+
+           "{:.2f}".format(time.perf_counter()-start)+" s",level=1)
+
+    start = time.perf_counter()
+    shared_spectra.SharedSpectra.load(args.output).get_nu_spectra()
+    bu.log("Loading time: "+"{:.2f}".format((time.perf_counter()-start)*1e3)+" ms",level=1)
+    bu.log("Done!",level=0)
+    return
+
+
+if __name__ == "__main__":
+    main()
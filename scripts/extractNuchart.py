@@ -12,10 +12,11 @@ from base import base_utilities as bu
 from rw import lazy_handler
 import h5py
 from process import wrappers
+from process.client import HttpClient, ResponseCache
 import argparse
 from datetime import date
 
-def find_cumulative_fission_yield(parent_list = None):
+def find_cumulative_fission_yield(parent_list = None,client=None):
     '''
     find all the nuclides with a cumulative fission yield > 0
     '''
@@ -25,7 +26,7 @@ def find_cumulative_fission_yield(parent_list = None):
     variable_names = ["cumulative_thermal_fy","unc_ct","cumulative_fast_fy","unc_cf"]
     
     for parent in parent_list:
-        nuchart = wrappers.CmdNuChart()
+        nuchart = wrappers.CmdNuChart(client=client)
         nuchart.get_fission_yields(kind="cumulative",parent=parent)
         '''
         variable_names = ["cumulative_thermal_fy","unc_ct"]    
@@ -83,12 +84,12 @@ def find_cumulative_fission_yield(parent_list = None):
 
 
 
-def find_nuclide_beta(E_thr = None,nuclides_names=None,names_lcn=None,names=None):
+def find_nuclide_beta(E_thr = None,nuclides_names=None,names_lcn=None,names=None,client=None):
     '''
     find all the beta-decaying nuclides with a Q-value >= E_thr
     '''
     dictionary = {}
-    nuchart = wrappers.CmdNuChart()
+    nuchart = wrappers.CmdNuChart(client=client)
     nuchart.get_nu_chart()  #return the ground states
     
     atomic_mass = (nuchart.get_array("z")+nuchart.get_array("n")).astype(str)
@@ -123,27 +124,29 @@ def find_nuclide_beta(E_thr = None,nuclides_names=None,names_lcn=None,names=None
 def find_nuclide__meta_beta(E_thr = None,nuclides_names=None,
                             names_lcn1=None,names1=None,
                             names_lcn2=None,names2=None,
-                            verbose=True):
+                            verbose=True,client=None):
     '''
     find all the beta-decaying nuclides metastable with a Q-value >= E_thr
     '''
     dictionary = {}
-    nuchart = wrappers.CmdNuChart()
+    nuchart = wrappers.CmdNuChart(client=client)
 
     i_max = len(nuclides_names)
+    
+    #download the ground states and the levels of all the nuclides at the same time
+    queries = []
+    for name in nuclides_names:
+        queries.extend([nuchart.nu_chart_query(name[:-3]),nuchart.nuclear_levels_query(name[:-3])])
+    failed = nuchart.prefetch(list(dict.fromkeys(queries)))
+    if len(failed) > 0:
+        bu.log(str(len(failed))+" requests failed, they will be repeated one by one",level=1)
 
     for i in range(i_max):
         nuclide_name = nuclides_names[i][:-3] #delete the _nm for livechart compatibility
         if verbose is True:
             print("[",i+1,"/",i_max,"] ", nuclide_name, " |-> ", nuclides_names[i])
-        flag = True
-        while flag is True:
-            try:
-                nuchart.get_nu_chart(nuclide_name)
-                flag = False
-            except:
-                print("Waiting for server response...")
-                
+        nuchart.get_nu_chart(nuclide_name)
+
         #save the usual parameters for the metastable nuclide from the ground state
         temp = dict(zip(names1, nuchart.get_array(names_lcn1)[0]))
         temp["metastable"] = int(nuclides_names[i][-2])
@@ -152,14 +155,8 @@ def find_nuclide__meta_beta(E_thr = None,nuclides_names=None,
             continue
     
         #add the parameters for the metastable nuclide from the levels table
-        flag = True
-        while flag is True:
-            try:
-                nuchart.get_nuclear_levels(nuclide_name)
-                flag = False
-            except:
-                print("Waiting for server response...")
-                
+        nuchart.get_nuclear_levels(nuclide_name)
+
 
         # find the location of proper the energy shift for the corresponding metastable state 
         # |-> [pos_beta][temp["metastable"]])
@@ -196,6 +193,12 @@ def main():
     parser.add_argument("-n", "--name"    , dest="fname"    , type=str , help="name of the .lazy file (hdf5)"  , required = True)
     parser.add_argument("-c", "--config"    , dest="config"    , type=str , help="path to the .conf file"  , required = True) 
     parser.add_argument("-not", "--notes"    , dest="note"    , type=str , help="some notes"  , required = None, default = '') 
+    parser.add_argument("-nc", "--n_connections"    , dest="n_connections"    , type=int , help="maximum number of requests to the live-chart at the same time"  , required = False, default = 4) 
+    parser.add_argument("-rt", "--retries"    , dest="retries"    , type=int , help="number of retries for a failed request (exponential backoff)"  , required = False, default = 5) 
+    parser.add_argument("-cp", "--cache_path"    , dest="cache_path"    , type=str , help="path to the folder where the live-chart responses are cached"  , required = False, default = None) 
+    parser.add_argument("-ttl", "--cache_ttl"    , dest="cache_ttl"    , type=float , help="days after which a cached response is downloaded again"  , required = False, default = 30) 
+    parser.add_argument("-off", "--offline"    , dest="offline"    , type=int , help="use only the cached responses"  , required = False, default = 0) 
+    parser.add_argument("-b", "--backend"    , dest="backend"    , type=str , help="storage backend of the .lazy file: hdf5 or directory (directory store)"  , required = False, default = "hdf5", choices = ["hdf5","directory"]) 
     
     args = parser.parse_args()    
     
@@ -205,6 +208,15 @@ def main():
     
     save_path = bu.fix_path(args.save_path)
     
+    cache = None
+    if args.cache_path is not None:
+        cache = ResponseCache(args.cache_path,ttl=args.cache_ttl*86400)
+    elif bool(args.offline) is True:
+        bu.log("Error: the offline mode requires a cache path (-cp)",level=0)
+        return
+    client = HttpClient(wrappers.CmdNuChart.URL,max_connections=args.n_connections,retries=args.retries,
+                        cache=cache,offline=bool(args.offline))
+    
     E_thr = dic_config_file["E_thr"]
     name_to_save_lcn = ["qbm","unc_qb","z","n","symbol"]
     name_to_save = ["Q","unc_Q","z","n","symbol"]
@@ -221,7 +233,7 @@ def main():
            
     #========= Cumulative fission yield
     bu.log("Collecting the cumulative fission yield of 235u, 238u, 239Pu and 241 Pu...", level=0) 
-    dictionary = find_cumulative_fission_yield(parent_list = ["235u","238u","239Pu","241Pu"])
+    dictionary = find_cumulative_fission_yield(parent_list = ["235u","238u","239Pu","241Pu"],client=client)
     bu.log("Done!", level=1)
 
     dic_keys = np.array(list(dictionary.keys()))
@@ -234,7 +246,7 @@ def main():
     
     #========= B- non metastable
     bu.log("Collecting B- nuclides (non metastable) with Q >= "+ str(E_thr) + " [keV]...",level=0)
-    dictionary2 = find_nuclide_beta(E_thr = E_thr,nuclides_names=nuclides_names_non_meta,names_lcn=name_to_save_lcn,names=name_to_save)
+    dictionary2 = find_nuclide_beta(E_thr = E_thr,nuclides_names=nuclides_names_non_meta,names_lcn=name_to_save_lcn,names=name_to_save,client=client)
     nuclides_deleted2 = nuclides_names_non_meta[np.uint32(np.where(np.in1d(nuclides_names_non_meta,np.array(list(dictionary2.keys())),invert = True))[0])]
     bu.log("Done!",level=1)
     bu.log(str(len(nuclides_deleted2) )+ " nuclides (non metastable) previously found do not satisfy the required conditions.",level=2)
@@ -244,7 +256,7 @@ def main():
     bu.log("Collecting B- nuclides (metastable) with Q >= "+ str(E_thr) + " [keV]...",level=0)
     dictionary3 = find_nuclide__meta_beta(E_thr = E_thr,nuclides_names=nuclides_names_meta,
                         names_lcn1=name_to_save_lcn,names1=name_to_save,
-                        names_lcn2=name_to_save_meta_lcn,names2=name_to_save_meta)
+                        names_lcn2=name_to_save_meta_lcn,names2=name_to_save_meta,client=client)
     nuclides_deleted3 = nuclides_names_meta[np.uint32(np.where(np.in1d(nuclides_names_meta,np.array(list(dictionary3.keys())),invert = True))[0])]
     bu.log(str(len(nuclides_deleted3) )+ " nuclides (metastable) previously found do not satisfy the required conditions.",level=2)
         
@@ -281,7 +293,7 @@ def main():
 
     #========= Save the dictionary in a .lazy (hdf5) file
     bu.log("Saving the .lazy file in "+ save_path + "...",level=0)
-    writer = lazy_handler.LazyWriter(output_path=save_path,name=args.fname)
+    writer = lazy_handler.LazyWriter(output_path=save_path,name=args.fname,backend=args.backend)
     
     name_to_save.extend(name_to_save_meta)    
     name_to_save.extend(["metastable","ripl_shift"])
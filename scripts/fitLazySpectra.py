@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+import numpy as np
+import argparse
+import time
+
+from base import base_utilities as bu
+from rw import lazy_handler
+
+
+def main():
+
+    usage='fitLazySpectra.py -lp /path/to/.lazy/file'
+    parser = argparse.ArgumentParser(description='Store in the .lazy file a piecewise polynomial fit of the spectrum of each nuclide (see LazyReader.fit_spectrum and LazyReader.evaluate)', usage=usage)
+
+    parser.add_argument("-lp", "--lazy_path"   , dest="lazy"   , type=str , help="path to the lazy file", default = None, required = True)
+    parser.add_argument("-d", "--degree"   , dest="degree"   , type=int , help="degree of the polynomials", default = 3, required = False)
+    parser.add_argument("-t", "--tol"   , dest="tol"   , type=float , help="target accuracy, relative to the peak of each spectrum", default = 1e-4, required = False)
+    parser.add_argument("-w", "--max_width"   , dest="max_width"   , type=float , help="maximum width (keV) of the intervals before the refinement", default = 1000., required = False)
+
+    args = parser.parse_args()
+
+    LR = lazy_handler.LazyReader(args.lazy)
+    LW = lazy_handler.LazyWriter(fname=args.lazy)
+    names = LR.get_nuclides_list()
+
+    bu.log("Fitting the spectra of "+str(len(names))+" nuclides in "+args.lazy,level=0)
+    start = time.perf_counter()
+    errors = []
+    fitted_names = []
+    n_polynomials = 0
+    for name in names:
+        fit = LR.fit_spectrum(name=name,degree=args.degree,tol=args.tol,max_width=args.max_width)
+        if fit is None:
+            continue
+        LW.write_nuclide_data(nuclide_name=name,dtype="fit",dictionary=fit)
+        errors.append(fit["max_error"])
+        fitted_names.append(name)
+        n_polynomials += len(fit["coefficients"])
+    errors = np.array(errors)
+    bu.log(str(len(errors))+" spectra fitted in "+"{:.2f}".format(time.perf_counter()-start)+" s, "+
+           str(n_polynomials)+" polynomials of degree "+str(args.degree),level=1)
+    if len(errors) == 0:
+        return
+
+    bu.log("Accuracy (largest difference with the stored spectrum, relative to its peak):",level=0)
+    bu.log("median "+"{:.2e}".format(np.median(errors))+", max "+"{:.2e}".format(np.max(errors))+" ("+
+           fitted_names[np.argmax(errors)]+"), above the target: "+str(np.sum(errors > args.tol)),level=1)
+
+    energy, spectra, spectra_er, posOK, _ = LR.get_nu_spectra(unc_BR=False)
+    spectrum, _ = LR.get_total_spectrum(spectra=spectra,spectra_er=spectra_er,posOK=posOK)
+    start = time.perf_counter()
+    fitted = LR.evaluate(energy)
+    bu.log("total spectrum on "+str(len(energy))+" energies: max difference "+
+           "{:.2e}".format(np.max(np.abs(fitted-spectrum))/np.max(np.abs(spectrum),initial=1e-300))+
+           " of its peak, evaluated in "+"{:.2f}".format((time.perf_counter()-start)*1e3)+" ms",level=1)
+    bu.log("Done!",level=0)
+    return
+
+
+if __name__ == "__main__":
+    main()
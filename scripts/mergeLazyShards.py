@@ -0,0 +1,34 @@
+#!/usr/bin/env python
+import argparse
+
+from base import base_utilities as bu
+from rw import lazy_handler
+
+
+def main():
+
+    usage='mergeLazyShards.py -o /path/to/.lazy/file -i /path/to/shard1.lazy /path/to/shard2.lazy ...'
+    parser = argparse.ArgumentParser(description='Merge the .lazy files built on different slices of the nuclides (see the -ar option of createLazyFile.py)', usage=usage)
+
+    parser.add_argument("-o", "--output"   , dest="output"   , type=str , help="path to the merged lazy file", default = None, required = True)
+    parser.add_argument("-i", "--inputs"   , dest="inputs"   , type=str , nargs="+", help="paths to the shards", default = None, required = True)
+
+    args = parser.parse_args()
+
+    bu.log("Merging "+str(len(args.inputs))+" shards into "+args.output,level=0)
+    LW = lazy_handler.LazyWriter(fname=args.output)
+    conflicts = LW.merge(args.inputs)
+    if len(conflicts) > 0:
+        bu.log("Error: "+str(len(conflicts))+" conflicts found, nothing was written",level=0)
+        for el in conflicts:
+            bu.log(el,level=1)
+        return
+
+    LR = lazy_handler.LazyReader(args.output)
+    bu.log(str(len(LR.get_nuclides_list()))+" nuclides in "+args.output,level=1)
+    bu.log("Done!",level=0)
+    return
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,31 @@
+#!/usr/bin/env python
+import argparse
+import os
+
+from base import base_utilities as bu
+from rw import lazy_handler
+from rw import storage
+
+
+def main():
+
+    usage='overlayLazyFile.py -o /path/to/patch.lazy -b /path/to/base.lazy [/path/to/other_base.lazy ...]'
+    parser = argparse.ArgumentParser(description='Create (or refresh) a .lazy file layered on top of one or more base .lazy files, without copying them', usage=usage)
+
+    parser.add_argument("-o", "--output"   , dest="output"   , type=str , help="path to the overlay (HDF5)", default = None, required = True)
+    parser.add_argument("-b", "--bases"   , dest="bases"   , type=str , nargs="+", help="base lazy files, from the lowest to the topmost layer", default = None, required = True)
+
+    args = parser.parse_args()
+
+    bu.log("Layering "+args.output+" on top of "+", ".join(args.bases),level=0)
+    lazy_handler.LazyWriter(fname=args.output).create_overlay(args.bases)
+    sources = lazy_handler.LazyReader(args.output).get_sources()
+    for path in [args.output]+storage.get_bases(args.output)[::-1]:
+        count = len([el for el in sources.values() if os.path.abspath(el) == os.path.abspath(path)])
+        bu.log(str(count)+" nuclides from "+path,level=1)
+    bu.log("Done!",level=0)
+    return
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,45 @@
+#!/usr/bin/env python
+import argparse
+import time
+
+from base import base_utilities as bu
+from rw import spectrum_server
+
+
+def main():
+
+    usage='serveLazyFile.py -lp /path/to/.lazy/file -p 8765'
+    parser = argparse.ArgumentParser(description='Serve the total spectrum queries on a .lazy file held in memory (see SpectrumServer and SpectrumClient)', usage=usage)
+
+    parser.add_argument("-lp", "--lazy_path"   , dest="lazy"   , type=str , help="path to the lazy file", default = None, required = True)
+    parser.add_argument("-ho", "--host"   , dest="host"   , type=str , help="address of the server", default = "127.0.0.1", required = False)
+    parser.add_argument("-p", "--port"   , dest="port"   , type=int , help="port of the server", default = 8765, required = False)
+    parser.add_argument("-emin", "--E_min"   , dest="E_min"   , type=float , help="lowest energy (keV) of the spectra", default = 0, required = False)
+    parser.add_argument("-emax", "--E_max"   , dest="E_max"   , type=float , help="highest energy (keV) of the spectra", default = 12e3, required = False)
+    parser.add_argument("-ub", "--unc_BR"   , dest="unc_BR"   , type=int , help="evaluate the uncertainties of the spectra with the uncertainties of the branching ratios", default = 1, required = False)
+    parser.add_argument("-du", "--default_unc"   , dest="default_unc"   , type=float , help="relative uncertainty used when it is unknown", default = 0.2, required = False)
+    parser.add_argument("-fn", "--force_normalization"   , dest="force_normalization"   , type=int , help="normalize the spectra", default = 1, required = False)
+    parser.add_argument("-tn", "--thr_norm"   , dest="thr_norm"   , type=float , help="normalize only the spectra with integral greater than thr_norm", default = 0.99, required = False)
+
+    args = parser.parse_args()
+
+    bu.log("Loading "+args.lazy,level=0)
+    start = time.perf_counter()
+    database = spectrum_server.SpectrumDatabase(args.lazy,E_min=args.E_min,E_max=args.E_max,unc_BR=bool(args.unc_BR),default_unc=args.default_unc,
+                                                force_normalization=bool(args.force_normalization),thr_norm=args.thr_norm)
+    info = database.get_info()
+    bu.log(str(len(info["nuclides"]))+" spectra loaded in "+"{:.2f}".format(time.perf_counter()-start)+" s",level=1)
+
+    server = spectrum_server.SpectrumServer(database,host=args.host,port=args.port)
+    bu.log("Serving on "+server.get_url()+" (Ctrl-C to stop)",level=0)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
+    bu.log("Done!",level=0)
+    return
+
+
+if __name__ == "__main__":
+    main()
@@ -6,6 +6,7 @@
 import os, errno
 from operator import methodcaller
 import numpy as np
+import hashlib
 import string
 import uncertainties
 
@@ -106,6 +107,38 @@ def locate_word(array,word):
         i+=1
     return np.array(temp)
     
+def get_hash(*items):
+    '''
+    Return the SHA-256 hex digest of the items (str, numbers, None, numpy arrays, lists and dictionaries).
+    Dictionaries are hashed with sorted keys, so the result does not depend on the insertion order.
+    '''
+    h = hashlib.sha256()
+    for item in items:
+        _update_hash(h,item)
+    return h.hexdigest()
+    
+def _update_hash(h,item):
+    if isinstance(item,dict):
+        h.update(b"d")
+        for key in sorted(item.keys(),key=str):
+            _update_hash(h,key)
+            _update_hash(h,item[key])
+    elif isinstance(item,(list,tuple)):
+        h.update(b"l"+str(len(item)).encode())
+        for el in item:
+            _update_hash(h,el)
+    elif isinstance(item,np.ndarray):
+        if item.dtype == "O":
+            item = item.astype(str)
+        item = np.ascontiguousarray(item)
+        h.update(b"a"+item.dtype.str.encode()+str(item.shape).encode()+item.tobytes())
+    elif isinstance(item,bytes):
+        h.update(b"b"+item)
+    else:
+        h.update(b"s"+str(item).encode("utf-8",errors="replace"))
+    h.update(b"\0")
+    return
+    
 def merge_dictionaries(dic1,dic2,keys=None):
     '''
     dic1 and dic2 are dictionaries of dictionary.
@@ -118,7 +151,89 @@ def merge_dictionaries(dic1,dic2,keys=None):
     for k in keys:
         dic3[k] = {**dic3[k] , **dic2[k]}
     return dic3
-    
+
+def to_ragged(rows):
+    '''
+    Ragged (CSR-like) representation of a list of 1D arrays with different lengths:
+    the concatenated values and the offsets (len(rows)+1), so that rows[i] = values[offsets[i]:offsets[i+1]].
+    '''
+    lengths = np.array([len(el) for el in rows],dtype=np.int64)
+    offsets = np.concatenate([[0],np.cumsum(lengths)]).astype(np.int64)
+    values = np.concatenate([np.asarray(el,dtype=float) for el in rows]) if len(rows) > 0 else np.zeros(0)
+    return values, offsets
+
+def ragged_indices(offsets):
+    '''
+    Row and column of each value of a ragged array (see to_ragged).
+    '''
+    lengths = np.diff(offsets)
+    rows = np.repeat(np.arange(len(lengths)),lengths)
+    return rows, np.arange(offsets[-1]) - np.repeat(offsets[:-1],lengths)
+
+def ragged_to_dense(values,offsets,lenght=None):
+    '''
+    Zero-padded matrix (one row for each row of the ragged array, lenght columns).
+    If lenght is None, the length of the longest row is used.
+    '''
+    rows, columns = ragged_indices(offsets)
+    if lenght is None:
+        lenght = int(np.max(np.diff(offsets),initial=0))
+    dense = np.zeros((len(offsets)-1,lenght))
+    keep = columns < lenght
+    dense[rows[keep],columns[keep]] = values[keep]
+    return dense
+
+def ragged_sum(values,offsets,lenght=None):
+    '''
+    Sum of the rows of a ragged array (see to_ragged), as np.sum(ragged_to_dense(values,offsets,lenght),axis=0).
+    '''
+    _, columns = ragged_indices(offsets)
+    if lenght is None:
+        lenght = int(np.max(np.diff(offsets),initial=0))
+    keep = columns < lenght
+    return np.bincount(columns[keep],weights=values[keep],minlength=lenght)
+
+def _locate(x,breakpoints):
+    '''
+    Interval [breakpoints[k],breakpoints[k+1]) of each x, the local variable u in [-1,1) and the mask of the x inside the breakpoints.
+    '''
+    segment = np.searchsorted(breakpoints,x,side="right")-1
+    inside = (segment >= 0) & (segment < len(breakpoints)-1)
+    segment = np.clip(segment,0,max(len(breakpoints)-2,0))
+    if len(breakpoints) < 2:
+        return segment, np.zeros(np.shape(x)), inside
+    left = breakpoints[segment]
+    u = 2*(x-left)/(breakpoints[segment+1]-left)-1
+    return segment, u, inside
+
+def fit_piecewise_polynomial(x,y,breakpoints,degree=3):
+    '''
+    Least squares fit of y(x) with a polynomial of the given degree in each interval [breakpoints[k],breakpoints[k+1])
+    (breakpoints strictly increasing). The polynomials are written in the local variable
+    u = 2*(x-breakpoints[k])/(breakpoints[k+1]-breakpoints[k])-1, coefficients[k,j] multiplying u**j.
+    The points outside the breakpoints are ignored; an interval with no points gets a null polynomial.
+    '''
+    n = max(len(breakpoints)-1,0)
+    segment, u, inside = _locate(np.asarray(x,dtype=float),breakpoints)
+    segment, u, y = segment[inside], u[inside], np.asarray(y,dtype=float)[inside]
+    moments = np.array([np.bincount(segment,weights=u**p,minlength=n) for p in range(2*degree+1)]).T.reshape(n,2*degree+1)
+    powers = np.add.outer(np.arange(degree+1),np.arange(degree+1))
+    rhs = np.array([np.bincount(segment,weights=y*u**p,minlength=n) for p in range(degree+1)]).T.reshape(n,degree+1)
+    # normal equations of each interval, pinv for the intervals with less than degree+1 points
+    return np.einsum("kij,kj->ki",np.linalg.pinv(moments[:,powers]),rhs)
+
+def evaluate_piecewise_polynomial(x,breakpoints,coefficients):
+    '''
+    Value at x of the piecewise polynomial (see fit_piecewise_polynomial), 0 outside the breakpoints.
+    '''
+    segment, u, inside = _locate(np.asarray(x,dtype=float),breakpoints)
+    if len(breakpoints) < 2:
+        return np.zeros(np.shape(x))
+    value = coefficients[segment,-1]
+    for j in range(coefficients.shape[1]-2,-1,-1):
+        value = value*u + coefficients[segment,j]
+    return np.where(inside,value,0.)
+
 def log(message='',level=1):
     out = '|'+level*2*'-'
     if level==-1:
@@ -127,7 +242,7 @@ def log(message='',level=1):
         out +=' '+ message
     if level == 0:
         out = message
-    print(out)
+    print(out+"\n",end="") # single write, so lines logged by different threads are not mixed
     return
 
 
@@ -0,0 +1,146 @@
+'''
+ Desc  : On-disk cache for the Betashape results
+ Author: Matteo Borghesi <matteo.borghesi@mib.infn.it>
+'''
+
+import numpy as np
+import hashlib
+import tempfile
+import time
+import os
+
+
+class ResultCache(object):
+    '''
+    Content-addressed cache for the output of CmdBetaShape.evaluate_decay.
+    Each entry is a compressed .npz file named after the hash of the Betashape input, options and version.
+    Only the successful runs are stored (see CmdBetaShape.evaluate_decay), and never an empty output.
+    When the cache exceeds *max_size* (bytes), the least recently used entries are removed. The size is scanned once
+    and then estimated from the entries written by this instance: the entries of other processes are counted at the
+    next scan, when the estimate exceeds max_size.
+
+    '''
+
+    TMP_AGE = 3600 # seconds after which a temporary file is left over by a killed writer
+
+    def __init__(self,path=None,max_size=2**30):
+        self._path = path
+        self._max_size = max_size
+        self._size = None # estimated size of the cache, None before the first scan
+        os.makedirs(self._path,exist_ok=True)
+
+    def get_path(self):
+        return self._path
+
+    def get_key(self,input_text="",options="",version=""):
+        '''
+        Return the key of an entry given the text of the Betashape input file, the Betashape options and its version.
+        '''
+        options = " ".join(options.split())
+        text = "\0".join([input_text,options,str(version)])
+        return hashlib.sha256(text.encode("utf-8",errors="replace")).hexdigest()
+
+    def __file(self,key):
+        return os.path.join(self._path,key+".npz")
+
+    def get(self,key):
+        '''
+        Return the cached output_dir (see CmdBetaShape.evaluate_decay) or None if key is not present.
+        '''
+        fname = self.__file(key)
+        try:
+            with np.load(fname,allow_pickle=False) as f:
+                arrays = {name: f[name] for name in f.files}
+        except (OSError,ValueError):
+            return None
+        try:
+            os.utime(fname) # mark as recently used
+        except OSError: # removed meanwhile by another worker (see evict)
+            pass
+        return self.__unpack(arrays)
+
+    def put(self,key,output_dir):
+        '''
+        Store output_dir. The file is written in a temporary file and then renamed, so concurrent
+        workers never see a partial entry. An empty output (no transitions) is not stored.
+        '''
+        if sum([len(el) for el in output_dir.values()]) == 0:
+            return
+        fd, temp = tempfile.mkstemp(dir=self._path,suffix=".tmp")
+        try:
+            with os.fdopen(fd,"wb") as f:
+                np.savez_compressed(f,**self.__pack(output_dir))
+                size = f.tell()
+            os.replace(temp,self.__file(key))
+        except BaseException:
+            os.remove(temp)
+            raise
+        if (self._size is None) or (self._size+size > self._max_size):
+            self.evict()
+        else:
+            self._size += size
+        return
+
+    def evict(self):
+        '''
+        Remove the least recently used entries until the cache size is below max_size (and the temporary files
+        older than TMP_AGE).
+        '''
+        entries = []
+        now = time.time()
+        for el in os.scandir(self._path):
+            try:
+                stat = el.stat()
+                if el.name.endswith(".npz"):
+                    entries.append((stat.st_mtime,stat.st_size,el.path))
+                elif el.name.endswith(".tmp") and (now-stat.st_mtime > self.TMP_AGE):
+                    os.remove(el.path)
+            except FileNotFoundError: # removed meanwhile by another worker
+                pass
+        entries.sort()
+        size = sum([el[1] for el in entries])
+        for _, fsize, fname in entries:
+            if size <= self._max_size:
+                break
+            try:
+                os.remove(fname)
+            except FileNotFoundError:
+                pass
+            size -= fsize
+        self._size = size
+        return
+
+    def clear(self):
+        for el in os.scandir(self._path):
+            if el.name.endswith(".npz"):
+                os.remove(el.path)
+        self._size = 0
+        return
+
+    def __pack(self,output_dir):
+        arrays = {}
+        for meta, output_list in output_dir.items():
+            arrays[str(meta)+"/n"] = np.array(len(output_list))
+            for i, dic in enumerate(output_list):
+                prefix = str(meta)+"/"+str(i)+"/"
+                arrays[prefix+"label"] = np.array(dic["label"],dtype=str)
+                arrays[prefix+"data_beta"] = dic["data_beta"]
+                arrays[prefix+"data_nu"] = dic["data_nu"]
+                arrays[prefix+"output_message"] = np.array(dic["output_message"],dtype=str)
+        return arrays
+
+    def __unpack(self,arrays):
+        output_dir = {}
+        for name in arrays.keys():
+            if name.endswith("/n") is False:
+                continue
+            meta = name[:-2]
+            output_list = []
+            for i in range(int(arrays[name])):
+                prefix = meta+"/"+str(i)+"/"
+                output_list.append({"label" : arrays[prefix+"label"].tolist(),
+                                    "data_beta" : arrays[prefix+"data_beta"],
+                                    "data_nu" : arrays[prefix+"data_nu"],
+                                    "output_message" : arrays[prefix+"output_message"].tolist()})
+            output_dir[int(meta)] = output_list
+        return output_dir
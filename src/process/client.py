@@ -0,0 +1,197 @@
+'''
+ Desc  : HTTP client with connection pooling, retries and on-disk cache (used by CmdNuChart)
+ Author: Matteo Borghesi <matteo.borghesi@mib.infn.it>
+'''
+
+import http.client
+import urllib.parse
+import urllib.error
+import hashlib
+import tempfile
+import threading
+import random
+import queue
+import time
+import os
+from concurrent import futures
+
+
+class ResponseCache(object):
+    '''
+    On-disk cache of the HTTP responses, one file for each url (named after its hash), in *path* (by default
+    ~/.cache/renshape/http). An entry older than *ttl* seconds is considered expired. If ttl is None, the entries
+    never expire.
+
+    '''
+
+    PATH = os.path.join(os.path.expanduser("~"),".cache","renshape","http")
+
+    def __init__(self,path=PATH,ttl=None):
+        self._path = path
+        self._ttl = ttl
+        os.makedirs(self._path,exist_ok=True)
+
+    def get_path(self):
+        return self._path
+
+    def __file(self,url):
+        return os.path.join(self._path,hashlib.sha256(url.encode("utf-8")).hexdigest()+".txt")
+
+    def get(self,url,expired=False):
+        '''
+        Return the cached response for url, or None if it is not present (or expired, unless expired is True).
+        '''
+        fname = self.__file(url)
+        try:
+            if (expired is False) and (self._ttl is not None) and (time.time()-os.path.getmtime(fname) > self._ttl):
+                return None
+            with open(fname,"r",encoding="utf-8") as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def put(self,url,text):
+        '''
+        Store the response. The file is written in a temporary file and then renamed, so concurrent
+        threads never see a partial entry.
+        '''
+        fd, temp = tempfile.mkstemp(dir=self._path,suffix=".tmp")
+        with os.fdopen(fd,"w",encoding="utf-8") as f:
+            f.write(text)
+        os.replace(temp,self.__file(url))
+        return
+
+    def clear(self):
+        for el in os.scandir(self._path):
+            if el.name.endswith(".txt"):
+                os.remove(el.path)
+        return
+
+
+class HttpClient(object):
+    '''
+    Minimal HTTP(S) client for GET requests returning text.
+    The connections are kept alive and reused (at most *max_connections* at the same time), the failed requests
+    (network errors, HTTP 429 and 5xx) are repeated up to *retries* times with an exponential backoff, and the
+    responses can be stored in a ResponseCache. In offline mode, only the cache is used.
+
+    '''
+
+    RETRY_STATUS = [429,500,502,503,504]
+
+    def __init__(self,url="",max_connections=4,retries=5,backoff=1.,max_backoff=60.,timeout=60.,cache=None,offline=False,
+                 headers={'User-Agent': 'Mozilla/5.0 (X11; Ubuntu; Linux x86_64; rv:77.0) Gecko/20100101 Firefox/77.0'}):
+        self._url = url
+        self._max_connections = max_connections
+        self._retries = retries
+        self._backoff = backoff
+        self._max_backoff = max_backoff
+        self._timeout = timeout
+        self._cache = cache
+        self._offline = offline
+        self._headers = dict(headers)
+        self._pool = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(max_connections)
+
+    def set_cache(self,cache=None,offline=False):
+        '''
+        Set the response cache (a ResponseCache or a path) and the offline mode.
+        '''
+        if isinstance(cache,str):
+            cache = ResponseCache(cache)
+        self._cache = cache
+        self._offline = offline
+        return
+
+    def close(self):
+        '''
+        Close the idle connections.
+        '''
+        while True:
+            try:
+                self._pool.get_nowait().close()
+            except queue.Empty:
+                return
+
+    def __connection(self,parts):
+        try:
+            while True:
+                conn = self._pool.get_nowait()
+                if (conn.host, conn.port) == (parts.hostname, parts.port or conn.default_port):
+                    return conn
+                conn.close()
+        except queue.Empty:
+            pass
+        if parts.scheme == "https":
+            return http.client.HTTPSConnection(parts.hostname,parts.port,timeout=self._timeout)
+        return http.client.HTTPConnection(parts.hostname,parts.port,timeout=self._timeout)
+
+    def __request(self,url):
+        parts = urllib.parse.urlsplit(url)
+        target = parts.path+("?"+parts.query if parts.query != "" else "")
+        with self._slots:
+            conn = self.__connection(parts)
+            try:
+                conn.request("GET",target,headers=self._headers)
+                response = conn.getresponse()
+                body = response.read()
+            except Exception:
+                conn.close()
+                raise
+            if response.will_close:
+                conn.close()
+            else:
+                self._pool.put(conn)
+        if response.status != 200:
+            raise urllib.error.HTTPError(url,response.status,response.reason,response.headers,None)
+        return body.decode(response.headers.get_content_charset() or "utf-8")
+
+    def __delay(self,attempt,error):
+        if isinstance(error,urllib.error.HTTPError) and (error.headers is not None):
+            retry_after = error.headers.get("Retry-After","")
+            if retry_after.isdigit():
+                return min(float(retry_after),self._max_backoff)
+        return min(self._backoff*2**attempt,self._max_backoff)*(0.5+random.random()/2)
+
+    def get(self,query=""):
+        '''
+        Return the response (text) for the url + query.
+        ConnectionError is raised in offline mode if the response is not in the cache.
+        '''
+        url = self._url+query
+        if self._cache is not None:
+            text = self._cache.get(url,expired=self._offline)
+            if text is not None:
+                return text
+        if self._offline is True:
+            raise ConnectionError("offline mode: "+url+" is not in the cache")
+
+        attempt = 0
+        while True:
+            try:
+                text = self.__request(url)
+                break
+            except (OSError,http.client.HTTPException) as error:
+                retry = (not isinstance(error,urllib.error.HTTPError)) or (error.code in self.RETRY_STATUS)
+                if (retry is False) or (attempt >= self._retries):
+                    raise
+                time.sleep(self.__delay(attempt,error))
+                attempt += 1
+        if self._cache is not None:
+            self._cache.put(url,text)
+        return text
+
+    def get_many(self,queries=None):
+        '''
+        Return the responses for a list of queries, downloaded with at most max_connections requests at the same time.
+        The list has the same order of queries. If a request failed, the raised exception is in its place.
+        '''
+        with futures.ThreadPoolExecutor(max_workers=self._max_connections) as pool:
+            jobs = [pool.submit(self.get,query) for query in queries]
+        results = []
+        for job in jobs:
+            try:
+                results.append(job.result())
+            except Exception as error:
+                results.append(error)
+        return results
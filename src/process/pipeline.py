@@ -0,0 +1,175 @@
+'''
+ Desc  : Producer/consumer pipeline for the build of the .lazy files
+ Author: Matteo Borghesi <matteo.borghesi@mib.infn.it>
+'''
+
+import threading
+import queue
+import time
+from base import base_utilities as bu
+
+
+class BuildPipeline(object):
+    '''
+    Overlap the stages of a build: parser threads -> Betashape runner -> a single writer thread.
+    The stages are connected by bounded queues, so a slow stage blocks the ones before it instead of
+    filling the memory.
+
+    parse(item) is called by *n_parsers* threads and returns a list of tasks:
+        ("job", key, kwargs)  : a Betashape job, sent to the runner;
+        ("write", key, func)  : func() is executed by the writer thread.
+    evaluate_decays(jobs) is the Betashape runner (see CmdBetaShape.evaluate_decays and AsyncBetaShape.evaluate_decays):
+    it receives an iterable of (key, kwargs) and yields (key, output_dir, error).
+    convert(key, output_dir, error) runs in the calling thread and returns a function for the writer thread (or None).
+
+    Only the writer thread must access the output file: since h5py cannot open the same file for reading and writing
+    at the same time, parse should work on data read before the pipeline starts.
+
+    '''
+
+    STAGES = ["parse","betashape","write"]
+
+    def __init__(self,parse=None,evaluate_decays=None,convert=None,n_parsers=1,maxsize=64,report_every=30):
+        self._parse = parse
+        self._evaluate_decays = evaluate_decays
+        self._convert = convert
+        self._n_parsers = n_parsers
+        self._maxsize = maxsize
+        self._report_every = report_every
+        self._lock = threading.Lock()
+        self.__reset()
+
+    def __reset(self):
+        self._items = queue.Queue()
+        self._jobs = queue.Queue(maxsize=self._maxsize)
+        self._writes = queue.Queue(maxsize=self._maxsize)
+        self._stop = threading.Event()
+        self._stats = {stage : {"n" : 0, "errors" : 0, "busy" : 0.} for stage in self.STAGES}
+        self._max_depth = {"jobs" : 0, "writes" : 0}
+        self._start = None
+
+    def get_stats(self):
+        '''
+        Return {stage : {"n", "errors", "busy", "rate"}} and the maximum depth of the queues.
+        "busy" is the time (s) spent in the stage summed over its threads, "rate" the processed items per second.
+        '''
+        elapsed = max(time.time()-self._start,1e-9) if self._start is not None else 1e-9
+        stats = {}
+        with self._lock:
+            for stage, value in self._stats.items():
+                stats[stage] = dict(value,rate=value["n"]/elapsed)
+            stats["max_depth"] = dict(self._max_depth)
+        stats["elapsed"] = elapsed
+        return stats
+
+    def __count(self,stage,start,error=False):
+        with self._lock:
+            self._stats[stage]["n"] += 1
+            self._stats[stage]["busy"] += time.time()-start
+            if error is True:
+                self._stats[stage]["errors"] += 1
+
+    def __put(self,name,q,item):
+        q.put(item)
+        with self._lock:
+            self._max_depth[name] = max(self._max_depth[name],q.qsize())
+
+    def __parser(self):
+        while True:
+            item = self._items.get()
+            if item is None:
+                return
+            start = time.time()
+            try:
+                tasks = self._parse(item)
+            except Exception as error:
+                bu.log("Error while parsing "+str(item)+": "+repr(error),level=2)
+                self.__count("parse",start,error=True)
+                continue
+            self.__count("parse",start)
+            for kind, key, value in tasks:
+                if kind == "job":
+                    self.__put("jobs",self._jobs,(key,value))
+                else:
+                    self.__put("writes",self._writes,(key,value))
+
+    def __writer(self):
+        while True:
+            task = self._writes.get()
+            if task is None:
+                return
+            key, func = task
+            start = time.time()
+            try:
+                func()
+            except Exception as error:
+                bu.log("Error while writing "+str(key)+": "+repr(error),level=2)
+                self.__count("write",start,error=True)
+                continue
+            self.__count("write",start)
+
+    def __close_jobs(self,parsers):
+        for thread in parsers:
+            thread.join()
+        self._jobs.put(None)
+
+    def __get_jobs(self):
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                return
+            yield job
+
+    def __monitor(self):
+        while self._stop.wait(self._report_every) is False:
+            self.report(level=2)
+
+    def report(self,level=1):
+        '''
+        Log the throughput of each stage and the current depth of the queues.
+        '''
+        stats = self.get_stats()
+        text = " | ".join([stage+": "+str(stats[stage]["n"])+" ("+str(round(stats[stage]["rate"],2))+"/s)" for stage in self.STAGES])
+        text += " | queued jobs: "+str(self._jobs.qsize())+", queued writes: "+str(self._writes.qsize())
+        bu.log(text,level=level)
+
+    def run(self,items=None):
+        '''
+        Process *items* and return the statistics of the run (see get_stats).
+        '''
+        self.__reset()
+        self._start = time.time()
+        for item in items:
+            self._items.put(item)
+        for i in range(self._n_parsers):
+            self._items.put(None)
+
+        parsers = [threading.Thread(target=self.__parser,daemon=True) for i in range(self._n_parsers)]
+        writer = threading.Thread(target=self.__writer,daemon=True)
+        closer = threading.Thread(target=self.__close_jobs,args=(parsers,),daemon=True)
+        monitor = threading.Thread(target=self.__monitor,daemon=True)
+        for thread in parsers+[writer,closer,monitor]:
+            thread.start()
+
+        try:
+            start = time.time()
+            for key, output_dir, error in self._evaluate_decays(self.__get_jobs()):
+                func = self._convert(key,output_dir,error)
+                self.__count("betashape",start,error=error is not None) # time spent waiting for the runner and converting
+                if func is not None:
+                    self.__put("writes",self._writes,(key,func))
+                start = time.time()
+            closer.join()
+        finally:
+            self._writes.put(None)
+            writer.join()
+            self._stop.set()
+            monitor.join()
+
+        stats = self.get_stats()
+        for stage in self.STAGES:
+            bu.log(stage+": "+str(stats[stage]["n"])+" items, "+str(stats[stage]["errors"])+" errors, "+
+                   str(round(stats[stage]["busy"],2))+" s busy, "+str(round(stats[stage]["rate"],2))+" items/s",level=1)
+        bu.log("maximum queue depth: "+str(stats["max_depth"]["jobs"])+" jobs, "+str(stats["max_depth"]["writes"])+" writes ("+
+               str(round(stats["elapsed"],2))+" s in total)",level=1)
+        return stats
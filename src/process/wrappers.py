@@ -7,13 +7,23 @@ import warnings
 warnings.filterwarnings('ignore') #FIXME
 
 import pandas as pd
-import urllib.request
+import io
 import numpy as np
 from base import base_utilities as bu 
+from process.cache import ResultCache
+from process.client import HttpClient
 from os import listdir
 import subprocess
 import os
 import re
+import shutil
+import tempfile
+import asyncio
+import threading
+import queue
+import multiprocessing
+import time
+from concurrent import futures
 
 
 
@@ -24,30 +34,70 @@ class CmdNuChart(object):
     
     '''
     
-    def __init__(self,http="https://nds.iaea.org/relnsd/v0/data?"):
+    URL = "https://nds.iaea.org/relnsd/v0/data?"
+    
+    def __init__(self,http=URL,client=None):
         self._url = http
         self._df = None
+        self._columns = {}
+        self._non_empty = {}
+        self._prefetched = {}
+        self.set_client(client)
+        
+    def set_client(self,client=None):
+        '''
+        Set the HttpClient used for the requests (e.g. with a ResponseCache or in offline mode). If None, a new
+        default client of the url of the wrapper.
+        '''
+        self._client = HttpClient(self._url) if client is None else client
+        return
+        
+    def get_client(self):
+        return self._client
         
-    def _return_csv(self,url):
-        req = urllib.request.Request(url)
-        req.add_header('User-Agent', 'Mozilla/5.0 (X11; Ubuntu; Linux x86_64; rv:77.0) Gecko/20100101 Firefox/77.0')
-        self._df = pd.read_csv(urllib.request.urlopen(req))
+    def _return_csv(self,query):
+        text = self._prefetched.pop(query,None)
+        if text is None:
+            text = self._client.get(query)
+        self._df = pd.read_csv(io.StringIO(text))
+        self._columns = {}
+        self._non_empty = {}
         return
     
     def get_df(self):
         return self._df
     
     def _ask_df(self,url):
-        url = self._url + url
         self._return_csv(url)
         return
+        
+    def prefetch(self,queries=None):
+        '''
+        Download the responses of several queries at the same time (see HttpClient.get_many). They are kept in
+        memory and used, only once, by the next requests with the same query. Return the queries which failed.
+        '''
+        failed = []
+        for query, text in zip(queries,self._client.get_many(queries)):
+            if isinstance(text,Exception):
+                failed.append(query)
+            else:
+                self._prefetched[query] = text
+        return failed
+        
+    @staticmethod
+    def nu_chart_query(nuclide="all"):
+        return "fields=ground_states&nuclides="+nuclide
+        
+    @staticmethod
+    def nuclear_levels_query(nuclide=None):
+        return "fields=levels&nuclides="+nuclide
 
     def get_nu_chart(self,nuclide="all"):
-        self._ask_df("fields=ground_states&nuclides="+nuclide)
+        self._ask_df(self.nu_chart_query(nuclide))
         return
     
     def get_nuclear_levels(self,nuclide=None):
-        self._ask_df("fields=levels&nuclides="+nuclide)
+        self._ask_df(self.nuclear_levels_query(nuclide))
         return    
     
     def get_fission_yields(self,kind='cumulative',parent=None):
@@ -65,26 +115,68 @@ class CmdNuChart(object):
         return len(self.get_df())
     
     def get_index_non_empty(self,column_name = None):
-        return np.where(np.isnan(np.array(self.get_df()[column_name])) == False)[0]
+        '''
+        Return the positions of the non-empty elements of a column. The result is evaluated once for each response.
+        '''
+        index = self._non_empty.get(column_name)
+        if index is None:
+            data = self.__column(column_name)
+            if data.dtype == object:
+                empty = pd.isna(data) | (data == "")
+            else:
+                empty = np.isnan(data) if data.dtype.kind == "f" else np.zeros(len(data),dtype=bool)
+            index = np.where(empty == False)[0]
+            index.flags.writeable = False
+            self._non_empty[column_name] = index
+        return index
+    
+    def __column(self,column_name):
+        '''
+        Typed array of a column, converted once for each response and then cached.
+        Numeric columns are returned with their dtype (NaN for the blanks). In the other columns, the elements
+        which can be converted are float and the remaining ones str (as in the element-wise conversion).
+        '''
+        data = self._columns.get(column_name)
+        if data is None:
+            series = self._df[column_name]
+            if pd.api.types.is_numeric_dtype(series):
+                data = series.to_numpy(copy=True)
+            else:
+                numbers = pd.to_numeric(series,errors="coerce").to_numpy(dtype=float)
+                text = np.isnan(numbers) & series.notna().to_numpy()
+                if text.any():
+                    data = series.to_numpy(dtype=object,copy=True)
+                    data[~text] = numbers[~text]
+                else:
+                    data = numbers
+            data.flags.writeable = False
+            self._columns[column_name] = data
+        return data
     
     def get_array(self,column_name=None):
-        data = np.array(self.get_df()[column_name])
-
-        if len(data.shape) == 2:
-            for col in range(data.shape[1]):
-                #data[:,col][data[:,col]==" "] = np.nan
-                try:
-                    data[:,col] = data[:,col].astype(float)
-                except:
-                    data[:,col] = data[:,col].astype(str)
-                    
-        if len(data.shape) == 1:
-            for col in range(data.shape[0]):
-                try:
-                    data[col] = float(data[col])
-                except:
-                    data[col] = str(data[col])    
-                            
+        '''
+        Return a column (column_name is a str) or a 2D array of columns (column_name is a list) of the last response.
+        The arrays are read-only and cached: the conversion of each column is done only once for each response.
+        In the 2D case, a column is float if all its elements can be converted, str otherwise.
+        '''
+        if isinstance(column_name,str):
+            return self.__column(column_name)
+        
+        key = tuple(column_name)
+        data = self._columns.get(key)
+        if data is None:
+            if all([pd.api.types.is_numeric_dtype(self._df[name]) for name in column_name]):
+                data = np.column_stack([self.__column(name) for name in column_name])
+            else:
+                data = np.empty((len(self._df),len(column_name)),dtype=object)
+                for col, name in enumerate(column_name):
+                    typed = self.__column(name)
+                    if typed.dtype != object:
+                        data[:,col] = typed.astype(float)
+                    else:
+                        data[:,col] = self._df[name].to_numpy().astype(str)
+            data.flags.writeable = False
+            self._columns[key] = data
         return data
     
     def get_decays(self,nuclide=None,dtype="bm"): #135xe
@@ -103,11 +195,41 @@ class CmdBetaShape(object):
         self._betashape_path = betashape_path
         self._save_path = "."
         self._message = None
+        self._state = None
+        self._cache = None
+        self._version = ""
+        self._pool = None # (n_workers, pool of evaluate_decays)
         
     def set_betashape(self,path=None):
         self._betashape_path = path
         return
         
+    def set_cache(self,cache=None,version=None):
+        '''
+        Use a ResultCache (or the path to its folder) to store the results of evaluate_decay.
+        *version* is the Betashape version and it is part of the cache key. If None, the Betashape binary is used
+        (its path, size and modification time, see get_binary_version), so that the entries of another build are not used.
+        '''
+        if isinstance(cache,str):
+            cache = ResultCache(cache)
+        if (cache is not None) and (version is None):
+            version = self.get_binary_version()
+        self._cache = cache
+        self._version = "" if version is None else version
+        return
+        
+    def get_binary_version(self):
+        '''
+        Identity of the Betashape binary: its real path, size and modification time. ValueError is raised if it is not found.
+        '''
+        executable = self._get_executable() if self._betashape_path is not None else "betashape"
+        path = shutil.which(executable) if os.path.dirname(executable) == "" else executable
+        if (path is None) or (os.path.isfile(path) is False):
+            raise ValueError("Betashape binary not found: give the version of the cache")
+        path = os.path.realpath(path)
+        stat = os.stat(path)
+        return path+":"+str(stat.st_size)+":"+str(stat.st_mtime_ns)
+        
     def set_save_path(self,path=None):
         self._save_path = path
         return
@@ -141,12 +263,11 @@ class CmdBetaShape(object):
         original_files = [f for f in listdir(bpath)] # name of the files in the betashape folder BEFORE launching betashape
         
         file_to_process = bu.fix_path(fpath) + fname  #copy the file to process inside the betashape folder
-        subprocess.call(["cp",file_to_process, bpath])
+        shutil.copy(file_to_process, bpath)
         
-        cmd = "betashape "+fname + " " + options  #launch betashape
-        message =subprocess.Popen(cmd,stdout=subprocess.PIPE,stderr=subprocess.PIPE,shell=True,cwd=self._betashape_path).communicate()
+        message =subprocess.run([self._get_executable(),fname]+options.split(),stdout=subprocess.PIPE,stderr=subprocess.PIPE,cwd=self._betashape_path).stdout
         if verbose is True:
-            print(message[0].decode('ascii'))
+            print(message.decode('ascii',errors='replace'))
             
         full_files = [f for f in listdir(bpath)] # name of the files in the betashape folder AFTER launching betashape
         ii =np.uint32(np.where(np.in1d(np.array(full_files),np.array(original_files),invert = True))[0])
@@ -156,8 +277,9 @@ class CmdBetaShape(object):
         for filen in new_files:
             if os.path.isdir(bpath+filen) is True:
                 file_dir = filen
-            subprocess.call(["mv",  bpath+filen, self._save_path])
-        self._message = message[0].decode('ascii')
+            shutil.move(bpath+filen, bu.fix_path(self._save_path)+filen)
+        self._message = message.decode('ascii',errors='replace')
+        self._state = None
         
         '''
         new_files = np.delete(new_files,new_files==file_dir)  
@@ -167,9 +289,80 @@ class CmdBetaShape(object):
         '''
         return  
         
+    def run_betashape_isolated(self,fpath=None,fname=None,options="",verbose=True,timeout=None):
+        '''
+        Same as run_betashape, but Betashape is launched inside a private working directory
+        (created in the save path) which mirrors the Betashape folder through symbolic links.
+        The outputs are the new entries of the working directory, hence several runs can share
+        the same Betashape installation. If *timeout* (s) expires, subprocess.TimeoutExpired is raised.
+        '''
+        work_path, original_files = self._prepare_work_path(fpath,fname)
+        try:
+            result = subprocess.run([self._get_executable(),fname]+options.split(),stdout=subprocess.PIPE,stderr=subprocess.PIPE,
+                                    cwd=work_path,timeout=timeout)
+            message = result.stdout.decode('ascii',errors='replace')
+            if verbose is True:
+                print(message)
+            new_files = self._collect_outputs(work_path,original_files)
+            self._message = message
+            self._state = self.classify_output(message.splitlines(),new_files,result.returncode)
+        finally:
+            shutil.rmtree(work_path,ignore_errors=True)
+        return
+        
+    def _get_executable(self):
+        bpath = bu.fix_path(self._betashape_path)
+        return bpath+"betashape" if os.path.isfile(bpath+"betashape") else "betashape"
+        
+    def _prepare_work_path(self,fpath,fname,save_path=None):
+        '''
+        Create a working directory inside save_path (default: the save path), link the Betashape folder inside it
+        and copy the input file. Return the working directory and the set of its entries before launching Betashape.
+        '''
+        if save_path is None:
+            save_path = self._save_path
+        bpath = bu.fix_path(self._betashape_path)
+        work_path = bu.fix_path(tempfile.mkdtemp(prefix="work_",dir=save_path))
+        for filen in listdir(bpath):
+            os.symlink(bpath+filen, work_path+filen)
+        original_files = set(listdir(work_path))
+        shutil.copy(bu.fix_path(fpath) + fname, work_path+fname)
+        original_files.add(fname)
+        return work_path, original_files
+        
+    def _collect_outputs(self,work_path,original_files,save_path=None):
+        '''
+        Move the files created by Betashape from the working directory to save_path (default: the save path).
+        '''
+        if save_path is None:
+            save_path = self._save_path
+        new_files = sorted(set(listdir(work_path)) - original_files) # file created by betashape
+        for filen in new_files:
+            shutil.move(work_path+filen, bu.fix_path(save_path)+filen)
+        return new_files
+        
+    def classify_output(self,lines=None,new_files=None,returncode=0,save_path=None):
+        '''
+        Return the state of a Betashape run given its stdout (list of lines), the files it created (moved to save_path,
+        default: the save path) and its return code. The run is "file processed" only if Betashape exited with 0 and
+        wrote the folder of the nuclide (not empty); "file not found" if it wrote nothing at all.
+        '''
+        if save_path is None:
+            save_path = self._save_path
+        if (len(new_files) == 0) and (len("".join(lines).strip()) == 0):
+            return "file not found"
+        if returncode != 0:
+            return "file not processed"
+        folders = [el for el in new_files if os.path.isdir(bu.fix_path(save_path)+el)]
+        if any([len(listdir(bu.fix_path(save_path)+el)) > 0 for el in folders]) is False:
+            return "file not processed"
+        return "file processed"
+
     def get_result_state(self,thr=800):
         if self._message is None:
             return "Not executed"
+        if self._state is not None:
+            return self._state
         if len(self._message) == 0:
             return "file not found"
         if len(self._message) >= thr:
@@ -179,24 +372,28 @@ class CmdBetaShape(object):
         
     def __read_header(self,fname=None):
         with open(fname,"r",encoding="ISO-8859-1") as f:    
-            nrow = 1
-            header = ""
-            try:
-                header += f.readline()
-            except:
-                pass
-            compact = header.replace(" ","")
-            while compact[:6] != "E(keV)":
+            lines = []
+            while True:
                 text = f.readline()
-                compact = text.replace(" ","")
-                header+=text
-                nrow +=1
-            header =header.split("\n")[:-1]
-            labels = header[-1]
-            labels = labels.split("  ")
-            labels_true = [x for x in labels if( (x != '') & (x != ' '))]
-            for i in range(len(labels_true)):
-                labels_true[i] = labels_true[i].replace(" ","")
+                lines.append(text)
+                if (text.replace(" ","")[:6] == "E(keV)") | (text == ""):
+                    break
+        return self.__parse_header(lines)
+        
+    def __parse_header(self,lines):
+        '''
+        Return the header (list of lines up to the labels line), the column labels and the number of header lines.
+        '''
+        nrow = 0
+        while lines[nrow].replace(" ","")[:6] != "E(keV)":
+            nrow += 1
+        nrow += 1
+        header = "".join(lines[:nrow]).split("\n")[:-1]
+        labels = header[-1]
+        labels = labels.split("  ")
+        labels_true = [x for x in labels if( (x != '') & (x != ' '))]
+        for i in range(len(labels_true)):
+            labels_true[i] = labels_true[i].replace(" ","")
         return header, labels_true, nrow
         
         
@@ -237,46 +434,166 @@ class CmdBetaShape(object):
         return      
 
 
-    def evaluate_decay(self,dictionary=None,ensdf_path=None,ensdf_name=None,verbose=False,boptions="myEstep=1 nu=1",rmdir=True):
+    def evaluate_decay(self,dictionary=None,ensdf_path=None,ensdf_name=None,verbose=False,boptions="myEstep=1 nu=1",rmdir=True,timeout=None):
+        '''
+        Run Betashape on a dictionary (see get_example_dictionary) or on an ENSDF file and return
+        the parsed output as {metastable index: list of transitions}. Each call works in its own
+        temporary folder inside the save path, so several calls can run at the same time.
+        With a cache (see set_cache), only the successful runs ("file processed") are stored.
+        '''
+        key = self._get_cache_key(dictionary,ensdf_path,ensdf_name,boptions)
+        if key is not None:
+            output_dir = self._cache.get(key)
+            if output_dir is not None:
+                return output_dir
         
-        folder_name = "dummyFolder101"
         path = bu.fix_path(self._save_path)
-        original_files = [f for f in listdir(path)] 
-        if folder_name in original_files:
-            print("Error!" ,folder_name," is present! Please remove it!")
-            return
-        message =subprocess.Popen("mkdir "+folder_name,stdout=subprocess.PIPE,stderr=subprocess.PIPE,shell=True,cwd=path).communicate()
+        folder_name = bu.fix_path(tempfile.mkdtemp(prefix="dummyFolder",dir=path))
         
         old_save_path = self._save_path
-        self.set_save_path(path+folder_name)
+        self.set_save_path(folder_name)
+        try:
+            if dictionary is not None:
+                self.create_dummy_ensdf(dictionary,folder_name)
+                self.run_betashape_isolated(fpath=folder_name,fname="dummy.ensdf",options=boptions,verbose=verbose,timeout=timeout)
+            if ensdf_path is not None:
+                self.run_betashape_isolated(fpath=ensdf_path,fname=ensdf_name,options=boptions,verbose=verbose,timeout=timeout)
+            output_dir = self._read_output_folder(folder_name)
+        finally:
+            if rmdir is True:
+                shutil.rmtree(folder_name,ignore_errors=True)
+            self.set_save_path(old_save_path)
+        
+        if (key is not None) and (self._state == "file processed"):
+            self._cache.put(key,output_dir)
+        return output_dir
+        
+    def _get_cache_key(self,dictionary=None,ensdf_path=None,ensdf_name=None,boptions=""):
+        '''
+        Return the cache key of a Betashape input, or None if no cache is set.
+        '''
+        if self._cache is None:
+            return None
         if dictionary is not None:
-            self.create_dummy_ensdf(dictionary,path+folder_name)
-            self.run_betashape(fpath=path+folder_name,fname="dummy.ensdf",options=boptions,verbose=verbose)
-        if ensdf_path is not None:
-            self.run_betashape(fpath=ensdf_path,fname=ensdf_name,options=boptions,verbose=verbose)
-        #self.run_betashape(fpath="./"+folder_name,fname="dummy.ensdf",options="myEstep="+str(Estep)+ " nu=1 "+boptions,verbose=verbose)
-    
-        full_files = [f for f in listdir(path+folder_name)] 
-        file_dir = []
-        for filen in full_files:
-            if os.path.isdir(path+folder_name+"/"+filen) is True:
-                file_dir.append(filen)
-
-        output_dir = {}
-        for el in file_dir:        
-            output_list = self.get_data_from_folder(folder_name=path+folder_name+"/"+el)
-            output_dir[self.__find_metastable(el)] = output_list
-            
-
+            input_text = self.create_dummy_ensdf(dictionary,None,debug=True)
+        else:
+            with open(bu.fix_path(ensdf_path)+ensdf_name,"r",encoding="ISO-8859-1") as f:
+                input_text = f.read()
+        return self._cache.get_key(input_text,boptions,self._version)
         
-        if rmdir is True:
-            message =subprocess.Popen("rm -r "+folder_name,stdout=subprocess.PIPE,stderr=subprocess.PIPE,shell=True,cwd=path).communicate()
-    
-        self.set_save_path(old_save_path)
+    def _read_output_folder(self,folder_name):
+        '''
+        Parse every nuclide folder created by Betashape inside folder_name.
+        '''
+        folder_name = bu.fix_path(folder_name)
+        output_dir = {}
+        for filen in sorted(listdir(folder_name)):
+            if os.path.isdir(folder_name+filen) is True:
+                output_dir[self.__find_metastable(filen)] = self.get_data_from_folder(folder_name=folder_name+filen)
         return output_dir
         
+    def evaluate_decays(self,jobs=None,n_workers=1,timeout=None):
+        '''
+        Run evaluate_decay for several inputs on a pool of *n_workers* processes.
+        
+        Parameters
+        ----------
+        jobs : dict or iterable
+            {key : dictionary of keyword arguments for evaluate_decay}, or an iterable of (key, keyword arguments)
+            pairs. The iterable is consumed while the jobs run (e.g. a generator fed by another thread) and at most
+            2*n_workers jobs are submitted ahead of the results that were not yet read.
+        n_workers : int
+            Number of Betashape processes running at the same time. Default is 1.
+        timeout : float
+            Maximum time in seconds for each Betashape run. If None, no limit is used. Default is None.
+            It covers only the Betashape process: the time a job waits for a free worker is not included, and the
+            workers are started (see start_workers) before the first job is submitted.
+            
+        Yields
+        ------
+        key, output_dir, error
+            The results are returned as soon as each job finishes. If the job failed (e.g. timeout),
+            output_dir is None and error is the raised exception.
+        '''
+        pool = self.start_workers(n_workers)
+        if isinstance(jobs,dict):
+            jobs = jobs.items()
+        finished = queue.Queue()
+        slots = threading.Semaphore(2*n_workers)
+        stop = threading.Event()
+        submitted = []
+        errors = []
+        
+        def feed():
+            try:
+                for key, kwargs in jobs:
+                    slots.acquire()
+                    if stop.is_set():
+                        break
+                    job = pool.submit(_evaluate_decay_job,self._betashape_path,self._save_path,self._cache,self._version,dict(kwargs,timeout=timeout))
+                    submitted.append(job)
+                    job.add_done_callback(lambda job, key=key: finished.put((key,job)))
+            except Exception as error:
+                errors.append(error)
+            finally:
+                finished.put(None)
+        
+        feeder = threading.Thread(target=feed,daemon=True)
+        feeder.start()
+        received = 0
+        fed = False
+        try:
+            while (fed is False) or (received < len(submitted)):
+                item = finished.get()
+                if item is None:
+                    fed = True
+                    continue
+                received += 1
+                slots.release()
+                key, job = item
+                try:
+                    result = job.result()
+                except Exception as error:
+                    yield key, None, error
+                    continue
+                yield key, result, None
+        finally:
+            stop.set()
+            slots.release()
+            for job in submitted: # the jobs not started yet, if the results are not read to the end
+                job.cancel()
+        if len(errors) > 0:
+            raise errors[0]
+        
+    def start_workers(self,n_workers=1):
+        '''
+        Start the pool of *n_workers* processes of evaluate_decays and wait until every worker is ready (a new worker
+        imports this module, which takes a few seconds). The pool is kept for the following calls of evaluate_decays
+        with the same n_workers, until close. Returns the pool.
+        '''
+        if (self._pool is not None) and (self._pool[0] == n_workers):
+            return self._pool[1]
+        self.close()
+        # the workers are spawned, not forked: a forked worker would inherit (and keep locked) the files
+        # opened by other threads, e.g. the .lazy file of the writer thread in process.pipeline
+        pool = futures.ProcessPoolExecutor(max_workers=n_workers,mp_context=multiprocessing.get_context("spawn"))
+        ready = set()
+        while len(ready) < n_workers: # a worker which is ready may take more than one job
+            ready.update([job.result() for job in [pool.submit(_start_worker,0.05) for _ in range(n_workers)]])
+        self._pool = (n_workers,pool)
+        return pool
+        
+    def close(self):
+        '''
+        Stop the workers of evaluate_decays (see start_workers), after the running jobs.
+        '''
+        if self._pool is not None:
+            self._pool[1].shutdown()
+            self._pool = None
+        return
+        
     def get_data_from_folder(self,folder_name=None):
-        full_files = [f for f in os.listdir(folder_name)]    
+        full_files = sorted([f for f in os.listdir(folder_name)])
         output_list = []
         pos =np.intersect1d(bu.locate_word(np.array(full_files),"trans"),bu.locate_word(np.array(full_files),"myEstep"))
         for i in pos:
@@ -284,7 +601,7 @@ class CmdBetaShape(object):
             file_to_open = folder_name+ "/" + full_files[i]
             label, data_beta, data_nu = self.get_data(file_to_open,dtype="nupartial")
 
-            output_message = self.__read_header(file_to_open.replace("_myEstep","") )[0] 
+            output_message = self.__read_header(file_to_open.replace("_myEstep","") )[0] # only the header is read
             dic["label"] = label
             dic["data_beta"] = data_beta
             dic["data_nu"] = data_nu
@@ -309,7 +626,13 @@ class CmdBetaShape(object):
                 tipo = str(number) + "nu"
         return tipo      
         
-    def convert_output_into_dic(self,output_list=None,tipo="data_nu"):
+    def convert_output_into_dic(self,output_list=None,tipo="data_nu",sparse=False):
+        '''
+        Collect the Betashape outputs of the transitions of a nuclide in a single dictionary.
+        If sparse is True, the spectra of the transitions are not zero-padded to the longest one: they are stored as
+        ragged arrays (see base_utilities.to_ragged), "transition_dN_dE_values" and "transition_unc_dN_dE_values",
+        with the common "transition_offsets". Otherwise, "transition_dN_dE" and "transition_unc_dN_dE" are matrices.
+        '''
     
         Emax = []
         transition_intensity = []
@@ -346,46 +669,49 @@ class CmdBetaShape(object):
         transition_unc_intensity = np.array(transition_unc_intensity)
         transition_intensity = np.array(transition_intensity)
         
-        temp = np.zeros((len(transition_dN_dE),max([el.shape[0] for el in transition_dN_dE])))
-        temp2 = temp.copy()
-        for i in range(temp.shape[0]):
-            temp[i,:len(transition_dN_dE[i])] = transition_dN_dE[i] 
-            temp2[i,:len(transition_unc_dN_dE[i])] = transition_unc_dN_dE[i] 
-        transition_dN_dE = temp
-        transition_unc_dN_dE = temp2
-    
-        transition_dN_dE_total = np.sum(transition_dN_dE,axis=0)
-        unc_dN_dE = np.sum(transition_unc_dN_dE**2,axis=0)**0.5
+        values, offsets = bu.to_ragged(transition_dN_dE)
+        unc_values, _ = bu.to_ragged(transition_unc_dN_dE)
+        
+        transition_dN_dE_total = bu.ragged_sum(values,offsets)
+        unc_dN_dE = bu.ragged_sum(unc_values**2,offsets)**0.5
     
         dizio ={"transition_Emax" : Emax,
                 "transition_intensity" : transition_intensity,
-                "transition_dN_dE" : transition_dN_dE,
-                "transition_unc_dN_dE" : transition_unc_dN_dE,
                 "transition_intensity" : transition_intensity,
                 "transition_unc_intensity" : transition_unc_intensity,
                 "dN_dE_tot" : transition_dN_dE_total,
                 "unc_dN_dE": unc_dN_dE,
                 "transition_type" : transition_type
                 }
+        if sparse is True:
+            dizio["transition_dN_dE_values"] = values
+            dizio["transition_unc_dN_dE_values"] = unc_values
+            dizio["transition_offsets"] = offsets
+        else:
+            dizio["transition_dN_dE"] = bu.ragged_to_dense(values,offsets)
+            dizio["transition_unc_dN_dE"] = bu.ragged_to_dense(unc_values,offsets)
         return dizio
         
         
     def get_data(self,fname=None,dtype="normal"):
-        header,labels,nrow = self.__read_header(fname)
+        '''
+        Read a Betashape output file. The file is read once: the header and the numeric blocks are
+        located by line offset and converted in a single pass.
+        If dtype is "normal", return the labels and the data. If dtype is "nupartial", return the labels,
+        the first block (electron spectrum) and the last one (neutrino spectrum).
+        '''
+        with open(fname,"r",encoding="ISO-8859-1") as f:
+            lines = f.readlines()
+        header,labels,nrow = self.__parse_header(lines)
         
         if dtype == "normal":
-            data = np.loadtxt(fname,skiprows=nrow)
+            data = _lines_to_array(lines[nrow:])
             return labels, data
         if dtype == "nupartial":
-            with open(fname,"r") as f:    
-                a = f.readlines()
-                a = np.array(a)
-                index = np.where(a=='\n')[0]
-
-            nrows1 = index[index>nrow][0] - nrow
-            data1 =  np.loadtxt(fname,skiprows=nrow,max_rows=nrows1)
-            nrow2 = index[index>nrow][-1] +2   
-            data2 =  np.loadtxt(fname,skiprows=nrow2)
+            first = lines.index("\n",nrow)                   # first empty line after the header
+            last = len(lines) - 1 - lines[::-1].index("\n")  # last empty line
+            data1 = _lines_to_array(lines[nrow:first])
+            data2 = _lines_to_array(lines[last+2:]) # the line after the last empty one holds the labels
             return labels, data1, data2
     
     def __find_metastable(self,name):
@@ -398,3 +724,193 @@ class CmdBetaShape(object):
             return 1
         else:
             return 0
+
+
+def _lines_to_array(lines):
+    '''
+    Convert lines of whitespace separated numbers into a 2D array (one row for each non-empty line).
+    The lines are already in memory, so the C parser of np.loadtxt works without touching the file again.
+    '''
+    return np.loadtxt(lines,ndmin=2)
+
+
+class AsyncBetaShape(object):
+    '''
+    asyncio runner for Betashape. The runs are launched with asyncio.create_subprocess_exec, at most
+    *max_running* at the same time, each one in its own working directory (see CmdBetaShape.run_betashape_isolated).
+    A run lasting more than *timeout* seconds is killed and launched again, up to *retries* times.
+    The save path and the cache are the ones of the CmdBetaShape object *cmd*.
+    
+    '''
+    
+    def __init__(self,cmd=None,max_running=1,timeout=None,retries=2,verbose=False):
+        self._cmd = cmd
+        self._max_running = max_running
+        self._timeout = timeout
+        self._retries = retries
+        self._verbose = verbose
+        self._semaphore = None
+        self._states = {}
+        
+    def get_result_state(self,key=None):
+        '''
+        Return the state of the last Betashape run for the job *key* (see CmdBetaShape.classify_output).
+        '''
+        return self._states.get(key,"Not executed")
+        
+    async def _run(self,save_path,fpath,fname,options):
+        work_path, original_files = self._cmd._prepare_work_path(fpath,fname,save_path)
+        process = None
+        try:
+            process = await asyncio.create_subprocess_exec(self._cmd._get_executable(),fname,*options.split(),
+                                                           stdout=asyncio.subprocess.PIPE,stderr=asyncio.subprocess.STDOUT,cwd=work_path)
+            lines = []
+            async for line in process.stdout:
+                line = line.decode('ascii',errors='replace').rstrip("\n")
+                if self._verbose is True:
+                    print(line)
+                lines.append(line)
+            await process.wait()
+            new_files = self._cmd._collect_outputs(work_path,original_files,save_path)
+            return self._cmd.classify_output(lines,new_files,process.returncode,save_path)
+        finally:
+            if (process is not None) and (process.returncode is None):
+                process.kill()
+                await process.wait()
+            shutil.rmtree(work_path,ignore_errors=True)
+    
+    async def evaluate_decay(self,key=None,dictionary=None,ensdf_path=None,ensdf_name=None,boptions="myEstep=1 nu=1"):
+        '''
+        Coroutine version of CmdBetaShape.evaluate_decay. asyncio.TimeoutError is raised if every attempt timed out.
+        '''
+        cache_key = self._cmd._get_cache_key(dictionary,ensdf_path,ensdf_name,boptions)
+        if cache_key is not None:
+            output_dir = self._cmd._cache.get(cache_key)
+            if output_dir is not None:
+                return output_dir
+        
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self._max_running)
+        async with self._semaphore: # the working folders exist only for the running jobs
+            folder_name = bu.fix_path(tempfile.mkdtemp(prefix="dummyFolder",dir=bu.fix_path(self._cmd._save_path)))
+            try:
+                if dictionary is not None:
+                    self._cmd.create_dummy_ensdf(dictionary,folder_name)
+                    ensdf_path, ensdf_name = folder_name, "dummy.ensdf"
+                attempt = 0
+                while True:
+                    try:
+                        self._states[key] = await asyncio.wait_for(self._run(folder_name,ensdf_path,ensdf_name,boptions),self._timeout)
+                        break
+                    except asyncio.TimeoutError:
+                        attempt += 1
+                        if attempt > self._retries:
+                            raise
+                        for filen in listdir(folder_name): # remove the partial outputs, if any
+                            if os.path.isdir(folder_name+filen):
+                                shutil.rmtree(folder_name+filen,ignore_errors=True)
+                output_dir = await asyncio.get_running_loop().run_in_executor(None,self._cmd._read_output_folder,folder_name)
+            finally:
+                shutil.rmtree(folder_name,ignore_errors=True)
+            
+        if (cache_key is not None) and (self._states.get(key) == "file processed"):
+            self._cmd._cache.put(cache_key,output_dir)
+        return output_dir
+        
+    async def __job(self,key,kwargs):
+        try:
+            return key, await self.evaluate_decay(key=key,**kwargs), None
+        except Exception as error:
+            return key, None, error
+        
+    async def evaluate_decays_async(self,jobs=None):
+        '''
+        Asynchronous generator version of evaluate_decays.
+        '''
+        self._semaphore = asyncio.Semaphore(self._max_running)
+        loop = asyncio.get_running_loop()
+        iterator = iter(jobs.items() if isinstance(jobs,dict) else jobs)
+        finished = asyncio.Queue()
+        slots = asyncio.Semaphore(2*self._max_running)
+        tasks = []
+        
+        async def feed():
+            while True:
+                await slots.acquire()
+                # the iterator may block (e.g. it waits for another thread), so it is read in the executor
+                job = await loop.run_in_executor(None,next,iterator,None)
+                if job is None:
+                    return len(tasks)
+                task = asyncio.ensure_future(self.__job(*job))
+                task.add_done_callback(lambda task: finished.put_nowait(task))
+                tasks.append(task)
+        
+        feeder = asyncio.ensure_future(feed())
+        received = 0
+        try:
+            while feeder.done() is False:
+                getter = asyncio.ensure_future(finished.get())
+                done, _ = await asyncio.wait([getter,feeder],return_when=asyncio.FIRST_COMPLETED)
+                if getter in done:
+                    received += 1
+                    slots.release()
+                    yield getter.result().result()
+                else:
+                    getter.cancel()
+            total = feeder.result()
+            while received < total:
+                received += 1
+                slots.release()
+                yield (await finished.get()).result()
+        finally:
+            feeder.cancel()
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(feeder,*tasks,return_exceptions=True)
+    
+    def evaluate_decays(self,jobs=None):
+        '''
+        Run Betashape on several inputs.
+        
+        Parameters
+        ----------
+        jobs : dict or iterable
+            {key : dictionary of keyword arguments for CmdBetaShape.evaluate_decay (dictionary, ensdf_path, ensdf_name, boptions)},
+            or an iterable of (key, keyword arguments) pairs which is consumed while the jobs run. At most 2*max_running
+            jobs are started ahead of the results that were not yet read.
+            
+        Yields
+        ------
+        key, output_dir, error
+            The results are returned as soon as each job finishes. If the job failed (e.g. timeout),
+            output_dir is None and error is the raised exception.
+        '''
+        loop = asyncio.new_event_loop()
+        results = self.evaluate_decays_async(jobs)
+        try:
+            while True:
+                try:
+                    yield loop.run_until_complete(results.__anext__())
+                except StopAsyncIteration:
+                    break
+        finally:
+            loop.run_until_complete(results.aclose())
+            loop.close()
+
+
+def _start_worker(delay=0.):
+    '''
+    Job of CmdBetaShape.start_workers: return the pid of the worker, once it is ready.
+    '''
+    time.sleep(delay)
+    return os.getpid()
+
+
+def _evaluate_decay_job(betashape_path,save_path,cache,version,kwargs):
+    '''
+    Worker for CmdBetaShape.evaluate_decays. It must live at module level to be pickled.
+    '''
+    cmd = CmdBetaShape(betashape_path)
+    cmd.set_save_path(save_path)
+    cmd.set_cache(cache,version)
+    return cmd.evaluate_decay(**kwargs)
@@ -327,6 +327,9 @@ class EnsdfReader:
         return Q,Q_std
     
     
+    def _get_name(self,line):
+        return str(re.findall(r"\d+", line[0])[0])+self._map[re.findall(r"\D+", line[0])[0]]
+    
     def get_dict(self):
         label = ""
         i = 1
@@ -340,13 +343,38 @@ class EnsdfReader:
                 Q, Q_std = self._get_Q(line)
                 time = self._get_half_file(string=liner)
                 
-                name = str(re.findall(r"\d+", line[0])[0])+self._map[re.findall(r"\D+", line[0])[0]]
+                name = self._get_name(line)
                 name += label
                 dic[name] = {"Q": Q, "unc_Q":Q_std,"half_life_sec":time}
                 label = "_"+str(i)+"m"  #this should work. The first chunk of data should be the  normal state, then
                                         #the others should follow...
                 i+=1
         return dic    
+        
+    def get_datasets(self):
+        '''
+        Return the text of the dataset (block of records closed by an empty END record) of each parent,
+        as {nuclide name : text}. The names are the same as in get_dict.
+        '''
+        label = ""
+        i = 1
+        dic = {}
+        lines = []
+        names = []
+        for liner in self._endsf + ["\n"]:
+            if liner.strip() == "":
+                for name in names:
+                    dic[name] = "".join(lines)
+                lines = []
+                names = []
+                continue
+            lines.append(liner)
+            line = liner.split()
+            if (len(line)>=2) and (line[1] =="P"):
+                names.append(self._get_name(line)+label)
+                label = "_"+str(i)+"m"
+                i+=1
+        return dic
     
     
 class EndfBSubLibraryReader:
@@ -5,20 +5,45 @@
 
 
 import numpy as np
-import h5py
+import os
+import re
+import ast
+import fnmatch
+import operator
+import functools
+import threading
+import collections
+import time
 from base import base_utilities
+from rw import storage
 from scipy import integrate
+from concurrent import futures
 
 
 class LazyWriter:
     
     '''
     Simple writer for the .lazy file (hdf5).
+    The file is written with *backend* (see storage.BACKENDS, e.g. "directory" for a directory store); if None,
+    the backend of the existing file is used, HDF5 for a new file.
+    If spectra_dtype is given (e.g. "float32"), the spectra and their uncertainties (the arrays named *dN_dE* in
+    the "data" sub-groups) are stored with this type. The other parameters keep their type.
+    Writing the "data" sub-group of a nuclide deletes its "fit" sub-group (see LazyReader.fit_spectrum), which
+    refers to the old spectrum.
+    The spectra can be written in a SWMR session (see start_swmr), so that other processes can read the file meanwhile.
     
     '''
     
-    def __init__(self, output_path=None,name=None,fname=None):
+    # arrays of the "data" sub-groups written in a SWMR session (see start_swmr), with their type
+    SWMR_DATA = {"dN_dE_tot" : "float64", "unc_dN_dE" : "float64", "dN_dE_tot_c" : "float64",
+                 "transition_Emax" : "float64", "transition_intensity" : "float64", "transition_unc_intensity" : "int64",
+                 "transition_dN_dE_values" : "float64", "transition_unc_dN_dE_values" : "float64", "transition_offsets" : "int64"}
+    
+    def __init__(self, output_path=None,name=None,fname=None,backend=None,spectra_dtype=None):
         
+        self._backend = backend
+        self._spectra_dtype = spectra_dtype
+        self._swmr = None
 
         if output_path is not None:
             output_path = base_utilities.fix_path(output_path)
@@ -33,7 +58,7 @@ class LazyWriter:
     
     def __check_exist(self,path=None,group_name = None):
 
-        with h5py.File(self._file,'r') as f:
+        with storage.open_file(self._file,'r',backend=self._backend) as f:
             if path is None:
                 names = list(f.keys())   
             else:
@@ -49,13 +74,12 @@ class LazyWriter:
         Write "dictionary" in the .lazy header
         
         '''
+        if self._swmr is not None:
+            return self.__defer(self.set_general_info,dictionary)
                 
-        with h5py.File(self._file,'a') as f:
+        with storage.open_file(self._file,'a',backend=self._backend) as f:
 
-            if self.__check_exist(group_name = "info") is False:
-                general_info=f.create_group('info')
-            else:
-                general_info=f.get("info")
+            general_info=f.require_group('info')
         
             for key, value in dictionary.items():
                 self.__save_parameter(general_info,key,value)
@@ -67,31 +91,327 @@ class LazyWriter:
 
         big_group = "nuclides"       
         
+        if self._swmr is not None:
+            return self.__write_swmr(nuclide_name,dtype,dictionary if dictionary is not None else {vname : vvalue})
         
-        with h5py.File(self._file,'a') as f:
+        with storage.open_file(self._file,'a',backend=self._backend) as f:
         
-            if self.__check_exist(path=None,group_name = big_group) is False:
-                f.create_group(big_group)
-            
-            if self.__check_exist(path=big_group,group_name = nuclide_name) is False:
-                group=f.create_group(big_group + "/"+ nuclide_name)
-            else:
-                group=f.get(big_group + "/"+ nuclide_name)        
-                    
-            nuclide_name = big_group + "/"+ nuclide_name
-            
-            if self.__check_exist(path=nuclide_name,group_name = dtype) is False:
-                group=f.create_group(nuclide_name+"/"+dtype)
-            else:
-                group=f.get(nuclide_name+"/"+dtype)      
+            storage.materialize(f,big_group+"/"+nuclide_name) # a nuclide of the base files of an overlay is copied first
+            # require_group: several writers can add different nuclides to a directory store at the same time
+            group=f.require_group(big_group + "/"+ nuclide_name+"/"+dtype)
+            if (dtype == "data") and ("fit" in f[big_group+"/"+nuclide_name]):
+                del f[big_group+"/"+nuclide_name+"/fit"] # the fit of the old spectrum (see LazyReader.fit_spectrum)
                 
             if dictionary is not None:    
                 for key, value in dictionary.items():
-                    self.__save_parameter(group,key,value)            
+                    self.__save_parameter(group,key,self.__cast(dtype,key,value))            
             else:
-                self.__save_parameter(group,vname,vvalue)
+                self.__save_parameter(group,vname,self.__cast(dtype,vname,vvalue))
+        return
+    
+    def __cast(self,dtype,name,value):
+        '''
+        Convert the spectra to spectra_dtype (see LazyWriter).
+        '''
+        if (self._spectra_dtype is None) or (dtype != "data") or ("dN_dE" not in name):
+            return value
+        array = np.asarray(value)
+        if (array.ndim == 0) or (array.dtype.kind != "f"):
+            return value
+        return array.astype(self._spectra_dtype)
+        
+
+    def write_manifest(self, nuclide_name=None, stage=None, state=None, input_hash=""):
+        '''
+        Record the state of a build stage (e.g. "cfy", "ensdf", "endf_b", "ensdf-fix") for a nuclide
+        in the manifest of the .lazy file, together with the hash of the inputs used by the stage.
+        The manifest is saved in the "manifest" group, outside "nuclides".
+        
+        '''
+        if self._swmr is not None:
+            return self.__defer(self.write_manifest,nuclide_name,stage,state,input_hash)
+        with storage.open_file(self._file,'a',backend=self._backend) as f:
+            storage.materialize(f,"manifest/"+nuclide_name)
+            group = f.require_group("manifest/"+nuclide_name+"/"+stage)
+            self.__save_parameter(group,"state",state)
+            self.__save_parameter(group,"hash",input_hash)
         return
+
+    def delete_nuclide_data(self, nuclide_name=None, dtype=None, vname=None):
+        '''
+        Delete a nuclide (dtype is None), one of its sub-groups (e.g. dtype="data") or a single parameter (vname).
+        Nothing happens if the object does not exist.
         
+        '''
+        path = "nuclides/"+nuclide_name
+        if dtype is not None:
+            path += "/"+dtype
+            if vname is not None:
+                path += "/"+vname
+        if self._swmr is not None:
+            return self.__delete_swmr(nuclide_name,path)
+        self.__delete(path)
+        return
+
+    def __delete(self,path,keep=()):
+        '''
+        Delete the object path, apart from the datasets in keep (the arrays written in a SWMR session, see __delete_swmr).
+        '''
+        with storage.open_file(self._file,'a',backend=self._backend) as f:
+            storage.materialize(f,os.path.dirname(path))
+            self.__delete_object(f,path,keep)
+        return
+
+    def __delete_object(self,f,path,keep):
+        if f.get(path,getlink=True) is None: # the link to a nuclide of a base file (see create_overlay) is removed
+            return
+        if (path in keep) and storage.is_dataset(f[path]) and (f[path].maxshape == (None,)): # not overwritten after the session
+            return
+        if len([el for el in keep if el.startswith(path+"/")]) == 0:
+            del f[path]
+            return
+        storage.materialize(f,path)
+        for key in list(f[path].keys()):
+            self.__delete_object(f,path+"/"+key,keep)
+        return
+        
+    def delete_manifest(self, nuclide_name=None, stage=None):
+        '''
+        Delete the manifest entries of a nuclide (all of them if stage is None).
+        '''
+        path = "manifest/"+nuclide_name
+        if stage is not None:
+            path += "/"+stage
+        if self._swmr is not None:
+            return self.__defer(self.delete_manifest,nuclide_name,stage)
+        with storage.open_file(self._file,'a',backend=self._backend) as f:
+            storage.materialize(f,os.path.dirname(path))
+            if f.get(path,getlink=True) is not None:
+                del f[path]
+        return
+
+    def create_overlay(self, bases=None):
+        '''
+        Make the .lazy file (HDF5) an overlay of the .lazy files in bases (from the lowest to the topmost layer, see
+        storage.overlay): the nuclides, the header entries and the manifest of the bases are linked, not copied.
+        LazyReader reads each nuclide from the topmost layer having it; write_nuclide_data and the other methods of
+        LazyWriter copy a linked nuclide in the file before modifying it, so the bases are never modified.
+        Calling it again refreshes the links (e.g. after a base is rebuilt); the nuclides written in the file are kept.
+        
+        '''
+        if storage.get_backend(self._file,self._backend) is not storage.HDF5Backend:
+            raise ValueError("an overlay must be an HDF5 file")
+        if self._swmr is not None:
+            raise ValueError("an overlay cannot be created in a SWMR session")
+        storage.overlay(self._file,bases)
+        return
+
+    def start_swmr(self, nuclides=None):
+        '''
+        Start a SWMR (single writer, multiple readers) session on the .lazy file (HDF5): until stop_swmr, the file stays
+        open for writing, and other processes can read it at the same time (e.g. a LazyReader following a build with
+        createLazyFile.py, see the refresh option of LazyReader). Use it as a context manager:
+        
+            with writer.start_swmr(nuclides=names):
+                writer.write_nuclide_data(...)
+        
+        HDF5 cannot create objects in SWMR mode, so the arrays of SWMR_DATA are created in advance, empty, in the "data"
+        sub-group of each of the *nuclides* (all the nuclides in the file if None). write_nuclide_data writes them with
+        their spectrum "dN_dE_tot" last, so a reader finds either the whole nuclide or an empty spectrum, which is read
+        as a missing one. Everything else (the other parameters, the header, the manifest, other nuclides) is written
+        by stop_swmr, in the order of the calls; the empty arrays left are deleted.
+        
+        The file is rewritten in the format of HDF5 >= 1.10 if it is older (see storage.upgrade).
+        '''
+        if storage.get_backend(self._file,self._backend) is not storage.HDF5Backend:
+            raise ValueError("SWMR needs an HDF5 file")
+        if self._swmr is not None:
+            raise ValueError("a SWMR session is already open")
+        if storage.exists(self._file,backend=self._backend) and (len(storage.get_bases(self._file)) > 0):
+            # the nuclides linked in an overlay are copied first, SWMR cannot start with the objects of other files open
+            with storage.open_file(self._file,'a',backend=self._backend) as f:
+                for name in nuclides if nuclides is not None else list(f.get("nuclides",{}).keys()):
+                    storage.materialize(f,"nuclides/"+name)
+        f = storage.open_swmr(self._file)
+        try:
+            if nuclides is None:
+                nuclides = list(f.get("nuclides",{}).keys())
+            placeholders = {}
+            for name in nuclides:
+                group = f.require_group("nuclides/"+name+"/data")
+                placeholders[name] = set()
+                for key, dtype in self.SWMR_DATA.items():
+                    if (self._spectra_dtype is not None) and ("dN_dE" in key):
+                        dtype = self._spectra_dtype
+                    if self.__create_placeholder(group,key,np.dtype(dtype)) is True:
+                        placeholders[name].add(key)
+            f.swmr_mode = True
+        except BaseException:
+            f.close()
+            raise
+        self._swmr = {"file" : f, "placeholders" : placeholders, "deferred" : [], "written" : set()}
+        return self
+
+    def stop_swmr(self):
+        '''
+        Close the SWMR session (see start_swmr): the writes postponed during the session are done, the stale fits are
+        deleted (see LazyReader.fit_spectrum) and the arrays left empty are removed. Nothing happens if no session is open.
+        '''
+        if self._swmr is None:
+            return
+        session, self._swmr = self._swmr, None
+        session["file"].close()
+        with storage.open_file(self._file,'a',backend=self._backend) as f:
+            for name in session["written"]:
+                if "fit" in f["nuclides/"+name]:
+                    del f["nuclides/"+name+"/fit"]
+        for task in session["deferred"]:
+            task()
+        with storage.open_file(self._file,'a',backend=self._backend) as f:
+            for name, keys in session["placeholders"].items():
+                path = "nuclides/"+name
+                for key in keys:
+                    node = f.get(path+"/data/"+key)
+                    if storage.is_dataset(node) and (node.maxshape == (None,)) and (node.shape == (0,)):
+                        del f[path+"/data/"+key]
+                for group in [path+"/data",path]:
+                    if (group in f) and (len(f[group]) == 0):
+                        del f[group]
+        return
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,*args):
+        self.stop_swmr()
+
+    def __create_placeholder(self,group,name,dtype):
+        '''
+        Empty resizable array for a SWMR session. An existing array with the same type is made resizable.
+        Return False if the array cannot be written in the session.
+        '''
+        node = group.get(name)
+        if node is not None:
+            if (storage.is_dataset(node) is False) or (node.ndim != 1) or (node.dtype != dtype):
+                return False
+            if node.maxshape == (None,):
+                return True
+            value = node[()]
+            del group[name]
+            group.create_dataset(name,data=value,maxshape=(None,),chunks=(4096,))
+            return True
+        group.create_dataset(name,shape=(0,),maxshape=(None,),dtype=dtype,chunks=(4096,))
+        return True
+
+    def __write_swmr(self,nuclide_name,dtype,dictionary):
+        '''
+        write_nuclide_data in a SWMR session (see start_swmr).
+        '''
+        keys = self._swmr["placeholders"].get(nuclide_name,set()) if dtype == "data" else set()
+        group = self._swmr["file"]["nuclides/"+nuclide_name+"/data"] if len(keys) > 0 else None
+        arrays, deferred = {}, {}
+        for key, value in dictionary.items():
+            value = self.__cast(dtype,key,value)
+            array = np.asarray(value)
+            if (key in keys) and (array.ndim == 1) and (array.dtype == group[key].dtype):
+                arrays[key] = array
+            else:
+                deferred[key] = value
+        if len(arrays) > 0:
+            # the spectrum last: a reader finding it finds the other arrays too
+            for key in sorted(arrays.keys(),key=lambda el: el == "dN_dE_tot"):
+                if key == "dN_dE_tot":
+                    self._swmr["file"].flush()
+                group[key].resize((len(arrays[key]),))
+                group[key][:] = arrays[key]
+            self._swmr["file"].flush()
+            self._swmr["written"].add(nuclide_name)
+        if len(deferred) > 0:
+            self.__defer(self.write_nuclide_data,nuclide_name=nuclide_name,dtype=dtype,dictionary=deferred)
+        return
+
+    def __delete_swmr(self,nuclide_name,path):
+        '''
+        delete_nuclide_data in a SWMR session (see start_swmr): the arrays written in the session are emptied (the
+        spectrum first), the other objects are deleted by stop_swmr.
+        '''
+        keys = self._swmr["placeholders"].get(nuclide_name,set())
+        data = "nuclides/"+nuclide_name+"/data/"
+        emptied = [data+el for el in sorted(keys,key=lambda el: el != "dN_dE_tot") if (data+el == path) or (data+el).startswith(path+"/")]
+        for el in emptied:
+            self._swmr["file"][el].resize((0,))
+        self._swmr["file"].flush()
+        if path not in emptied:
+            self.__defer(self.__delete,path,keep=set([data+el for el in keys]))
+        return
+
+    def __defer(self,function,*args,**kwargs):
+        '''
+        Postpone a write to the end of the SWMR session (see stop_swmr).
+        '''
+        self._swmr["deferred"].append(functools.partial(function,*args,**kwargs))
+        return
+
+    def merge(self, fnames=None):
+        '''
+        Merge the shards in fnames (.lazy files built on different slices of the nuclides, e.g. with the -ar option
+        of createLazyFile.py) into the .lazy file. The nuclides, their manifest entries and the header are copied
+        as HDF5 objects (the arrays are never read) if the files are HDF5 files, otherwise they are read and written again.
+
+        The shards are checked before writing anything. A conflict is found if
+        - a header entry has different values in two shards (e.g. different Betashape options);
+        - a nuclide is in more than one shard (or already in the .lazy file) with a different tag.
+        A nuclide found in several shards with the same tag is taken from the first one.
+
+        Returns the list of the conflicts found. If it is not empty, the .lazy file was not modified.
+        '''
+        if self._swmr is not None:
+            raise ValueError("the shards cannot be merged in a SWMR session")
+        header = {}
+        owners = {}
+        conflicts = []
+        sources = [self._file] if storage.exists(self._file,backend=self._backend) else []
+        for fname in sources+list(fnames):
+            with storage.open_file(fname,'r') as f:
+                for key, value in self.__read_values(f.get("info")).items():
+                    if key not in header:
+                        header[key] = (fname,value)
+                    elif np.array_equal(np.asarray(header[key][1]),np.asarray(value)) is False:
+                        conflicts.append("header entry "+key+": "+str(header[key][1])+" in "+header[key][0]+", "+str(value)+" in "+fname)
+                for name, group in f.get("nuclides",{}).items():
+                    tag = self.__read_values(group.get("info")).get("tag")
+                    if name not in owners:
+                        owners[name] = (fname,tag)
+                    elif owners[name][1] != tag:
+                        conflicts.append("nuclide "+name+": tag "+str(owners[name][1])+" in "+owners[name][0]+", "+str(tag)+" in "+fname)
+        if len(conflicts) > 0:
+            return conflicts
+
+        with storage.open_file(self._file,'a',backend=self._backend) as out:
+            for fname in fnames:
+                with storage.open_file(fname,'r') as f:
+                    if "info" in f:
+                        dest = out.require_group("info")
+                        for key in f["info"].keys():
+                            if key not in dest:
+                                storage.copy(f["info"][key],dest,key)
+                    for name in f.get("nuclides",{}).keys():
+                        if owners[name][0] != fname:
+                            continue
+                        storage.copy(f["nuclides"][name],out.require_group("nuclides"),name)
+                        if ("manifest" in f) and (name in f["manifest"]):
+                            storage.copy(f["manifest"][name],out.require_group("manifest"),name)
+        return conflicts
+
+    def __read_values(self,group):
+        if group is None:
+            return {}
+        values = {}
+        for key, value in group.items():
+            if storage.is_dataset(value):
+                value = value[()]
+                values[key] = value.decode() if isinstance(value,bytes) else value
+        return values
 
     def __save_parameter(self,group,variable_name,value):
         try:
@@ -103,12 +423,12 @@ class LazyWriter:
         return
  
  
-        with h5py.File(self.__file,'a') as f:       
+        with storage.open_file(self.__file,'a') as f:       
             f.create_dataset(path+'/'+name,data=value)
         return
 
     def __delete_parameter(self,path,name):
-        with h5py.File(self.__file,  "a") as f:
+        with storage.open_file(self.__file,  "a") as f:
             del f[path+'/'+name]
         return
 
@@ -117,16 +437,99 @@ class LazyWriter:
 class LazyReader:
 
     '''
-    Simple reader for the .lazy file (hdf5).
+    Simple reader for the .lazy file (hdf5, or a directory store, see storage.py).
+    
+    The parameters (see get_table), the fits and the envelope of the spectra are cached and read again when the file
+    is modified. A file written while it is read (e.g. in a SWMR session, see LazyWriter.start_swmr) is modified
+    continuously: with refresh (seconds), they are read again at most every refresh seconds, unless nuclides are
+    added or removed. The spectra are read from the file at each call, apart from the ones cached by
+    get_total_spectrum_fast (at most KEPT_MEMORY bytes). clear_cache drops all the caches.
+    
+    A reader can be shared by several threads: each call opens its own handle of the file, and the caches are
+    read-only arrays replaced as a whole (one thread builds a cache, the others wait for it). The reads of an HDF5
+    file are serialized by h5py anyway: with preload=True (see preload) the whole file is read in memory once and
+    the calls never touch the file again.
     
     '''
+    
+    KEPT_CACHE = 32 # settings of get_total_spectrum_fast whose kept nuclides are cached
+    KEPT_MEMORY = 2**28 # bytes of the spectra of the kept nuclides cached by get_total_spectrum_fast
         
-    def __init__(self, path_file):
+    def __init__(self, path_file, refresh=None, preload=False):
         self._file = path_file
+        self._refresh = refresh
+        self._lock = threading.RLock()
+        self._memory = None
+        self._table = None # (stamp, table, masks of the patterns)
+        self._envelope = None # (key, stamp, envelope, kept nuclides, their spectra)
+        self._fits = None # (stamp, fits)
+        if preload is True:
+            self.preload()
+
+    def preload(self):
+        '''
+        Read the whole file in memory (see storage.load): the following calls read the arrays in memory, so that
+        they never take the h5py lock and several threads run them at the same time. The file is not read again,
+        even if it is modified: call preload again to update the data.
+        Returns the reader itself.
+        '''
+        memory = storage.load(self._file)
+        with self._lock:
+            self._memory = memory
+            self._table = None
+            self._envelope = None
+            self._fits = None
+        self.get_table()
+        return self
+
+    def clear_cache(self):
+        '''
+        Drop the cached parameters, fits, envelope and spectra (they are read again when needed), e.g. to free the
+        memory taken by get_total_spectrum_fast.
+        '''
+        with self._lock:
+            self._table = None
+            self._envelope = None
+            self._fits = None
+        return
+
+    def _open(self):
+        '''
+        Open the file for reading, or return the file in memory (see preload).
+        '''
+        memory = self._memory
+        if memory is not None:
+            return memory
+        return storage.open_file(self._file,'r')
+
+    def __get_mtime(self):
+        memory = self._memory
+        if memory is not None:
+            return memory.mtime
+        return storage.get_mtime(self._file)
+        
+    def __get_stamp(self):
+        '''
+        State of the file for the caches (see __is_current).
+        '''
+        return (self.__get_mtime(),time.monotonic(),self.get_nuclides_list())
+
+    def __is_current(self,stamp):
+        '''
+        True if a cache made when the file was in the state stamp (see __get_stamp) can be used: the file was not
+        modified since, or less than refresh seconds passed and it has the same nuclides (see LazyReader).
+        '''
+        if stamp is None:
+            return False
+        if self.__get_mtime() == stamp[0]:
+            return True
+        if (self._refresh is None) or (time.monotonic()-stamp[1] >= self._refresh):
+            return False
+        return self.get_nuclides_list() == stamp[2]
         
     def __check_exist(self,path=None,group_name = None):
 
-        with h5py.File(self._file,'r') as f:
+        with self._open() as f:
             if path is None:
                 names = list(f.keys())   
             else:
@@ -155,15 +558,38 @@ class LazyReader:
         """
         Get the header of the .lazy file.
         """
-        with h5py.File(self._file,'r') as f:
+        with self._open() as f:
             return self.__convert_to_dict(f['info'])
     
+    def get_manifest(self):
+        """
+        Get the build manifest of the .lazy file as {nuclide : {stage : {"state" : str, "hash" : str}}}.
+        The dictionary is empty if the file (or its manifest) does not exist.
+        """
+        if (self._memory is None) and (storage.exists(self._file) is False):
+            return {}
+        with self._open() as f:
+            if "manifest" not in f:
+                return {}
+            manifest = {}
+            for name, group in f["manifest"].items():
+                manifest[name] = {stage : self.__convert_to_dict(sub) for stage, sub in group.items()}
+        return manifest
+    
     def get_nuclides_list(self, group_path = "nuclides"):
-        with h5py.File(self._file,'r') as f:
+        with self._open() as f:
             return list(f[group_path].keys())
+
+    def get_sources(self, group_path = "nuclides"):
+        """
+        Get the file where each nuclide is stored as {nuclide : path}: the .lazy file itself, or one of its base
+        files if it is an overlay (see LazyWriter.create_overlay).
+        """
+        with storage.open_file(self._file,'r') as f:
+            return {name : storage.get_source(f,group_path+"/"+name) for name in f[group_path].keys()}
             
     def get_parameters_labels(self,attempts=20):
-        with h5py.File(self._file,'r') as f:
+        with self._open() as f:
             names = self.get_nuclides_list()[:attempts]    
             temp = []
             for name in names:
@@ -198,7 +624,7 @@ class LazyReader:
         >>> reader.get_parameters(name="cumulative_thermal_fy_235u", variable_not_found = 0)
         
         """
-        with h5py.File(self._file,'r') as f:
+        with self._open() as f:
             temp = []
             for el in f[group_path].keys():
                 try:
@@ -211,7 +637,7 @@ class LazyReader:
                 temp = temp.astype(str)
         return temp
         
-    def get_data(self,name="dN_dE_tot", group_path="nuclides",sub_group = "data",E_min = 0, E_max = 12000,E_step = None):
+    def get_data(self,name="dN_dE_tot", group_path="nuclides",sub_group = "data",E_min = 0, E_max = 12000,E_step = None,nuclides=None,dtype=None):
         """
         Return the arrays labeled as *name* present in the dataset. The arrays are zero-padded and re-arranged 
         as matrix.
@@ -232,6 +658,11 @@ class LazyReader:
         E_step : float
             The energy step for each spectrum. If None, the value is taken from the header
             of the dataset. Default is None.
+        nuclides : list or ndarray
+            Names or indices (as in get_parameters, e.g. the output of select) of the nuclides to read, each at most once.
+            If None, all the nuclides are read. Default is None.
+        dtype : str or numpy dtype
+            Type of the returned matrix (e.g. "float32"). If None, float64 is used. Default is None.
             
         Returns
         -------
@@ -244,42 +675,92 @@ class LazyReader:
             e.g. :  data[i] = get_nuclide(loc=pos_ok[i])["dN_dE_tot"]
                     data[i] -> get_parameters("Q")[pos_ok[i]]
         pos_notok : ndarray
-            The indices of the nuclides which are not present in data. 
+            The indices of the nuclides which are not present in data. If nuclides is not None, only
+            the requested nuclides are considered. The indices always refer to the whole file.
         
         """
         if E_step is None:
             E_step = self.get_info()["E_step"]
             
-        energies = np.arange(0,E_max,step=E_step) #energy in the dataset
-        pos_min, pos_max = np.where((energies>=E_min)&(energies<=E_max))[0][[0,-1]]
+        energies, pos_min, pos_max = self.__get_window(E_min,E_max,E_step)
         data_lenght = int(pos_max-pos_min)
-        with h5py.File(self._file,'r') as f:
-            temp = []
+        with self._open() as f:
+            names = list(f[group_path].keys())
+            positions = self._get_positions(nuclides,names)
+            data = np.zeros((len(positions),data_lenght+1),dtype=dtype if dtype is not None else np.float64)
             pos_ok = []
             pos_notok = []
-            i = 0
-            for el in f[group_path].keys():
+            for i in positions:
                 try:
-                    value = np.array(f[group_path][el][sub_group][name])
-                    pos_ok.append(i)
+                    value = np.array(f[group_path][names[i]][sub_group][name])
                 except:
+                    value = np.zeros(0)
+                if value.size == 0: # not written yet in a SWMR session (see LazyWriter.start_swmr)
                     pos_notok.append(i)
-                    i+=1
                     continue
                 value = value[pos_min:pos_max+1]
-                value = np.append(value,np.zeros(data_lenght-len(value)+1))  
-                temp.append(value)
-                i+=1
-        energies = energies[pos_min:pos_max+1]
-        data = np.array(temp)
-        pos_ok = np.array(pos_ok)
-        pos_notok = np.array(pos_notok)
+                data[len(pos_ok),:len(value)] = value
+                pos_ok.append(i)
+        data = data[:len(pos_ok)]
+        pos_ok = np.array(pos_ok,dtype=int)
+        pos_notok = np.array(pos_notok,dtype=int)
         return data,energies,pos_ok,pos_notok
     
+    def __get_window(self,E_min,E_max,E_step):
+        '''
+        Energies between E_min and E_max and the corresponding positions in the spectra of the dataset.
+        '''
+        energies = np.arange(0,E_max,step=E_step) #energy in the dataset
+        pos_min, pos_max = np.where((energies>=E_min)&(energies<=E_max))[0][[0,-1]]
+        return energies[pos_min:pos_max+1], pos_min, pos_max
+    
+    def _get_positions(self,nuclides,names):
+        '''
+        Convert a list of names or indices of nuclides (also mixed), or a boolean mask, into indices of the whole file
+        (all of them if nuclides is None). ValueError is raised for unknown names, indices out of range and nuclides
+        given more than once.
+        '''
+        if nuclides is None:
+            return np.arange(len(names))
+        if np.ndim(nuclides) == 0:
+            nuclides = [nuclides]
+        mask = np.asarray(nuclides)
+        if mask.dtype.kind == "b":
+            if mask.shape != (len(names),):
+                raise ValueError("the mask of the nuclides has "+str(mask.size)+" values, the file "+str(len(names))+" nuclides")
+            return np.where(mask)[0]
+        index = {el : i for i, el in enumerate(names)}
+        positions = []
+        missing = []
+        for el in nuclides:
+            if isinstance(el,(int,np.integer)):
+                position = int(el) if 0 <= el < len(names) else None
+            else:
+                position = index.get(str(el))
+            if position is None:
+                missing.append(str(el))
+            positions.append(position)
+        if len(missing) > 0:
+            raise ValueError("nuclides not found: "+", ".join(missing))
+        positions = np.array(positions,dtype=int)
+        unique, counts = np.unique(positions,return_counts=True)
+        if np.any(counts > 1):
+            raise ValueError("nuclides given more than once: "+", ".join([str(names[el]) for el in unique[counts > 1]]))
+        return positions
+    
+    def __get_column(self,name,default=0):
+        '''
+        Column of the table (see get_table) with default instead of the missing values.
+        '''
+        table = self.get_table()
+        if name not in table:
+            return np.full(len(table["lazy_name"]),float(default))
+        return np.where(np.isnan(table[name]),default,table[name])
+    
     def get_nuclide(self,name=None,loc=None,group_path="nuclides"):
         subgroup1_name = "info"
         subgroup2_name = "data"
-        with h5py.File(self._file,'r') as f:
+        with self._open() as f:
             if name is not None:
                 nuclide_name = name
             if loc is not None:
@@ -292,33 +773,284 @@ class LazyReader:
             dic1['lazy_name'] = nuclide_name
         return dic1
         
-    def _evaluate_total_spectrum(self,loc,thr=0.2):
+    def get_transitions(self,name=None,loc=None,dense=False,group_path="nuclides"):
+        """
+        Read the spectra of the transitions of a nuclide (and their intensities, end-points and types).
+        
+        The spectra are returned as ragged arrays (see base_utilities.to_ragged): "transition_dN_dE_values" and
+        "transition_unc_dN_dE_values", with the offsets of the rows in "transition_offsets". The files written with
+        zero-padded matrices are converted (the trailing zeros of each row are dropped) unless dense is True.
+        
+        Parameters
+        ----------
+        name : str
+            Name of the nuclide.
+        loc : int
+            Position of the nuclide (as in get_parameters), used if name is None.
+        dense : bool
+            If True, return the zero-padded matrices "transition_dN_dE" and "transition_unc_dN_dE" instead.
+            Default is False.
+            
+        Returns
+        -------
+        transitions : dict
+            The transition_* entries of the "data" sub-group of the nuclide.
+        """
+        with self._open() as f:
+            if name is None:
+                name = self.get_nuclides_list()[loc]
+            data = f[group_path][name]["data"]
+            transitions = {key : np.array(data[key]) for key in ["transition_Emax","transition_intensity","transition_unc_intensity","transition_type"] if key in data}
+            if "transition_offsets" in data:
+                offsets = np.array(data["transition_offsets"])
+                values = np.array(data["transition_dN_dE_values"])
+                unc_values = np.array(data["transition_unc_dN_dE_values"])
+            else:
+                matrix = np.array(data["transition_dN_dE"])
+                unc_matrix = np.array(data["transition_unc_dN_dE"])
+                if dense is True:
+                    transitions.update({"transition_dN_dE" : matrix, "transition_unc_dN_dE" : unc_matrix})
+                    return transitions
+                nonzero = (matrix != 0) | (unc_matrix != 0)
+                lengths = np.where(np.any(nonzero,axis=1),matrix.shape[1]-np.argmax(nonzero[:,::-1],axis=1),0)
+                values, offsets = base_utilities.to_ragged([row[:n] for row, n in zip(matrix,lengths)])
+                unc_values, _ = base_utilities.to_ragged([row[:n] for row, n in zip(unc_matrix,lengths)])
+        if dense is True:
+            transitions["transition_dN_dE"] = base_utilities.ragged_to_dense(values,offsets)
+            transitions["transition_unc_dN_dE"] = base_utilities.ragged_to_dense(unc_values,offsets)
+        else:
+            transitions["transition_dN_dE_values"] = values
+            transitions["transition_unc_dN_dE_values"] = unc_values
+            transitions["transition_offsets"] = offsets
+        return transitions
+
+    def get_nuclide_info(self,name=None,loc=None,group_path="nuclides"):
+        """
+        Same as get_nuclide, but only the "info" sub-group is read (no spectra).
+        """
+        with self._open() as f:
+            if name is not None:
+                nuclide_name = name
+            if loc is not None:
+                nuclide_name = self.get_nuclides_list()[loc]
+            dic = self.__convert_to_dict(f[group_path][nuclide_name]["info"])
+            dic['lazy_name'] = nuclide_name
+        return dic
+
+    def get_nuclides_info(self,data_name="dN_dE_tot",group_path="nuclides"):
+        """
+        Read the "info" sub-group of every nuclide with a single access to the file.
+
+        Parameters
+        ----------
+        data_name : str
+            The key "has_data" of each dictionary is True if the nuclide has the dataset data_name
+            in its "data" sub-group. Default is "dN_dE_tot".
+
+        Returns
+        -------
+        dict
+            {nuclide : info dictionary, as returned by get_nuclide_info}.
+        """
+        infos = {}
+        with self._open() as f:
+            for nuclide_name, group in f[group_path].items():
+                dic = self.__convert_to_dict(group["info"]) if "info" in group else {}
+                dic['lazy_name'] = nuclide_name
+                dic['has_data'] = ("data" in group) and (data_name in group["data"]) and (group["data"][data_name].shape[0] > 0)
+                infos[nuclide_name] = dic
+        return infos
+
+    def get_table(self,group_path="nuclides",sub_group="info"):
+        """
+        Return the scalar parameters of all the nuclides as columns, read with a single access to the file.
+        The table is cached and read again only if the file is modified.
+
+        Besides the parameters, the table has the columns "lazy_name" (name of the nuclide), "A" (mass number),
+        "element" (e.g. "Rb") and "isomer" (0 for the ground state, k for the nuclides named *_km).
+
+        Returns
+        -------
+        table : dict
+            {column : ndarray}. The i-th entry of each column corresponds to the i-th nuclide, as in get_parameters.
+            The numeric columns are float, with nan if the parameter is not present for a nuclide. The other columns
+            are str, with "" if the parameter is not present.
+        """
+        cache = self._table
+        if (cache is not None) and self.__is_current(cache[0]):
+            return cache[1]
+        with self._lock:
+            cache = self._table
+            if (cache is None) or (self.__is_current(cache[0]) is False):
+                cache = self.__read_table(group_path,sub_group)
+                self._table = cache
+        return cache[1]
+
+    def __read_table(self,group_path,sub_group):
+        '''
+        Read the table (see get_table) and return its cache.
+        '''
+        stamp = self.__get_stamp()
+        with self._open() as f:
+            names = list(f[group_path].keys())
+            values = {}
+            for i, el in enumerate(names):
+                if sub_group not in f[group_path][el]:
+                    continue
+                for key, dataset in f[group_path][el][sub_group].items():
+                    if dataset.shape != ():
+                        continue
+                    value = dataset[()]
+                    values.setdefault(key,{})[i] = value.decode() if isinstance(value,bytes) else value
+        
+        table = {}
+        for key, column in values.items():
+            if all([isinstance(el,(int,float,np.number)) for el in column.values()]):
+                data = np.full(len(names),np.nan)
+            else:
+                data = np.full(len(names),"",dtype=object)
+                column = {i : str(el) for i, el in column.items()}
+            data[list(column.keys())] = list(column.values())
+            table[key] = data if data.dtype != object else data.astype(str)
+        
+        table["lazy_name"] = np.array(names,dtype=str)
+        parts = [re.match(r"(\d*)([A-Za-z]*)(?:_(\d+)m)?",el).groups() for el in names]
+        table["A"] = np.array([float(el[0]) if el[0] != "" else np.nan for el in parts])
+        table["element"] = np.array([el[1] for el in parts],dtype=str)
+        table["isomer"] = np.array([float(el[2]) if el[2] is not None else 0. for el in parts])
+        for data in table.values():
+            data.flags.writeable = False
+        return (stamp,table,{})
+
+    _OPERATORS = {ast.Eq : operator.eq, ast.NotEq : operator.ne, ast.Lt : operator.lt, ast.LtE : operator.le,
+                  ast.Gt : operator.gt, ast.GtE : operator.ge, ast.Add : operator.add, ast.Sub : operator.sub,
+                  ast.Mult : operator.mul, ast.Div : operator.truediv, ast.Pow : operator.pow, ast.Mod : operator.mod,
+                  ast.USub : operator.neg, ast.UAdd : operator.pos, ast.Not : np.logical_not}
+
+    def __like(self,column,pattern,name=None):
+        '''
+        Mask of the elements of a column matching a shell-style pattern (e.g. "9?Rb*").
+        The masks of the columns of the table (name is not None) are cached.
+        '''
+        cache = self._table
+        masks = cache[2] if (name is not None) and (cache is not None) and (cache[1].get(name) is column) else {}
+        if (name,pattern) in masks:
+            return masks[(name,pattern)]
+        regex = re.compile(fnmatch.translate(pattern))
+        mask = np.array([regex.match(el) is not None for el in np.asarray(column).astype(str)],dtype=bool)
+        mask.flags.writeable = False
+        masks[(name,pattern)] = mask
+        return mask
+
+    def __evaluate(self,node,table):
+        if isinstance(node,ast.Expression):
+            return self.__evaluate(node.body,table)
+        if isinstance(node,ast.Constant):
+            return node.value
+        if isinstance(node,(ast.List,ast.Tuple)):
+            return [self.__evaluate(el,table) for el in node.elts]
+        if isinstance(node,ast.Name):
+            if node.id not in table:
+                raise ValueError("unknown parameter in query: "+node.id)
+            return table[node.id]
+        if isinstance(node,ast.BoolOp):
+            function = np.logical_and if isinstance(node.op,ast.And) else np.logical_or
+            result = self.__evaluate(node.values[0],table)
+            for el in node.values[1:]:
+                result = function(result,self.__evaluate(el,table))
+            return result
+        if isinstance(node,ast.UnaryOp) and (type(node.op) in self._OPERATORS):
+            return self._OPERATORS[type(node.op)](self.__evaluate(node.operand,table))
+        if isinstance(node,ast.BinOp) and (type(node.op) in self._OPERATORS):
+            return self._OPERATORS[type(node.op)](self.__evaluate(node.left,table),self.__evaluate(node.right,table))
+        if isinstance(node,ast.Compare):
+            result = True
+            left = self.__evaluate(node.left,table)
+            for op, el in zip(node.ops,node.comparators):
+                right = self.__evaluate(el,table)
+                if isinstance(op,(ast.In,ast.NotIn)):
+                    mask = np.isin(left,right)
+                    mask = mask if isinstance(op,ast.In) else ~mask
+                elif type(op) in self._OPERATORS:
+                    mask = self._OPERATORS[type(op)](left,right)
+                else:
+                    raise ValueError("unsupported operator in query: "+type(op).__name__)
+                result = np.logical_and(result,mask)
+                left = right
+            return result
+        if isinstance(node,ast.Call) and isinstance(node.func,ast.Name) and (len(node.keywords) == 0):
+            args = [self.__evaluate(el,table) for el in node.args]
+            if (node.func.id == "like") and (len(args) == 2):
+                return self.__like(args[0],args[1],node.args[0].id if isinstance(node.args[0],ast.Name) else None)
+            if (node.func.id == "contains") and (len(args) == 2):
+                return np.char.find(args[0].astype(str),args[1]) >= 0
+            if (node.func.id == "isnan") and (len(args) == 1):
+                return np.isnan(args[0])
+            if (node.func.id == "abs") and (len(args) == 1):
+                return np.abs(args[0])
+            raise ValueError("unsupported function in query: "+node.func.id)
+        raise ValueError("unsupported expression in query: "+ast.dump(node))
+
+    def select(self,query=None):
+        """
+        Select the nuclides satisfying a condition on their parameters. The condition is evaluated 
+        vectorized on the table returned by get_table.
+        
+        Parameters
+        ----------
+        query : string
+            Boolean expression with the parameters (and the columns "lazy_name", "A", "element", "isomer")
+            as variables. Supported: and, or, not, comparisons (also chained and "in"/"not in" with a list),
+            + - * / ** %, and the functions like(column, pattern) (shell-style pattern, e.g. "9?Rb*"),
+            contains(column, text), isnan(column), abs(column). A missing numeric parameter is nan, so
+            every comparison with it is False.
+            
+        Returns
+        -------
+        pos : ndarray
+            The indices of the selected nuclides, as in get_parameters and get_nuclide(loc=...).
+            
+        Examples
+        --------
+        >>> reader.select("Q > 12000 and z < 50 and tag == 'ensdf'")
+        >>> reader.select("like(lazy_name, '*_1m') or element in ['Rb','Cs']")
+        """
+        table = self.get_table()
+        mask = self.__evaluate(ast.parse(query,mode="eval"),table)
+        mask = np.broadcast_to(np.asarray(mask,dtype=bool),table["lazy_name"].shape)
+        return np.where(mask)[0]
+
+    def _evaluate_total_spectrum(self,loc,thr=0.2,transitions=None):
         """
         Return the neutrino spectrum from the neuclide in loc position.
         The uncertainty is given considering also the uncertainty on the BRs.
+        transitions is the output of get_transitions, read if None.
         """
-        nuc = self.get_nuclide(loc=loc)
+        nuc = self.get_transitions(loc=loc) if transitions is None else transitions
+        values, unc_values, offsets = nuc["transition_dN_dE_values"], nuc["transition_unc_dN_dE_values"], nuc["transition_offsets"]
+        intensity = nuc["transition_intensity"]
+        rows, _ = base_utilities.ragged_indices(offsets)
    
         # Normalize the transition spectrum to 1 insted of it's BR.
-        y =(nuc["transition_dN_dE"].T/nuc["transition_intensity"]).T
-        y_er = (nuc["transition_unc_dN_dE"].T/nuc["transition_intensity"]).T
+        y = np.divide(values,intensity[rows],out=np.zeros(len(values)),where=intensity[rows]!=0)
+        y_er = np.divide(unc_values,intensity[rows],out=np.zeros(len(values)),where=intensity[rows]!=0)
     
         unc_BR = []
-        for i in range(len(nuc["transition_intensity"])):
-            unc_BR.append(base_utilities.short_to_std(nuc["transition_intensity"][i],nuc["transition_unc_intensity"][i]))
-        unc_BR = np.array(unc_BR)
+        for i in range(len(intensity)):
+            unc_BR.append(base_utilities.short_to_std(intensity[i],nuc["transition_unc_intensity"][i]))
+        unc_BR = np.array(unc_BR,dtype=float)
 
         #substitute the BR with unknown uncertainty with an uncertainty equal to thr*BR
-        ii = np.where(unc_BR==None)[0]
-        unc_BR[ii] = nuc["transition_intensity"][ii]*thr
+        ii = np.where(np.isnan(unc_BR))[0]
+        unc_BR[ii] = intensity[ii]*thr
     
-        y_er2 = np.sum( ((y.T*unc_BR).T)**2 + ((y_er.T*nuc["transition_intensity"]).T)**2, axis=0)**0.5
+        y_er2 = base_utilities.ragged_sum((y*unc_BR[rows])**2 + (y_er*intensity[rows])**2,offsets)**0.5
     
-        return np.sum((nuc["transition_dN_dE"]),axis=0),y_er2
+        return base_utilities.ragged_sum(values,offsets),y_er2
         
         
     def get_nu_spectra(self,E_min = 0, E_max=12e3, unc_BR = True, default_unc = 0.2, 
-                       force_normalization=True,thr_norm=0.99):
+                       force_normalization=True,thr_norm=0.99,nuclides=None,dtype=None):
         '''
         Return the neutrino spectra of the nuclides in the dataset with their uncertainties.
         
@@ -339,6 +1071,12 @@ class LazyReader:
             Default is True.
         thr_norm : float
             Only if force_normalization is True. Default is 0.99.
+        nuclides : list or ndarray
+            Names or indices (as in get_parameters, e.g. the output of select) of the nuclides to process.
+            If None, all the nuclides are processed. Default is None.
+        dtype : str or numpy dtype
+            Type of the spectra and uncertainties matrices (e.g. "float32", half of the memory). The normalization
+            integrals and the BR uncertainties are evaluated in float64. If None, float64 is used. Default is None.
             
         Returns
         -------
@@ -357,42 +1095,206 @@ class LazyReader:
         
         '''
     
-        spectra, energy, posOK, posnotOK = self.get_data("dN_dE_tot",E_min = E_min, E_max=E_max)
+        spectra, energy, posOK, posnotOK = self.get_data("dN_dE_tot",E_min = E_min, E_max=E_max,nuclides=nuclides,dtype=dtype)
     
         if unc_BR is False:
-            spectra_er, _, _, _ = self.get_data("unc_dN_dE",E_min = E_min, E_max=E_max)
+            spectra_er, _, _, _ = self.get_data("unc_dN_dE",E_min = E_min, E_max=E_max,nuclides=posOK,dtype=dtype)
         
             #if the uncertainty is unkwnown, use the defalt_unc
             pos_to_fix = np.where(np.mean(spectra_er,axis=1)==0)[0]
             for p in pos_to_fix:
                 spectra_er[p] = spectra[p]*default_unc
         else:
-            spectra_er = np.zeros((len(posOK),int(E_max)))
-            i = 0
-            for p in posOK:
-                try:
-                    _, temp = self._evaluate_total_spectrum(self,p,thr=default_unc)
-                    temp = temp[:spectra.shape[1]]  
-                except:
-                    #if the uncertainty is unkwnown, use the defalt_unc
-                    temp = spectra[i]*default_unc
-                spectra_er[i,:len(temp)] = temp
-                i += 1
+            spectra_er = np.zeros(spectra.shape,dtype=spectra.dtype)
+            start = int(round(energy[0]/self.get_info()["E_step"])) # position of E_min in the spectra of the transitions
+            for i, p in enumerate(posOK):
+                temp = self.__get_br_uncertainty(p,spectra[i],default_unc,start=start)
+                #if the uncertainty is unkwnown, use the defalt_unc
+                spectra_er[i] = temp if temp is not None else spectra[i]*default_unc
           
         if force_normalization is True:
             for i in range(spectra.shape[0]):
-                I = integrate.simpson(spectra[i],x=energy)
-                if I >= thr_norm:
+                I = self.__get_normalization(spectra[i],energy,thr_norm)
+                if I is not None:
                     spectra[i] = spectra[i]/I
                     spectra_er[i] = spectra_er[i]/I        
     
         return energy, spectra, spectra_er, posOK, posnotOK
+    
+    def __get_br_uncertainty(self,loc,spectrum,default_unc,start=0):
+        '''
+        Uncertainty of the spectrum of the nuclide in loc position, with the uncertainty on the BRs (see get_nu_spectra).
+        spectrum starts at the start-th energy bin. Return None if the nuclide has no transitions (or their
+        intensities are missing), the errors in the evaluation are raised.
+        '''
+        try:
+            transitions = self.get_transitions(loc=loc)
+        except KeyError: # the transitions are not stored
+            return None
+        if (len(transitions.get("transition_intensity",[])) == 0) or ("transition_unc_intensity" not in transitions):
+            return None
+        _, temp = self._evaluate_total_spectrum(loc,thr=default_unc,transitions=transitions)
+        temp = temp[start:start+len(spectrum)]
+        uncertainty = np.zeros(len(spectrum))
+        uncertainty[:len(temp)] = temp
+        return uncertainty
+    
+    def __get_normalization(self,spectrum,energy,thr_norm):
+        '''
+        Integral of the spectrum if it is greater than thr_norm (the spectrum has to be normalized), None otherwise.
+        '''
+        I = integrate.simpson(np.asarray(spectrum,dtype=np.float64),x=energy)
+        if I >= thr_norm:
+            return I
+        return None
+    
+    def __read_row(self,dataset,start,stop):
+        '''
+        Read dataset[start:stop] from the file, zero-padded to stop-start elements.
+        '''
+        row = np.zeros(stop-start)
+        value = dataset[start:min(stop,dataset.shape[0])] if start < dataset.shape[0] else []
+        row[:len(value)] = value
+        return row
+    
+    def get_total_spectrum_chunked(self,labels=["cumulative_thermal_fy_235u","cumulative_thermal_fy_239Pu","cumulative_thermal_fy_241Pu","cumulative_fast_fy_238u"],
+                                   labels_unc=["unc_ct_235u","unc_ct_239Pu","unc_ct_241Pu","unc_cf_238u"],
+                                   ffs = [0.564,0.076,0.304,0.056], ffs_unc = None, E_min = 0, E_max = 12e3, unc_BR = True, 
+                                   default_unc = 0.2, force_normalization = True, thr_norm = 0.99, nuclides = None,
+                                   memory_budget = 2**28, n_threads = 1):
+        '''
+        Out-of-core version of get_nu_spectra + get_total_spectrum, for fine energy grids. The spectra are never 
+        loaded as a whole: the sum is done on tiles (blocks of nuclides x blocks of energies) read from the file,
+        so that the memory used by the tiles stays within *memory_budget*. The result is the same as the 
+        in-memory path, apart from the rounding due to the different order of the sums.
+        
+        The file is read twice: first each spectrum is read once as a whole (one at a time) to evaluate its 
+        normalization, then the tiles are read and summed. With unc_BR, the uncertainty of each spectrum (see
+        get_nu_spectra) is evaluated in the first pass and kept for the tiles while the kept ones take less than half
+        of memory_budget; the others are evaluated again once for each block of nuclides, not for each tile.
+        
+        Parameters
+        ----------
+        labels, labels_unc, ffs, ffs_unc :
+            See get_total_spectrum.
+        E_min, E_max, unc_BR, default_unc, force_normalization, thr_norm, nuclides :
+            See get_nu_spectra.
+        memory_budget : int
+            Maximum memory in bytes used by the tiles being processed. Default is 2**28 (256 MB).
+        n_threads : int
+            Number of threads processing the tiles at the same time. Default is 1.
+            
+        Returns
+        -------
+            energy : ndarray
+                Array with the energy in keV.
+            spectrum : ndarray
+                The reactor antineutrino spectrum.
+            spectrum_err : ndarray
+                The uncertainties in the reactor antineutrino spectrum.
+        '''
+        group_path, sub_group = "nuclides", "data"
+        energy, pos_min, _ = self.__get_window(E_min,E_max,self.get_info()["E_step"])
+        length = len(energy)
+        
+        with self._open() as f:
+            names = list(f[group_path].keys())
+            posOK = []
+            scales = []
+            modes = []
+            br_uncs = [] # uncertainties with the BRs kept for the tiles (None if evaluated again)
+            kept = 0
+            for p in self._get_positions(nuclides,names):
+                try:
+                    data = f[group_path][names[p]][sub_group]
+                    if data["dN_dE_tot"].shape[0] == 0: # see get_data
+                        continue
+                    spectrum = self.__read_row(data["dN_dE_tot"],pos_min,pos_min+length)
+                except:
+                    continue
+                posOK.append(p)
+                #if the uncertainty is unkwnown, use the defalt_unc
+                if unc_BR is False:
+                    unc = self.__read_row(data["unc_dN_dE"],pos_min,pos_min+length)
+                    modes.append("data" if np.mean(unc) != 0 else "default")
+                else:
+                    unc = self.__get_br_uncertainty(p,spectrum,default_unc,start=pos_min)
+                    modes.append("BR" if unc is not None else "default")
+                    if (unc is not None) and (kept+unc.nbytes <= memory_budget//2):
+                        kept += unc.nbytes
+                    else:
+                        unc = None
+                    br_uncs.append(unc)
+                scales.append(self.__get_normalization(spectrum,energy,thr_norm) if force_normalization is True else None)
+        posOK = np.array(posOK,dtype=int)
+        
+        sum_cfy = np.zeros(len(posOK))
+        sum_cfy_unc = np.zeros(len(posOK))
+        for i in range(len(labels)):
+            cfy_selected = self.__get_column(labels[i])[posOK]
+            sum_cfy += cfy_selected*ffs[i]
+            sum_cfy_unc += (self.__get_column(labels_unc[i])[posOK]*ffs[i])**2
+            if ffs_unc is not None:
+                sum_cfy_unc += (cfy_selected*ffs_unc[i])**2
+        sum_cfy_unc = sum_cfy_unc**0.5
+        
+        # each tile holds ~4 matrices of float64 (spectra, uncertainties and temporaries), 5 with the uncertainties of
+        # the BRs of its block; the memory of the kept uncertainties is not available for the tiles
+        cells = max(int((memory_budget-kept)//((5 if unc_BR is True else 4)*8*max(n_threads,1))),1)
+        # whole spectra if possible, the energies are split only if a spectrum does not fit in the budget
+        width = min(length,cells)
+        rows = max(cells//width,1)
+        
+        def evaluate_block(f,n0):
+            block = range(n0,min(n0+rows,len(posOK)))
+            uncs = {}
+            for i in block:
+                if modes[i] == "BR":
+                    uncs[i] = br_uncs[i]
+                    if uncs[i] is None:
+                        full = self.__read_row(f[group_path][names[posOK[i]]][sub_group]["dN_dE_tot"],pos_min,pos_min+length)
+                        uncs[i] = self.__get_br_uncertainty(posOK[i],full,default_unc,start=pos_min)
+            partial = np.zeros(length)
+            partial_err = np.zeros(length)
+            for e0 in range(0,length,width):
+                e1 = min(e0+width,length)
+                spectra = np.zeros((len(block),e1-e0))
+                spectra_er = np.zeros((len(block),e1-e0))
+                for j, i in enumerate(block):
+                    data = f[group_path][names[posOK[i]]][sub_group]
+                    spectra[j] = self.__read_row(data["dN_dE_tot"],pos_min+e0,pos_min+e1)
+                    if modes[i] == "data":
+                        spectra_er[j] = self.__read_row(data["unc_dN_dE"],pos_min+e0,pos_min+e1)
+                    elif modes[i] == "default":
+                        spectra_er[j] = spectra[j]*default_unc
+                    else:
+                        spectra_er[j] = uncs[i][e0:e1]
+                    if scales[i] is not None:
+                        spectra[j] = spectra[j]/scales[i]
+                        spectra_er[j] = spectra_er[j]/scales[i]
+                spectra_cfy = (spectra.T * sum_cfy[block]).T
+                spectra_cfy_err = ((spectra_er.T * sum_cfy[block]).T)**2
+                spectra_cfy_err += ((spectra.T*sum_cfy_unc[block]).T)**2
+                partial[e0:e1] = np.sum(spectra_cfy,axis=0)
+                partial_err[e0:e1] = np.sum(spectra_cfy_err,axis=0)
+            return partial, partial_err
+        
+        spectrum = np.zeros(length)
+        spectrum_err = np.zeros(length)
+        # the file is opened once: h5py serializes the reads (the directory store does not), the threads overlap them with the sums
+        with self._open() as f, futures.ThreadPoolExecutor(max_workers=max(n_threads,1)) as pool:
+            jobs = [pool.submit(evaluate_block,f,n0) for n0 in range(0,len(posOK),rows)]
+            for job in jobs:
+                partial, partial_err = job.result()
+                spectrum += partial
+                spectrum_err += partial_err
+        return energy, spectrum, spectrum_err**0.5
      
 
     def get_total_spectrum(self,labels=["cumulative_thermal_fy_235u","cumulative_thermal_fy_239Pu","cumulative_thermal_fy_241Pu","cumulative_fast_fy_238u"],
                            labels_unc=["unc_ct_235u","unc_ct_239Pu","unc_ct_241Pu","unc_cf_238u"],
                            ffs = [0.564,0.076,0.304,0.056], ffs_unc = None, do_sum = True,
-                           spectra=None,spectra_er=None,posOK=None):
+                           spectra=None,spectra_er=None,posOK=None,nuclides=None,dtype=None):
 
         '''
         Return the neutrino spectrum with its uncertainty given the fission fractions.
@@ -412,10 +1314,17 @@ class LazyReader:
             If True, sum all the spectra to return the total antineutrino spectrum. Otherwise return a matrix. Default is True.
         spectra : ndarray
             The matrix containing all the spectra to be combined. It should be the output of "get_nu_spectra". Default is None.
+            If its type is not float64 (see the dtype option of get_nu_spectra), the sums are done in float64.
         spectra_er : ndarray
             The matrix containing all the uncertainties for the spectra. It should be the output of "get_nu_spectra". Default is None.
         posOK : ndarray
             The indices to match the rows of *spectra* with the output of get_parameters and get_nuclide. It should be the output of "get_nu_spectra". Default is None.
+        nuclides : list or ndarray
+            Names or indices (as in get_parameters, e.g. the output of select) of the nuclides to combine. If spectra is given, 
+            only its rows corresponding to these nuclides are used. If spectra is None, the spectra of these nuclides are evaluated 
+            with get_nu_spectra (default arguments). If None, all the nuclides are used. Default is None.
+        dtype : str or numpy dtype
+            Only if spectra is None: type of the spectra evaluated with get_nu_spectra (e.g. "float32"). Default is None.
             
         Returns
         -------
@@ -427,19 +1336,36 @@ class LazyReader:
         
     
 
+        if spectra is None:
+            _, spectra, spectra_er, posOK, _ = self.get_nu_spectra(nuclides=nuclides,dtype=dtype)
+        elif nuclides is not None:
+            rows = np.where(np.isin(posOK,self._get_positions(nuclides,self.get_table()["lazy_name"])))[0]
+            spectra, spectra_er, posOK = spectra[rows], spectra_er[rows], posOK[rows]
+
         sum_cfy = np.zeros(len(posOK))
         sum_cfy_unc = np.zeros(len(posOK))
     
         for i in range(len(labels)):
-            cfy_selected = self.get_parameters(labels[i] ,variable_not_found=0)
-            sum_cfy += cfy_selected[posOK]*ffs[i]
+            cfy_selected = self.__get_column(labels[i])[posOK]
+            sum_cfy += cfy_selected*ffs[i]
         
-            sum_cfy_unc += (self.get_parameters(labels_unc[i],variable_not_found=0)[posOK]*ffs[i])**2
+            sum_cfy_unc += (self.__get_column(labels_unc[i])[posOK]*ffs[i])**2
             if ffs_unc is not None:
                 sum_cfy_unc += (cfy_selected*ffs_unc[i])**2
         
         sum_cfy_unc = sum_cfy_unc**0.5
 
+        if (do_sum is True) and (spectra.dtype != np.float64):
+            # reduced precision spectra (see get_nu_spectra): the sums are done in float64, a block of rows at a time
+            spectrum = np.zeros(spectra.shape[1])
+            spectrum_err = np.zeros(spectra.shape[1])
+            for i in range(0,spectra.shape[0],256):
+                block = spectra[i:i+256].astype(np.float64)
+                block_er = spectra_er[i:i+256].astype(np.float64)
+                spectrum += np.sum((block.T * sum_cfy[i:i+256]).T,axis=0)
+                spectrum_err += np.sum(((block_er.T * sum_cfy[i:i+256]).T)**2 + ((block.T*sum_cfy_unc[i:i+256]).T)**2,axis=0)
+            return spectrum, spectrum_err**0.5
+
         spectra_cfy = (spectra.T * sum_cfy).T
     
         spectra_cfy_err = ((spectra_er.T * sum_cfy).T)**2
@@ -451,3 +1377,485 @@ class LazyReader:
             return spectrum,  spectrum_err
         else:
             return spectra_cfy, spectra_cfy_err
+
+    def __get_envelope(self,E_min=0,E_max=12e3,region_width=500.):
+        '''
+        Maximum and minimum of each spectrum (see get_nu_spectra) in energy regions of width region_width.
+        The envelope is evaluated once (all the spectra are read, but not kept) and cached until the file is modified,
+        together with the caches of get_total_spectrum_fast (kept nuclides and their spectra).
+        '''
+        key = (E_min,E_max,region_width)
+        cache = self._envelope
+        if (cache is not None) and (cache[0] == key) and self.__is_current(cache[1]):
+            return cache[2:]
+        with self._lock:
+            cache = self._envelope
+            if (cache is None) or (cache[0] != key) or (self.__is_current(cache[1]) is False):
+                cache = self.__read_envelope(key)
+                self._envelope = cache
+        return cache[2:]
+
+    def __read_envelope(self,key):
+        '''
+        Evaluate the envelope (see __get_envelope) and return its cache, with empty caches of the kept nuclides and
+        of their spectra.
+        '''
+        E_min, E_max, region_width = key
+        stamp = self.__get_stamp()
+        energy, spectra, spectra_er, posOK, _ = self.get_nu_spectra(E_min=E_min,E_max=E_max)
+        regions = np.floor((energy-energy[0])/region_width).astype(int)
+        starts = np.where(np.diff(regions,prepend=-1) != 0)[0]
+        env_max = np.maximum.reduceat(spectra,starts,axis=1) if len(posOK) > 0 else np.zeros((0,len(starts)))
+        env_min = np.minimum.reduceat(spectra,starts,axis=1) if len(posOK) > 0 else np.zeros((0,len(starts)))
+        envelope = {"energy" : energy,"regions" : regions,"max" : env_max,"min" : env_min,"posOK" : posOK}
+        for data in envelope.values():
+            data.flags.writeable = False
+        return (key,stamp,envelope,collections.OrderedDict(),collections.OrderedDict())
+
+    def get_total_spectrum_fast(self,tol=1e-3,labels=["cumulative_thermal_fy_235u","cumulative_thermal_fy_239Pu","cumulative_thermal_fy_241Pu","cumulative_fast_fy_238u"],
+                                labels_unc=["unc_ct_235u","unc_ct_239Pu","unc_ct_241Pu","unc_cf_238u"],
+                                ffs = [0.564,0.076,0.304,0.056], ffs_unc = None, E_min = 0, E_max = 12e3, region_width = 500.):
+        '''
+        Approximate version of get_total_spectrum: the nuclides whose contribution is negligible are skipped,
+        and an upper bound of the neglected part is returned together with the spectrum.
+        
+        The maximum possible contribution of each nuclide in each energy region is its cumulative yield (weighted
+        with the fission fractions) times the maximum of its spectrum in the region. The nuclides with the smallest
+        contributions are skipped as long as, in every region, the sum of their maximum contributions is lower than
+        tol times a lower bound of the peak of the total spectrum.
+        
+        The envelope is evaluated once, reading all the spectra, and cached until the file is modified: it takes
+        2*8 bytes for each nuclide and energy region. The kept nuclides are cached for the last KEPT_CACHE values of
+        tol, labels and ffs, and the spectra of each set of kept nuclides (2*8 bytes for each kept nuclide and energy
+        bin) for the last ones within KEPT_MEMORY bytes, so that a scan of the fission fractions reads the spectra only
+        when the kept nuclides change. Use clear_cache to free this memory.
+        
+        Parameters
+        ----------
+        tol : float
+            Maximum neglected contribution, relative to the peak of the total spectrum. With tol = 0, only the nuclides
+            which do not contribute at all are skipped. Default is 1e-3.
+        labels, labels_unc, ffs, ffs_unc :
+            See get_total_spectrum.
+        E_min : float
+            The lowest energy in keV. Default is 0.
+        E_max : float
+            The highest energy in keV. Default is 12000.
+        region_width : float
+            Width in keV of the energy regions used to bound the contributions. Narrower regions give tighter bounds
+            (and fewer kept nuclides), but a larger envelope to cache. Default is 500.
+            
+        Returns
+        -------
+            spectrum : ndarray
+                The reactor antineutrino spectrum evaluated with the kept nuclides.
+            spectrum_err : ndarray
+                Its uncertainty (kept nuclides only).
+            bound : ndarray
+                Upper bound of the neglected part of the spectrum in each energy bin:
+                0 <= full spectrum - spectrum <= bound.
+            posOK : ndarray
+                The indices (as in get_parameters) of the kept nuclides.
+        '''
+        envelope, kept, rows = self.__get_envelope(E_min=E_min,E_max=E_max,region_width=region_width)
+        key = (tol,tuple(labels),tuple(ffs))
+        with self._lock:
+            cache = kept.get(key)
+            if cache is not None:
+                kept.move_to_end(key)
+        if cache is None:
+            weight = np.zeros(len(envelope["posOK"]))
+            for i in range(len(labels)):
+                weight += self.__get_column(labels[i])[envelope["posOK"]]*ffs[i]
+            contribution = (envelope["max"].T*weight).T
+            lower = np.max(np.sum((envelope["min"].T*weight).T,axis=0),initial=0) # the total spectrum peak is at least this
+            
+            order = np.argsort(np.max(contribution,axis=1,initial=0),kind="stable")
+            neglected = np.cumsum(contribution[order],axis=0)
+            n_skip = np.argmin(np.append(np.all(neglected <= tol*lower,axis=1),False)) # longest prefix within the tolerance
+            skip = np.sort(order[:n_skip])
+            keep = np.sort(order[n_skip:])
+            bound_regions = np.sum(contribution[skip],axis=0)
+            cache = (keep,bound_regions[envelope["regions"]])
+            for data in cache:
+                data.flags.writeable = False
+            with self._lock:
+                kept[key] = cache
+                while len(kept) > self.KEPT_CACHE:
+                    kept.popitem(last=False)
+        
+        keep, bound = cache
+        spectra = self.__get_kept_spectra(envelope,rows,keep,E_min,E_max)
+        spectrum, spectrum_err = self.get_total_spectrum(labels=labels,labels_unc=labels_unc,ffs=ffs,ffs_unc=ffs_unc,
+                                                         spectra=spectra[1],spectra_er=spectra[2],posOK=spectra[0])
+        return spectrum, spectrum_err, bound.copy(), spectra[0]
+
+    def __get_kept_spectra(self,envelope,rows,keep,E_min,E_max):
+        '''
+        posOK, spectra and spectra_er (see get_nu_spectra) of the kept nuclides of get_total_spectrum_fast, cached in
+        rows for the last sets of kept nuclides within KEPT_MEMORY bytes.
+        '''
+        key = keep.tobytes()
+        with self._lock:
+            cache = rows.get(key)
+            if cache is not None:
+                rows.move_to_end(key)
+                return cache
+        _, spectra, spectra_er, posOK, _ = self.get_nu_spectra(E_min=E_min,E_max=E_max,nuclides=envelope["posOK"][keep])
+        cache = (posOK,spectra,spectra_er)
+        for data in cache:
+            data.flags.writeable = False
+        with self._lock:
+            rows[key] = cache
+            while sum([el[1].nbytes+el[2].nbytes for el in rows.values()]) > self.KEPT_MEMORY:
+                rows.popitem(last=False)
+        return cache
+
+    def fit_spectrum(self,name=None,loc=None,degree=3,tol=1e-4,max_width=1000.,max_iterations=20,data_name="dN_dE_tot",group_path="nuclides"):
+        """
+        Compact representation of the spectrum of a nuclide: a piecewise polynomial (see base_utilities.fit_piecewise_polynomial),
+        which can be evaluated at any energy without the energy grid of the file (see evaluate).
+        
+        The end-points of the transitions (transition_Emax) are breakpoints, so the jumps and kinks of the spectrum
+        are reproduced exactly and each polynomial fits a smooth part of it. The intervals are at most max_width keV wide,
+        and they are halved until the largest difference with the stored spectrum is lower than tol times its peak
+        (or they are too short to be split).
+        
+        Parameters
+        ----------
+        name : str
+            Name of the nuclide.
+        loc : int
+            Position of the nuclide (as in get_parameters), used if name is None.
+        degree : int
+            Degree of the polynomials. Default is 3.
+        tol : float
+            Target accuracy, relative to the peak of the spectrum. Default is 1e-4.
+        max_width : float
+            Maximum width in keV of the intervals before the refinement. Default is 1000.
+        max_iterations : int
+            Maximum number of refinements. Default is 20.
+        data_name : str
+            Spectrum to fit. Default is "dN_dE_tot".
+            
+        Returns
+        -------
+        fit : dict or None
+            "breakpoints" (keV) and "coefficients" of the polynomials, "integral" (integral of the stored spectrum between
+            0 and 12000 keV, used for the normalization as in get_nu_spectra) and "max_error" (largest difference with the
+            stored spectrum, relative to its peak). None if the nuclide has no spectrum.
+            It is stored in the "fit" sub-group of the nuclide: LazyWriter.write_nuclide_data(name,dtype="fit",dictionary=fit).
+        """
+        E_step = self.get_info()["E_step"]
+        with self._open() as f:
+            if name is None:
+                name = self.get_nuclides_list()[loc]
+            data = f[group_path][name].get("data")
+            if (data is None) or (data_name not in data) or (data[data_name].shape[0] == 0):
+                return None
+            spectrum = np.array(data[data_name],dtype=np.float64)
+            endpoints = np.array(data["transition_Emax"],dtype=float).ravel() if "transition_Emax" in data else np.zeros(0)
+        energy = np.arange(len(spectrum))*E_step
+        
+        nonzero = np.where(spectrum != 0)[0]
+        end = max(energy[nonzero[-1]]+E_step if len(nonzero) > 0 else E_step,np.max(endpoints,initial=0))
+        knots = np.unique(np.concatenate([[0.,end],endpoints[(endpoints > 0) & (endpoints < end)]]))
+        n_split = np.ceil(np.diff(knots)/max_width).astype(int)
+        knots = np.concatenate([np.linspace(a,b,n+1)[:-1] for a, b, n in zip(knots[:-1],knots[1:],n_split)]+[[end]])
+        
+        peak = np.max(np.abs(spectrum),initial=0)
+        for iteration in range(max_iterations+1):
+            coefficients = base_utilities.fit_piecewise_polynomial(energy,spectrum,knots,degree)
+            error = np.abs(base_utilities.evaluate_piecewise_polynomial(energy,knots,coefficients)-spectrum)
+            segment = np.searchsorted(knots,energy,side="right")-1
+            inside = segment < len(knots)-1
+            segment_error = np.zeros(len(knots)-1)
+            np.maximum.at(segment_error,segment[inside],error[inside])
+            split = (segment_error > tol*peak) & (np.bincount(segment[inside],minlength=len(knots)-1) > 2*(degree+1))
+            if (iteration == max_iterations) or not np.any(split):
+                break
+            knots = np.sort(np.concatenate([knots,0.5*(knots[:-1]+knots[1:])[split]]))
+        
+        window, pos_min, pos_max = self.__get_window(0,12e3,E_step)
+        integral = integrate.simpson(self.__read_row(spectrum,pos_min,pos_max+1),x=window)
+        return {"breakpoints" : knots, "coefficients" : coefficients, "integral" : integral,
+                "max_error" : np.max(error,initial=0)/peak if peak > 0 else 0.}
+
+    def get_fits(self,nuclides=None,group_path="nuclides"):
+        """
+        Read the fits of the spectra stored in the file (see fit_spectrum and scripts/fitLazySpectra.py).
+        The fits are cached and read again only if the file is modified.
+        
+        Parameters
+        ----------
+        nuclides : list or ndarray
+            Names or indices (as in get_parameters) of the nuclides to read. If None, all the nuclides are read. Default is None.
+            
+        Returns
+        -------
+        fits : dict
+            "breakpoints" and "coefficients" of the nuclides, concatenated, with "offsets": the i-th nuclide has the
+            breakpoints offsets[i]:offsets[i+1] and the polynomials offsets[i]-i:offsets[i+1]-i-1. "integral" and
+            "max_error" have one entry for each nuclide (see fit_spectrum), "posOK" are their indices (as in get_parameters).
+            The nuclides without fit are not returned.
+        """
+        cache = self._fits
+        if (cache is None) or (self.__is_current(cache[0]) is False):
+            with self._lock:
+                cache = self._fits
+                if (cache is None) or (self.__is_current(cache[0]) is False):
+                    cache = self.__read_fits(group_path)
+                    self._fits = cache
+        fits = cache[1]
+        
+        positions = self._get_positions(nuclides,self.get_table()["lazy_name"])
+        posOK = np.array([i for i in positions if i in fits],dtype=int)
+        selected = [fits[i] for i in posOK]
+        breakpoints, offsets = base_utilities.to_ragged([el["breakpoints"] for el in selected])
+        degree = max([el["coefficients"].shape[1] for el in selected],default=1)
+        coefficients = np.zeros((len(breakpoints)-len(selected),degree))
+        row = 0
+        for el in selected:
+            coefficients[row:row+len(el["coefficients"]),:el["coefficients"].shape[1]] = el["coefficients"]
+            row += len(el["coefficients"])
+        return {"breakpoints" : breakpoints, "coefficients" : coefficients, "offsets" : offsets,
+                "integral" : np.array([float(el["integral"]) for el in selected]),
+                "max_error" : np.array([float(el["max_error"]) for el in selected]), "posOK" : posOK}
+
+    def __read_fits(self,group_path):
+        '''
+        Read the fits (see get_fits) and return their cache.
+        '''
+        stamp = self.__get_stamp()
+        fits = {}
+        missing = 0
+        with self._open() as f:
+            for i, (el, group) in enumerate(f[group_path].items()):
+                if "fit" in group:
+                    fits[i] = {key : np.array(group["fit"][key]) for key in ["breakpoints","coefficients","integral","max_error"]}
+                    for data in fits[i].values():
+                        data.flags.writeable = False
+                elif ("data" in group) and ("dN_dE_tot" in group["data"]) and (group["data"]["dN_dE_tot"].shape[0] > 0):
+                    missing += 1
+        if missing > 0:
+            base_utilities.log("Warning: "+str(missing)+" nuclides with spectra have no fit (see fitLazySpectra.py)",level=1)
+        return (stamp,fits)
+
+    def __select_fits(self,fits,mask):
+        '''
+        Fits (see get_fits) of the nuclides selected by mask.
+        '''
+        offsets = fits["offsets"]
+        counts = np.diff(offsets)
+        rows, _ = base_utilities.ragged_indices(offsets)
+        segments = np.repeat(np.arange(len(counts)),np.maximum(counts-1,0))
+        _, new_offsets = base_utilities.to_ragged([np.zeros(n) for n in counts[mask]])
+        return {"breakpoints" : fits["breakpoints"][mask[rows]], "coefficients" : fits["coefficients"][mask[segments]],
+                "offsets" : new_offsets, "integral" : fits["integral"][mask], "max_error" : fits["max_error"][mask],
+                "posOK" : fits["posOK"][mask]}
+
+    def evaluate(self,E,labels=["cumulative_thermal_fy_235u","cumulative_thermal_fy_239Pu","cumulative_thermal_fy_241Pu","cumulative_fast_fy_238u"],
+                 ffs = [0.564,0.076,0.304,0.056],nuclides=None,force_normalization=True,thr_norm=0.99,memory_budget=2**26):
+        """
+        Total spectrum (as get_total_spectrum, without uncertainties) at arbitrary energies, evaluated with the fits
+        of the spectra (see fit_spectrum): the spectra on the energy grid of the file are never read.
+        
+        Parameters
+        ----------
+        E : float or ndarray
+            Energies in keV.
+        labels, ffs :
+            See get_total_spectrum.
+        nuclides : list or ndarray
+            Names or indices (as in get_parameters) of the nuclides to sum. If None, all the nuclides with a fit are
+            used. Default is None.
+        force_normalization, thr_norm :
+            See get_nu_spectra (the integrals between 0 and 12000 keV are used).
+        memory_budget : int
+            Approximate memory in bytes used at a time: the energies are processed in blocks. Default is 2**26.
+            
+        Returns
+        -------
+            spectrum : ndarray
+                The reactor antineutrino spectrum at E (same shape as E).
+        """
+        E = np.asarray(E,dtype=float)
+        fits = self.get_fits(nuclides=nuclides)
+        posOK = fits["posOK"]
+        weight = np.zeros(len(posOK))
+        for i in range(len(labels)):
+            weight += self.__get_column(labels[i])[posOK]*ffs[i]
+        if force_normalization is True:
+            integral = fits["integral"]
+            weight = np.divide(weight,integral,out=weight.copy(),where=integral >= thr_norm)
+        fits = self.__select_fits(fits,weight != 0)
+        weight = weight[weight != 0]
+        
+        # one piecewise polynomial for all the nuclides: the breakpoints of the i-th nuclide are shifted by i*span,
+        # the intervals between two nuclides have null polynomials
+        offsets = fits["offsets"]
+        span = np.max(fits["breakpoints"],initial=0)+1.
+        shift = np.arange(len(weight))*span
+        breakpoints = fits["breakpoints"] + np.repeat(shift,np.diff(offsets))
+        coefficients = np.zeros((max(len(breakpoints)-1,0),fits["coefficients"].shape[1]))
+        keep = np.ones(len(coefficients),dtype=bool)
+        keep[offsets[1:-1]-1] = False
+        coefficients[keep] = fits["coefficients"]
+        
+        x = np.where((E >= 0) & (E < span),E,-1.).ravel()
+        spectrum = np.zeros(len(x))
+        block = max(memory_budget//(64*max(len(weight),1)),1)
+        for i in range(0,len(x),block):
+            values = base_utilities.evaluate_piecewise_polynomial(x[i:i+block]+shift[:,None],breakpoints,coefficients)
+            spectrum[i:i+block] = weight @ values
+        return spectrum.reshape(E.shape)
+
+    def compare(self,other,labels=["cumulative_thermal_fy_235u","cumulative_thermal_fy_239Pu","cumulative_thermal_fy_241Pu","cumulative_fast_fy_238u"],
+                ffs = [0.564,0.076,0.304,0.056],E_min = 0, E_max = 12e3, rtol = 1e-12, force_normalization=True, thr_norm=0.99,
+                memory_budget=2**28):
+        """
+        Compare the .lazy file with another one (e.g. a new build against the reference database).
+        
+        The nuclides are aligned by name. The parameters (the columns of get_table) are compared as whole columns, and the
+        spectra (dN_dE_tot) are read in blocks of nuclides from both files. The impact on the total spectrum (as get_total_spectrum,
+        without uncertainties) is evaluated in the same pass: the contribution of each nuclide is its spectrum, normalized as in
+        get_nu_spectra, times its cumulative yields weighted with ffs.
+        
+        Parameters
+        ----------
+        other : str or LazyReader
+            The other .lazy file. Its E_step must be the same.
+        labels, ffs :
+            See get_total_spectrum.
+        E_min : float
+            The lowest energy in keV. Default is 0.
+        E_max : float
+            The highest energy in keV. Default is 12000.
+        rtol : float
+            Relative tolerance: a parameter or a spectrum is changed if it differs by more than rtol (relative to the value,
+            or to the peak of the spectrum, in this file). Default is 1e-12.
+        force_normalization, thr_norm :
+            See get_nu_spectra (only for the total spectrum).
+        memory_budget : int
+            Approximate memory in bytes used for the spectra at a time. Default is 2**28.
+            
+        Returns
+        -------
+        comparison : dict
+            "nuclides" : dict of columns (one entry for each nuclide of the two files, sorted by name):
+                "lazy_name"; "in_self", "in_other" (bool); "changed_parameters" (names of the changed parameters, separated
+                by ","); "spectrum_max_abs" (largest difference of the spectra, nan if one of them is missing); "spectrum_max_rel"
+                (the same, relative to the peak of the spectrum in this file); "spectrum_changed" (bool, also True if the
+                spectrum is only in one file); "total_impact" (largest change of the contribution to the total spectrum,
+                relative to the peak of the total spectrum of this file).
+            "parameters" : {parameter : {"n_changed", "max_abs", "max_rel", "only_in"}} for every parameter with differences.
+                "only_in" is "self" or "other" if the parameter is in one file only (None otherwise).
+            "energy", "total_self", "total_other" : the total spectra. "total_max_rel" : largest difference of the total
+                spectra, relative to the peak of the total spectrum of this file.
+        """
+        other = other if isinstance(other,LazyReader) else LazyReader(other)
+        E_step = self.get_info()["E_step"]
+        if other.get_info()["E_step"] != E_step:
+            raise ValueError("the files have different E_step")
+        
+        # alignment of the nuclides
+        table, table_other = self.get_table(), other.get_table()
+        names = np.union1d(table["lazy_name"],table_other["lazy_name"])
+        in_self = np.isin(names,table["lazy_name"])
+        in_other = np.isin(names,table_other["lazy_name"])
+        index = np.zeros(len(names),dtype=int) # position of each nuclide in the file (as in get_parameters)
+        index[in_self] = self._get_positions(names[in_self],table["lazy_name"])
+        index_other = np.zeros(len(names),dtype=int)
+        index_other[in_other] = other._get_positions(names[in_other],table_other["lazy_name"])
+        both = in_self & in_other
+        
+        # parameters (only the nuclides in both files); a parameter missing in a file is compared as nan (or "")
+        changed = [[] for _ in names]
+        parameters = {}
+        for key in sorted(set(table.keys()) | set(table_other.keys())):
+            if key in ["lazy_name","A","element","isomer"]:
+                continue
+            a = table[key][index[both]] if key in table else None
+            b = table_other[key][index_other[both]] if key in table_other else None
+            if a is None:
+                a = np.full(len(b),"") if b.dtype.kind == "U" else np.full(len(b),np.nan)
+            if b is None:
+                b = np.full(len(a),"") if a.dtype.kind == "U" else np.full(len(a),np.nan)
+            if (a.dtype.kind == "U") or (b.dtype.kind == "U"):
+                diff = a.astype(str) != b.astype(str)
+                max_abs, max_rel = np.nan, np.nan
+            else:
+                delta = np.abs(b-a)
+                diff = (np.isnan(a) != np.isnan(b)) | (delta > rtol*np.abs(a))
+                delta = np.where(np.isnan(delta),0,delta)
+                max_abs = np.max(delta,initial=0)
+                max_rel = np.max(np.divide(delta,np.abs(a),out=np.where(delta > 0,np.inf,0.),where=np.abs(a) > 0),initial=0)
+            if np.any(diff):
+                only_in = "self" if key not in table_other else ("other" if key not in table else None)
+                parameters[key] = {"n_changed" : int(np.sum(diff)), "max_abs" : max_abs if only_in is None else np.nan,
+                                   "max_rel" : max_rel if only_in is None else np.nan, "only_in" : only_in}
+                for i in np.where(both)[0][diff]:
+                    changed[i].append(key)
+        
+        # spectra and total spectrum, in blocks of nuclides
+        energy, _, _ = self.__get_window(E_min,E_max,E_step)
+        weight = np.zeros(len(names))
+        weight_other = np.zeros(len(names))
+        for i in range(len(labels)):
+            weight[in_self] += self.__get_column(labels[i])[index[in_self]]*ffs[i]
+            weight_other[in_other] += other.__get_column(labels[i])[index_other[in_other]]*ffs[i]
+        max_abs = np.full(len(names),np.nan)
+        peak = np.zeros(len(names))
+        spectrum_changed = ~both
+        impact = np.zeros(len(names))
+        total = np.zeros(len(energy))
+        total_other = np.zeros(len(energy))
+        
+        def read(reader,positions,rows):
+            # spectra of the nuclides in positions, in the rows of a zero matrix (the missing spectra stay null)
+            data, _, pos_ok, _ = reader.get_data("dN_dE_tot",E_min=E_min,E_max=E_max,nuclides=positions[rows])
+            block = np.zeros((len(rows),len(energy)))
+            found = np.isin(positions[rows],pos_ok)
+            block[found] = data
+            if force_normalization is True:
+                integral = integrate.simpson(block,x=energy,axis=1) if len(energy) > 1 else np.zeros(len(rows))
+                block = np.divide(block.T,integral,out=block.T.copy(),where=integral >= thr_norm).T
+            return data, block, found
+        
+        n_block = max(memory_budget//(8*6*max(len(energy),1)),1)
+        for start in range(0,len(names),n_block):
+            rows = np.arange(start,min(start+n_block,len(names)))
+            contribution = np.zeros((len(rows),len(energy)))
+            contribution_other = np.zeros((len(rows),len(energy)))
+            found = np.zeros(len(rows),dtype=bool)
+            found_other = np.zeros(len(rows),dtype=bool)
+            raw = np.zeros((len(rows),len(energy)))
+            raw_other = np.zeros((len(rows),len(energy)))
+            sub = in_self[rows]
+            if np.any(sub):
+                data, block, found[sub] = read(self,index,rows[sub])
+                raw[np.where(sub)[0][found[sub]]] = data
+                contribution[sub] = (block.T*weight[rows[sub]]).T
+            sub = in_other[rows]
+            if np.any(sub):
+                data, block, found_other[sub] = read(other,index_other,rows[sub])
+                raw_other[np.where(sub)[0][found_other[sub]]] = data
+                contribution_other[sub] = (block.T*weight_other[rows[sub]]).T
+            
+            delta = np.abs(raw_other-raw)
+            max_abs[rows] = np.where(found & found_other,np.max(delta,axis=1,initial=0),np.nan)
+            peak[rows] = np.max(np.abs(raw),axis=1,initial=0)
+            spectrum_changed[rows] = (found != found_other) | (max_abs[rows] > rtol*peak[rows])
+            impact[rows] = np.max(np.abs(contribution_other-contribution),axis=1,initial=0)
+            total += np.sum(contribution,axis=0)
+            total_other += np.sum(contribution_other,axis=0)
+        
+        total_peak = np.max(np.abs(total),initial=0)
+        nuclides = {"lazy_name" : names, "in_self" : in_self, "in_other" : in_other,
+                    "changed_parameters" : np.array([",".join(el) for el in changed],dtype=str),
+                    "spectrum_max_abs" : max_abs,
+                    "spectrum_max_rel" : np.divide(max_abs,peak,out=np.where(max_abs > 0,np.inf,max_abs),where=peak > 0),
+                    "spectrum_changed" : spectrum_changed,
+                    "total_impact" : impact/total_peak if total_peak > 0 else impact}
+        return {"nuclides" : nuclides, "parameters" : parameters, "energy" : energy, "total_self" : total, "total_other" : total_other,
+                "total_max_rel" : np.max(np.abs(total_other-total),initial=0)/total_peak if total_peak > 0 else np.max(np.abs(total_other-total),initial=0)}
@@ -0,0 +1,231 @@
+'''
+ Desc  : Spectra of a .lazy file shared between processes (shared memory or memory-mapped files)
+ Author: Matteo Borghesi <matteo.borghesi@mib.infn.it>
+'''
+
+import numpy as np
+import tempfile
+import json
+import sys
+import os
+from multiprocessing import shared_memory, resource_tracker
+from base import base_utilities as bu
+from rw.lazy_handler import LazyReader
+from rw import storage
+
+
+def _attach(name):
+    '''
+    Attach to the shared memory block *name*, created by another process, without registering it with the resource
+    tracker of this process: the block belongs to its creator (see SharedSpectra.unlink), and the tracker of a worker
+    would unlink it, or warn about a leak, when the worker exits.
+    '''
+    if sys.version_info >= (3,13):
+        return shared_memory.SharedMemory(name=name,track=False)
+    block = shared_memory.SharedMemory(name=name)
+    if os.name == "posix": # only the POSIX blocks are tracked
+        resource_tracker.unregister(block._name,"shared_memory")
+    return block
+
+
+class SharedSpectra(LazyReader):
+
+    '''
+    LazyReader whose spectra (the output of get_nu_spectra) and table (see get_table) are loaded once and shared
+    between processes, e.g. the workers of a multiprocessing pool running fits.
+
+    The arrays are stored in shared memory blocks or, if *path* is given, in memory-mapped .npy files in that folder
+    (a scratch folder, preferably on a tmpfs such as /dev/shm). The object can be passed to the workers (it is pickled
+    as a small handle, see get_handle and attach): they attach to the same arrays without copies. The shared arrays
+    are read-only.
+
+    get_nu_spectra, get_total_spectrum, get_table, select, ... work as in LazyReader. get_nu_spectra uses the shared
+    arrays if it is called with the arguments used to load them (or without arguments), otherwise it reads the file.
+    Unlike LazyReader, it then returns the read-only shared arrays: copy them before modifying them in place (e.g. to
+    normalize the spectra).
+
+    Shared memory blocks are freed by unlink (or at the end of a with block) in the process that created them. They
+    can be used by its child processes; for independent processes, use memory-mapped files.
+
+    The memory-mapped files can also be kept as a compiled bundle (see export and load): a folder with the .npy files
+    and a manifest, loaded in a few milliseconds without reading the .lazy file.
+
+    '''
+
+    MANIFEST = "manifest.json"
+
+    def __init__(self,path_file,path=None,E_min=0,E_max=12e3,unc_BR=True,default_unc=0.2,force_normalization=True,thr_norm=0.99,dtype=None):
+        LazyReader.__init__(self,path_file)
+        options = {"E_min" : E_min, "E_max" : E_max, "unc_BR" : unc_BR, "default_unc" : default_unc,
+                   "force_normalization" : force_normalization, "thr_norm" : thr_norm,
+                   "dtype" : np.dtype(dtype).name if dtype is not None else None}
+        reader = LazyReader(path_file)
+        energy, spectra, spectra_er, posOK, posnotOK = reader.get_nu_spectra(**options)
+        arrays = {"energy" : energy, "spectra" : spectra, "spectra_er" : spectra_er, "posOK" : posOK, "posnotOK" : posnotOK}
+        for key, value in reader.get_table().items():
+            arrays["table/"+key] = value
+
+        handle = {"file" : path_file, "path" : path, "options" : options, "info" : reader.get_info(), "arrays" : {}}
+        if path is not None:
+            os.makedirs(path,exist_ok=True)
+        blocks = {}
+        for key, value in arrays.items():
+            value = np.ascontiguousarray(value)
+            if path is None:
+                block = shared_memory.SharedMemory(create=True,size=max(value.nbytes,1))
+                np.ndarray(value.shape,dtype=value.dtype,buffer=block.buf)[...] = value
+                blocks[key] = block
+                name = block.name
+            else:
+                name = key.replace("/","__")+".npy"
+                array = np.lib.format.open_memmap(os.path.join(path,name),mode="w+",dtype=value.dtype,shape=value.shape)
+                array[...] = value
+                array.flush()
+                del array
+            handle["arrays"][key] = (name,value.shape,value.dtype.str)
+        self.__load(handle,blocks,owner=True)
+
+    @classmethod
+    def attach(cls,handle):
+        '''
+        Return a SharedSpectra using the arrays described by handle (see get_handle), without copies.
+        '''
+        self = cls.__new__(cls)
+        LazyReader.__init__(self,handle["file"])
+        self.__load(handle,{},owner=False)
+        return self
+
+    @classmethod
+    def export(cls,path_file,path,**options):
+        '''
+        Write a compiled bundle of the .lazy file in the folder *path*: the energy grid, the spectra and their
+        uncertainties (get_nu_spectra with *options*), the indices of the nuclides and the columns of the table
+        (one .npy file each), and a manifest (manifest.json) describing them. Return the manifest.
+        '''
+        bundle = cls(path_file,path=path,**options)
+        handle = bundle.get_handle()
+        manifest = {"file" : os.path.abspath(path_file), "mtime" : storage.get_mtime(path_file), "options" : handle["options"],
+                    "info" : {key : (value.item() if isinstance(value,np.generic) else value) for key, value in handle["info"].items()},
+                    "arrays" : {key : {"file" : name, "shape" : list(shape), "dtype" : dtype} for key, (name, shape, dtype) in handle["arrays"].items()}}
+        bundle.close()
+        fd, temp = tempfile.mkstemp(dir=path,suffix=".tmp")
+        with os.fdopen(fd,"w") as f:
+            json.dump(manifest,f,indent=1,default=str)
+        os.replace(temp,os.path.join(path,cls.MANIFEST))
+        return manifest
+
+    @classmethod
+    def load(cls,path):
+        '''
+        Return a SharedSpectra using the bundle in the folder *path* (see export). The arrays are memory-mapped, so
+        the pages are shared by all the processes loading the same bundle. The .lazy file is used only by the methods
+        which read the file (e.g. get_nuclide, or get_nu_spectra with other arguments).
+        '''
+        with open(os.path.join(path,cls.MANIFEST),"r") as f:
+            manifest = json.load(f)
+        handle = {"file" : manifest["file"], "path" : path, "options" : manifest["options"], "info" : manifest["info"],
+                  "arrays" : {key : (value["file"],tuple(value["shape"]),value["dtype"]) for key, value in manifest["arrays"].items()}}
+        if os.path.exists(manifest["file"]) and (storage.get_mtime(manifest["file"]) != manifest["mtime"]):
+            bu.log("Warning: "+manifest["file"]+" was modified after the export of "+path,level=1)
+        return cls.attach(handle)
+
+    def __load(self,handle,blocks,owner=False):
+        self._handle = handle
+        self._options = dict(handle["options"])
+        self._options.setdefault("dtype",None)
+        self._owner = owner
+        self._blocks = []
+        self._arrays = {}
+        for key, (name, shape, dtype) in handle["arrays"].items():
+            if handle["path"] is None:
+                block = blocks[key] if key in blocks else _attach(name)
+                self._blocks.append(block)
+                array = np.ndarray(shape,dtype=dtype,buffer=block.buf)
+            else:
+                array = np.load(os.path.join(handle["path"],name),mmap_mode="r")
+            array.flags.writeable = False
+            self._arrays[key] = array
+        # as the cache of LazyReader.get_table: (stamp, table, masks of the patterns)
+        self._table = (None,{key[len("table/"):] : value for key, value in self._arrays.items() if key.startswith("table/")},{})
+
+    def __reduce__(self):
+        return (SharedSpectra.attach,(self._handle,))
+
+    def get_handle(self):
+        '''
+        Return the description of the shared arrays (a small dict), to be used with attach.
+        '''
+        return self._handle
+
+    def get_options(self):
+        '''
+        Return the arguments of get_nu_spectra used to load the shared spectra.
+        '''
+        return dict(self._options)
+
+    def close(self):
+        '''
+        Release the shared arrays in this process. The arrays returned before (e.g. by get_nu_spectra) must not be used after.
+        '''
+        self._arrays = {}
+        self._table = None
+        for block in self._blocks:
+            try:
+                block.close()
+            except BufferError:
+                pass # some arrays are still referenced: the memory is released when they are deleted
+        self._blocks = []
+
+    def unlink(self):
+        '''
+        Free the shared memory blocks (or delete the memory-mapped files). Only the process which created them can do it.
+        '''
+        if self._owner is False:
+            return
+        for key, (name, shape, dtype) in self._handle["arrays"].items():
+            try:
+                if self._handle["path"] is None:
+                    shared_memory.SharedMemory(name=name).unlink()
+                else:
+                    os.remove(os.path.join(self._handle["path"],name))
+            except FileNotFoundError:
+                pass
+        self._owner = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,*args):
+        self.close()
+        self.unlink()
+
+    def get_info(self):
+        return dict(self._handle["info"])
+
+    def get_table(self,group_path="nuclides",sub_group="info"):
+        return self._table[1]
+
+    def get_nuclides_list(self,group_path="nuclides"):
+        return list(self._table[1]["lazy_name"])
+
+    def get_nu_spectra(self,E_min=None,E_max=None,unc_BR=None,default_unc=None,force_normalization=None,thr_norm=None,nuclides=None,dtype=None):
+        '''
+        Same as LazyReader.get_nu_spectra. The arguments which are None take the values used to load the shared spectra:
+        if all the arguments (but nuclides) match them, the shared arrays are returned, read-only (the rows of *nuclides*
+        are copied), otherwise the spectra are read from the file.
+        '''
+        options = {"E_min" : E_min, "E_max" : E_max, "unc_BR" : unc_BR, "default_unc" : default_unc,
+                   "force_normalization" : force_normalization, "thr_norm" : thr_norm,
+                   "dtype" : np.dtype(dtype).name if dtype is not None else None}
+        options = {key : (value if value is not None else self._options.get(key)) for key, value in options.items()}
+        if options != self._options:
+            return LazyReader.get_nu_spectra(self,nuclides=nuclides,**options)
+
+        energy, spectra, spectra_er = self._arrays["energy"], self._arrays["spectra"], self._arrays["spectra_er"]
+        posOK, posnotOK = self._arrays["posOK"], self._arrays["posnotOK"]
+        if nuclides is None:
+            return energy, spectra, spectra_er, posOK, posnotOK
+        index = {p : i for i, p in enumerate(posOK)}
+        positions = self._get_positions(nuclides,self.get_table()["lazy_name"])
+        rows = np.array([index[p] for p in positions if p in index],dtype=int)
+        return energy, spectra[rows], spectra_er[rows], posOK[rows], np.array([p for p in positions if p not in index],dtype=int)
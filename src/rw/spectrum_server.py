@@ -0,0 +1,273 @@
+'''
+ Desc  : Local server answering total spectrum queries on a .lazy file held in memory, and its client
+ Author: Matteo Borghesi <matteo.borghesi@mib.infn.it>
+'''
+
+import numpy as np
+import http.client
+import http.server
+import urllib.parse
+import threading
+import json
+import io
+from rw.lazy_handler import LazyReader
+
+
+LABELS = ["cumulative_thermal_fy_235u","cumulative_thermal_fy_239Pu","cumulative_thermal_fy_241Pu","cumulative_fast_fy_238u"]
+LABELS_UNC = ["unc_ct_235u","unc_ct_239Pu","unc_ct_241Pu","unc_cf_238u"]
+FFS = [0.564,0.076,0.304,0.056]
+
+
+class SpectrumDatabase(object):
+    '''
+    Spectra of a .lazy file (get_nu_spectra with the given options, normalized) and the numeric parameters of the
+    nuclides (the yields, see LazyReader.get_table), read once and kept in memory as read-only arrays, together with
+    the squares of the spectra and of their uncertainties and their cumulative sums in energy (for the integrals in
+    bins). A total spectrum (see get_total_spectrum) is then a few matrix-vector products, without reading the file;
+    the memory used is about five times the size of the spectra.
+
+    '''
+
+    def __init__(self,path_file,E_min=0,E_max=12e3,unc_BR=True,default_unc=0.2,force_normalization=True,thr_norm=0.99):
+        self._reader = LazyReader(path_file)
+        self._options = {"E_min" : E_min, "E_max" : E_max, "unc_BR" : unc_BR, "default_unc" : default_unc,
+                         "force_normalization" : force_normalization, "thr_norm" : thr_norm}
+        energy, spectra, spectra_er, posOK, _ = self._reader.get_nu_spectra(**self._options)
+        table = self._reader.get_table()
+        self._arrays = {"energy" : energy, "spectra" : spectra, "spectra_sq" : spectra**2, "spectra_er_sq" : spectra_er**2,
+                        "posOK" : posOK}
+        step = float(self._reader.get_info()["E_step"])
+        for key, value in [("spectra_cum",spectra),("spectra_er_cum",spectra_er)]:
+            self._arrays[key] = np.zeros((value.shape[0],value.shape[1]+1))
+            np.cumsum(value*step,axis=1,out=self._arrays[key][:,1:])
+        # the numeric parameters of the nuclides with a spectrum, 0 if missing
+        self._columns = {key : np.where(np.isnan(value[posOK]),0.,value[posOK]) for key, value in table.items() if value.dtype.kind == "f"}
+        for value in list(self._arrays.values())+list(self._columns.values()):
+            value.flags.writeable = False
+        self._info = {"file" : path_file, "options" : self._options, "E_step" : step,
+                      "energy" : [float(energy[0]),float(energy[-1]),len(energy)] if len(energy) > 0 else [],
+                      "nuclides" : [str(el) for el in table["lazy_name"][posOK]], "parameters" : sorted(self._columns.keys())}
+
+    def get_info(self):
+        '''
+        Description of the database: the file and the options of get_nu_spectra, the energy grid (first, last, number
+        of energies), the nuclides with a spectrum and the numeric parameters.
+        '''
+        return dict(self._info)
+
+    def get_total_spectrum(self,labels=LABELS,labels_unc=LABELS_UNC,ffs=FFS,ffs_unc=None,E_min=None,E_max=None,edges=None,
+                           nuclides=None,query=None):
+        '''
+        Total spectrum, as LazyReader.get_total_spectrum on the spectra of the database (same result, apart from the
+        rounding due to the different order of the sums).
+
+        Parameters
+        ----------
+        labels, labels_unc, ffs, ffs_unc :
+            See LazyReader.get_total_spectrum.
+        E_min, E_max : float
+            Energy window (keV) within the one of the database. If None, the whole window. Default is None.
+        edges : list of float
+            Edges of energy bins (increasing). If given, the spectrum is integrated in each bin [edges[i],edges[i+1])
+            (sum times the energy step); the uncertainty of each spectrum is taken as fully correlated in energy.
+            Default is None.
+        nuclides : list
+            Names or indices (as in LazyReader.get_parameters) of the nuclides to sum. If None, all of them. Default is None.
+        query : str
+            Condition on the parameters (see LazyReader.select) selecting the nuclides to sum, together with nuclides.
+            Default is None.
+
+        Returns
+        -------
+            energy : ndarray
+                The energies in keV (the lower edges of the bins if edges is given).
+            spectrum : ndarray
+                The total spectrum.
+            spectrum_err : ndarray
+                Its uncertainty.
+        '''
+        energy = self._arrays["energy"]
+        posOK = self._arrays["posOK"]
+        if (len(labels) != len(ffs)) or (len(labels_unc) != len(ffs)) or ((ffs_unc is not None) and (len(ffs_unc) != len(ffs))):
+            raise ValueError("labels, labels_unc, ffs and ffs_unc must have the same length")
+
+        zeros = np.zeros(len(posOK)) # missing parameters, as in LazyReader.get_total_spectrum
+        weight = np.zeros(len(posOK))
+        weight_unc = np.zeros(len(posOK))
+        for i in range(len(labels)):
+            weight += self._columns.get(labels[i],zeros)*ffs[i]
+            weight_unc += (self._columns.get(labels_unc[i],zeros)*ffs[i])**2
+            if ffs_unc is not None:
+                weight_unc += (self._columns.get(labels[i],zeros)*ffs_unc[i])**2
+        selected = np.ones(len(posOK),dtype=bool)
+        if nuclides is not None:
+            selected &= np.isin(posOK,self._reader._get_positions(nuclides,self._reader.get_table()["lazy_name"]))
+        if query is not None:
+            selected &= np.isin(posOK,self._reader.select(query))
+        weight = np.where(selected,weight,0.)
+        weight_unc = np.where(selected,weight_unc,0.) # already squared
+
+        start = 0 if E_min is None else int(np.searchsorted(energy,E_min,side="left"))
+        stop = len(energy) if E_max is None else int(np.searchsorted(energy,E_max,side="right"))
+        stop = max(start,stop)
+        if edges is None:
+            spectrum = weight @ self._arrays["spectra"][:,start:stop]
+            spectrum_err = weight**2 @ self._arrays["spectra_er_sq"][:,start:stop] + weight_unc @ self._arrays["spectra_sq"][:,start:stop]
+            return energy[start:stop], spectrum, spectrum_err**0.5
+
+        edges = np.asarray(edges,dtype=float)
+        if (edges.ndim != 1) or (len(edges) < 2) or np.any(np.diff(edges) <= 0):
+            raise ValueError("edges must be increasing, with at least two values")
+        columns = np.clip(np.searchsorted(energy[start:stop],edges,side="left")+start,start,stop)
+        spectra = np.diff(self._arrays["spectra_cum"][:,columns],axis=1)
+        spectra_er = np.diff(self._arrays["spectra_er_cum"][:,columns],axis=1)
+        spectrum = weight @ spectra
+        spectrum_err = weight**2 @ spectra_er**2 + weight_unc @ spectra**2
+        return edges[:-1], spectrum, spectrum_err**0.5
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    '''
+    GET /info: the description of the database (json).
+    GET /total?...: the total spectrum (see SpectrumServer), as a .npy array with the rows energy, spectrum, spectrum_err.
+    '''
+
+    protocol_version = "HTTP/1.1" # keep-alive
+    disable_nagle_algorithm = True # the headers and the body are written separately
+
+    LISTS = ["labels","labels_unc","nuclides"]
+    NUMBERS = ["ffs","ffs_unc","edges"]
+
+    def do_GET(self):
+        parts = urllib.parse.urlsplit(self.path)
+        try:
+            if parts.path == "/info":
+                return self.__send(200,"application/json",json.dumps(self.server.database.get_info()).encode())
+            if parts.path != "/total":
+                return self.__send(404,"text/plain",b"unknown path "+parts.path.encode())
+            kwargs = {}
+            for key, value in urllib.parse.parse_qsl(parts.query):
+                if key in self.LISTS:
+                    kwargs[key] = [el for el in value.split(",") if el != ""]
+                elif key in self.NUMBERS:
+                    kwargs[key] = [float(el) for el in value.split(",") if el != ""]
+                elif key in ["E_min","E_max"]:
+                    kwargs[key] = float(value)
+                elif key == "query":
+                    kwargs[key] = value
+                else:
+                    raise ValueError("unknown parameter "+key)
+            energy, spectrum, spectrum_err = self.server.database.get_total_spectrum(**kwargs)
+        except (ValueError,KeyError,SyntaxError) as error:
+            return self.__send(400,"text/plain",str(error).encode())
+        buffer = io.BytesIO()
+        np.save(buffer,np.array([energy,spectrum,spectrum_err]))
+        return self.__send(200,"application/octet-stream",buffer.getvalue())
+
+    def __send(self,status,content_type,body):
+        self.send_response(status)
+        self.send_header("Content-Type",content_type)
+        self.send_header("Content-Length",str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self,format,*args):
+        return
+
+
+class SpectrumServer(http.server.ThreadingHTTPServer):
+    '''
+    HTTP server (one thread for each connection) answering the total spectrum queries on a SpectrumDatabase:
+
+        GET /info
+        GET /total?ffs=0.56,0.08,0.3,0.06&E_min=1800&edges=1800,2000,...&nuclides=87Br,...&query=A>90
+
+    The parameters of /total are those of SpectrumDatabase.get_total_spectrum (lists separated by commas, all optional).
+    The response is a .npy array (see numpy.save) with the rows energy, spectrum and spectrum_err; an invalid query
+    gets the status 400 with the error as text. Use SpectrumClient to send the queries.
+
+    By default the server listens only on the local host. With port=0 a free port is chosen (see get_url).
+
+    '''
+
+    daemon_threads = True
+
+    def __init__(self,database,host="127.0.0.1",port=0):
+        self.database = database
+        http.server.ThreadingHTTPServer.__init__(self,(host,port),_Handler)
+
+    def get_url(self):
+        return "http://"+self.server_address[0]+":"+str(self.server_address[1])
+
+    def start(self):
+        '''
+        Serve in a background thread (until shutdown). Returns the server itself.
+        '''
+        threading.Thread(target=self.serve_forever,daemon=True).start()
+        return self
+
+
+class SpectrumClient(object):
+    '''
+    Client of a SpectrumServer. Each thread keeps its own connection alive, so the client can be shared by threads.
+    '''
+
+    def __init__(self,url="http://127.0.0.1:8765",timeout=60.):
+        parts = urllib.parse.urlsplit(url)
+        self._host = parts.hostname
+        self._port = parts.port
+        self._timeout = timeout
+        self._local = threading.local()
+
+    def __get(self,path):
+        for attempt in range(2): # a connection closed by the server is opened again once
+            conn = getattr(self._local,"conn",None)
+            if conn is None:
+                conn = http.client.HTTPConnection(self._host,self._port,timeout=self._timeout)
+                self._local.conn = conn
+            try:
+                conn.request("GET",path)
+                response = conn.getresponse()
+                body = response.read()
+                break
+            except (http.client.HTTPException,ConnectionError):
+                conn.close()
+                self._local.conn = None
+                if attempt == 1:
+                    raise
+        if response.status != 200:
+            raise ValueError("the server answered "+str(response.status)+": "+body.decode(errors="replace"))
+        return body
+
+    def get_info(self):
+        '''
+        Description of the database of the server (see SpectrumDatabase.get_info).
+        '''
+        return json.loads(self.__get("/info").decode())
+
+    def get_total_spectrum(self,labels=None,labels_unc=None,ffs=None,ffs_unc=None,E_min=None,E_max=None,edges=None,
+                           nuclides=None,query=None):
+        '''
+        Total spectrum computed by the server (see SpectrumDatabase.get_total_spectrum; None means the default of the
+        server). Returns energy, spectrum and spectrum_err. ValueError is raised if the server rejects the query.
+        '''
+        params = {}
+        for key, value in [("labels",labels),("labels_unc",labels_unc),("nuclides",nuclides)]:
+            if value is not None:
+                params[key] = ",".join([str(el) for el in value])
+        for key, value in [("ffs",ffs),("ffs_unc",ffs_unc),("edges",edges)]:
+            if value is not None:
+                params[key] = ",".join([repr(float(el)) for el in value])
+        for key, value in [("E_min",E_min),("E_max",E_max)]:
+            if value is not None:
+                params[key] = repr(float(value))
+        if query is not None:
+            params["query"] = query
+        result = np.load(io.BytesIO(self.__get("/total?"+urllib.parse.urlencode(params))))
+        return result[0], result[1], result[2]
+
+    def close(self):
+        conn = getattr(self._local,"conn",None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
@@ -0,0 +1,653 @@
+'''
+ Desc  : Storage backends for the .lazy files (HDF5 and chunked directory store)
+ Author: Matteo Borghesi <matteo.borghesi@mib.infn.it>
+'''
+
+import numpy as np
+import h5py
+import tempfile
+import shutil
+import json
+import time
+import os
+
+
+class Dataset(object):
+    '''
+    Array of a DirectoryStore: a folder with the metadata (.array) and one .npy file for each chunk of rows.
+    It can be read as an h5py.Dataset: dataset[()], dataset[start:stop], np.array(dataset), dataset.shape.
+    Strings are returned as bytes (dtype object), as h5py does.
+
+    '''
+
+    def __init__(self,path):
+        self._path = path
+        with open(os.path.join(path,".array"),"r") as f:
+            meta = json.load(f)
+        self.shape = tuple(meta["shape"])
+        self._chunks = meta["chunks"]
+        self._string = meta["dtype"] == "str"
+        self.dtype = np.dtype(object) if self._string else np.dtype(meta["dtype"])
+        self.name = path
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __load(self,i):
+        value = np.load(os.path.join(self._path,str(i)+".npy"))
+        if self._string is True:
+            value = np.array([el.encode() for el in value.ravel()],dtype=object).reshape(value.shape)
+        return value
+
+    def __read(self,start,stop):
+        if self.shape == ():
+            return self.__load(0)
+        if start >= stop:
+            return np.zeros((0,)+self.shape[1:],dtype=self.dtype)
+        first, last = start//self._chunks, (stop-1)//self._chunks
+        value = np.concatenate([self.__load(i) for i in range(first,last+1)])
+        return value[start-first*self._chunks:stop-first*self._chunks]
+
+    def __getitem__(self,key):
+        if (self.shape != ()) and isinstance(key,slice) and (key.step in [None,1]):
+            start, stop, _ = key.indices(self.shape[0])
+            return self.__read(start,max(start,stop))
+        return self.__read(0,self.shape[0] if self.shape != () else 0)[key]
+
+    def __array__(self,dtype=None,copy=None):
+        value = self.__read(0,self.shape[0] if self.shape != () else 0)
+        return value.astype(dtype) if dtype is not None else value
+
+
+class Group(object):
+    '''
+    Group of a DirectoryStore (a folder). It can be used as an h5py.Group for the operations needed by the .lazy
+    files: the keys are sorted by name (as in HDF5), paths can contain "/", creating an existing object or deleting
+    a missing one raises an error (ValueError or KeyError, as h5py).
+
+    Every object is written in a temporary folder and then renamed, so a reader never sees a partial object, and
+    different processes can write different groups (e.g. different nuclides) at the same time.
+
+    '''
+
+    def __init__(self,store,path):
+        self._store = store
+        self._path = path
+        self.name = path
+
+    def __node(self,path):
+        full = os.path.join(self._path,*[el for el in path.split("/") if el != ""])
+        if os.path.isdir(full) is False:
+            return None
+        if os.path.isfile(os.path.join(full,".array")):
+            return Dataset(full)
+        return Group(self._store,full)
+
+    def __getitem__(self,path):
+        node = self.__node(path)
+        if node is None:
+            raise KeyError(path+" not found in "+self._path)
+        return node
+
+    def get(self,path,default=None,getlink=False):
+        node = self.__node(path)
+        return node if node is not None else default
+
+    def __contains__(self,path):
+        return self.__node(path) is not None
+
+    def keys(self):
+        return sorted([el for el in os.listdir(self._path) if not el.startswith(".")])
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def values(self):
+        return [self[el] for el in self.keys()]
+
+    def items(self):
+        return [(el,self[el]) for el in self.keys()]
+
+    def __split(self,path):
+        parts = [el for el in path.split("/") if el != ""]
+        parent = self.require_group("/".join(parts[:-1])) if len(parts) > 1 else self
+        return parent, parts[-1]
+
+    def __commit(self,temp,name):
+        target = os.path.join(self._path,name)
+        try:
+            if os.path.exists(target):
+                raise ValueError("unable to create "+name+" (name already exists)")
+            os.rename(temp,target)
+        except (ValueError,OSError):
+            shutil.rmtree(temp,ignore_errors=True)
+            raise ValueError("unable to create "+name+" (name already exists)")
+        self._store.touch()
+        return self[name]
+
+    def create_group(self,path):
+        parent, name = self.__split(path)
+        self._store.check_writable()
+        return parent.__commit(tempfile.mkdtemp(dir=parent._path,prefix=".tmp"),name)
+
+    def require_group(self,path):
+        parts = [el for el in path.split("/") if el != ""]
+        group = self
+        for name in parts:
+            node = group.get(name)
+            if node is None:
+                try:
+                    node = group.create_group(name)
+                except ValueError: # created by another writer in the meantime
+                    node = group[name]
+            if isinstance(node,Dataset):
+                raise TypeError(path+" is a dataset")
+            group = node
+        return group
+
+    def create_dataset(self,path,data=None,dtype=None):
+        parent, name = self.__split(path)
+        self._store.check_writable()
+        if isinstance(data,(Dataset,h5py.Dataset)):
+            data = data[()]
+        value = np.asarray(data,dtype=dtype if (dtype is not None) and (np.dtype(dtype) != object) else None)
+        string = value.dtype.kind in "OSU"
+        if string is True:
+            value = np.array([el.decode() if isinstance(el,bytes) else str(el) for el in value.ravel()]).reshape(value.shape)
+        temp = tempfile.mkdtemp(dir=parent._path,prefix=".tmp")
+        if value.shape == ():
+            chunks = 1
+            np.save(os.path.join(temp,"0.npy"),value)
+        else:
+            row = max(value[:1].nbytes,1)
+            chunks = max(self._store.get_chunk_bytes()//row,1)
+            for i in range(0,max(value.shape[0],1),chunks):
+                np.save(os.path.join(temp,str(i//chunks)+".npy"),value[i:i+chunks])
+        with open(os.path.join(temp,".array"),"w") as f:
+            json.dump({"shape" : list(value.shape), "dtype" : "str" if string else value.dtype.str, "chunks" : chunks},f)
+        return parent.__commit(temp,name)
+
+    def __delitem__(self,path):
+        parent, name = self.__split(path)
+        self._store.check_writable()
+        target = os.path.join(parent._path,name)
+        if os.path.isdir(target) is False:
+            raise KeyError(path+" not found in "+self._path)
+        temp = tempfile.mkdtemp(dir=parent._path,prefix=".tmp")
+        os.rename(target,os.path.join(temp,name))
+        shutil.rmtree(temp)
+        self._store.touch()
+
+
+class DirectoryStore(Group):
+    '''
+    Chunked directory store (one folder for each group and dataset, one file for each chunk), with the same layout
+    of the HDF5 .lazy files. Unlike HDF5, the store has no global lock: several processes can read it in parallel,
+    and write different nuclides at the same time.
+
+    mode is "r" (read only) or "a" (read and write, the store is created if it does not exist).
+    The chunks of the datasets have at most *chunk_bytes* bytes.
+
+    '''
+
+    MARKER = ".lazystore"
+
+    def __init__(self,path,mode="r",chunk_bytes=2**16):
+        if mode not in ["r","a"]:
+            raise ValueError("mode must be r or a")
+        if os.path.isfile(os.path.join(path,self.MARKER)) is False:
+            if mode == "r":
+                raise FileNotFoundError("no directory store in "+path)
+            os.makedirs(path,exist_ok=True)
+            with open(os.path.join(path,self.MARKER),"a") as f:
+                f.write("")
+        Group.__init__(self,self,path)
+        self._mode = mode
+        self._chunk_bytes = chunk_bytes
+
+    def get_chunk_bytes(self):
+        return self._chunk_bytes
+
+    def check_writable(self):
+        if self._mode != "a":
+            raise ValueError("the store "+self._path+" is open in read-only mode")
+
+    def touch(self):
+        '''
+        Update the modification time of the store (see get_mtime).
+        '''
+        os.utime(os.path.join(self._path,self.MARKER))
+
+    def close(self):
+        return
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,*args):
+        self.close()
+
+
+class MemoryGroup(object):
+    '''
+    Group of a MemoryFile: groups and read-only numpy arrays, read as an h5py.Group (paths can contain "/").
+    '''
+
+    def __init__(self,name,children):
+        self.name = name
+        self._children = children
+
+    def __node(self,path):
+        node = self
+        for el in [el for el in path.split("/") if el != ""]:
+            if (isinstance(node,MemoryGroup) is False) or (el not in node._children):
+                return None
+            node = node._children[el]
+        return node
+
+    def __getitem__(self,path):
+        node = self.__node(path)
+        if node is None:
+            raise KeyError(path+" not found in "+self.name)
+        return node
+
+    def get(self,path,default=None,getlink=False):
+        node = self.__node(path)
+        return node if node is not None else default
+
+    def __contains__(self,path):
+        return self.__node(path) is not None
+
+    def keys(self):
+        return list(self._children.keys())
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self._children)
+
+    def values(self):
+        return list(self._children.values())
+
+    def items(self):
+        return list(self._children.items())
+
+
+class MemoryFile(MemoryGroup):
+    '''
+    .lazy file read as a whole in memory (see load), with the interface of an open h5py.File in read mode. The arrays
+    are read-only numpy arrays, so the file can be shared by several threads without locks, and it is never modified.
+    mtime is the modification time of the file when it was read.
+    '''
+
+    def __init__(self,path,children,mtime):
+        MemoryGroup.__init__(self,path,children)
+        self.filename = path
+        self.mtime = mtime
+
+    def close(self):
+        return
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,*args):
+        self.close()
+
+
+class OverlayFile(h5py.File):
+    '''
+    Overlay (see overlay) open in read mode together with its base files, so that they are not opened again
+    each time an external link is followed. The base files are closed with the overlay.
+    '''
+
+    def __init__(self,path,bases):
+        h5py.File.__init__(self,_open_read(path).id)
+        if self.swmr_mode is True: # the external links are followed with the same access flags
+            self._bases = [_unlocked(lambda: h5py.File(el,"r",libver="latest",swmr=True)) for el in bases]
+        else:
+            self._bases = [HDF5Backend.open(el,"r") for el in bases]
+
+    def close(self):
+        h5py.File.close(self)
+        for el in self._bases:
+            el.close()
+
+
+def _unlocked(function):
+    '''
+    Call function (opening an HDF5 file) again until the file is not locked by another process, for at most
+    HDF5Backend.LOCK_TIMEOUT seconds.
+    '''
+    deadline = time.monotonic()+HDF5Backend.LOCK_TIMEOUT
+    while True:
+        try:
+            return function()
+        except BlockingIOError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.01)
+
+
+def _open_read(path):
+    '''
+    Open an HDF5 file in read mode, as a SWMR reader if it is open by a SWMR writer (see open_swmr).
+    '''
+    try:
+        return h5py.File(path,"r")
+    except BlockingIOError:
+        raise
+    except OSError: # the file is marked as open for writing, only SWMR readers are allowed
+        return h5py.File(path,"r",libver="latest",swmr=True)
+
+
+class HDF5Backend(object):
+    '''
+    Default backend: a single HDF5 file (h5py). The file can be an overlay of other HDF5 files (see overlay).
+    '''
+
+    _bases = {} # {path : (mtime, base files of the overlay)}
+    LOCK_TIMEOUT = 60. # seconds waiting for a file locked by another process (e.g. a writer adding a nuclide)
+
+    @staticmethod
+    def open(path,mode="r"):
+        '''
+        Open the file, waiting up to LOCK_TIMEOUT seconds if it is locked by another process. A file being written
+        in a SWMR session (see open_swmr) is opened as a SWMR reader.
+        '''
+        return _unlocked(lambda: HDF5Backend.__open(path,mode))
+
+    @staticmethod
+    def __open(path,mode):
+        if (mode != "r") or (os.path.isfile(path) is False):
+            return h5py.File(path,mode)
+        if len(HDF5Backend.get_bases(path)) > 0:
+            return OverlayFile(path,HDF5Backend.get_bases(path))
+        return _open_read(path)
+
+    @staticmethod
+    def exists(path):
+        return os.path.isfile(path)
+
+    @staticmethod
+    def get_mtime(path):
+        '''
+        Time of the last modification of the file, or of one of its base files if it is an overlay.
+        '''
+        return max([os.path.getmtime(path)]+[get_mtime(el) for el in HDF5Backend.get_bases(path)])
+
+    @staticmethod
+    def get_bases(path):
+        '''
+        Base files of an overlay (see get_bases), read again only if the file is modified.
+        '''
+        mtime = os.path.getmtime(path)
+        key = os.path.abspath(path)
+        if (key not in HDF5Backend._bases) or (HDF5Backend._bases[key][0] != mtime):
+            HDF5Backend._bases[key] = (mtime,get_bases(path))
+        return HDF5Backend._bases[key][1]
+
+
+class DirectoryBackend(object):
+    '''
+    Chunked directory store (see DirectoryStore).
+    '''
+
+    @staticmethod
+    def open(path,mode="r"):
+        return DirectoryStore(path,mode)
+
+    @staticmethod
+    def exists(path):
+        return os.path.isfile(os.path.join(path,DirectoryStore.MARKER))
+
+    @staticmethod
+    def get_mtime(path):
+        return os.path.getmtime(os.path.join(path,DirectoryStore.MARKER))
+
+
+BACKENDS = {"hdf5" : HDF5Backend, "directory" : DirectoryBackend}
+
+
+def get_backend(path,backend=None):
+    '''
+    Return the backend class: *backend* (a name in BACKENDS) if given, otherwise the backend of the existing file
+    (the directory store for a folder, HDF5 in all the other cases).
+    '''
+    if backend is not None:
+        return BACKENDS[backend]
+    return DirectoryBackend if os.path.isdir(path) else HDF5Backend
+
+
+def open_file(path,mode="r",backend=None):
+    '''
+    Open a .lazy file with its backend (see get_backend). The returned object is used as an h5py.File.
+    '''
+    return get_backend(path,backend).open(path,mode)
+
+
+def exists(path,backend=None):
+    return get_backend(path,backend).exists(path)
+
+
+def get_mtime(path,backend=None):
+    '''
+    Time of the last modification of the .lazy file.
+    '''
+    return get_backend(path,backend).get_mtime(path)
+
+
+def is_dataset(node):
+    return isinstance(node,(h5py.Dataset,Dataset,np.ndarray))
+
+
+def load(path,backend=None):
+    '''
+    Read the whole .lazy file in memory (see MemoryFile).
+    '''
+    mtime = get_mtime(path,backend)
+    with open_file(path,"r",backend=backend) as f:
+        return MemoryFile(path,_load(f),mtime)
+
+
+def _load(group):
+    children = {}
+    for key, node in group.items():
+        if is_dataset(node):
+            value = np.array(node[()],dtype=node.dtype) # the strings stay bytes in object arrays, as read by h5py
+            value.flags.writeable = False
+            children[key] = value
+        else:
+            children[key] = MemoryGroup(node.name,_load(node))
+    return children
+
+
+def copy(source,dest,name):
+    '''
+    Copy the group or dataset *source* in the group *dest* with the given name. The objects are copied by HDF5
+    if both are in HDF5 files, otherwise they are read and written again.
+    '''
+    if isinstance(source,h5py.HLObject) and isinstance(dest,h5py.HLObject):
+        source.file.copy(source,dest,name=name,expand_external=True) # the objects of an overlay are copied, not linked
+        return
+    if is_dataset(source) is False:
+        group = dest.create_group(name)
+        for key, value in source.items():
+            copy(value,group,key)
+        return
+    value = source[()]
+    if (source.dtype == object) and isinstance(dest,h5py.Group):
+        if isinstance(value,bytes):
+            value = value.decode()
+        else:
+            value = np.array([el.decode() if isinstance(el,bytes) else el for el in value.ravel()],dtype=object).reshape(value.shape)
+        dest.create_dataset(name,data=value,dtype=h5py.string_dtype())
+    else:
+        dest.create_dataset(name,data=value)
+    return
+
+
+OVERLAY_GROUPS = ["info","nuclides","manifest"]
+
+
+def overlay(path,bases):
+    '''
+    Make the HDF5 file *path* (created if it does not exist) an overlay of the HDF5 .lazy files *bases*, given from the
+    lowest to the topmost layer. Every header entry, nuclide and manifest entry of the bases which is not in the file
+    becomes an external link to the topmost base having it, so the file is read as the union of the layers and only the
+    objects written in it (see materialize) take space. The paths of the bases are stored relative to the file.
+
+    The links are refreshed if the function is called again (e.g. after adding nuclides to a base): the objects already
+    written in the file are kept, a nuclide deleted from the overlay is linked again.
+    '''
+    folder = os.path.dirname(os.path.abspath(path))
+    sources = {}
+    for base in bases:
+        if get_backend(base) is not HDF5Backend:
+            raise ValueError("the base "+base+" is not an HDF5 file")
+        with h5py.File(base,"r") as f:
+            for group in OVERLAY_GROUPS:
+                for name in f.get(group,{}).keys():
+                    sources[group+"/"+name] = os.path.relpath(os.path.abspath(base),folder)
+    with h5py.File(path,"a") as f:
+        for name, base in sources.items():
+            link = f.get(name,getlink=True)
+            if link is not None:
+                if isinstance(link,h5py.ExternalLink) is False:
+                    continue # written in the overlay
+                del f[name]
+            f.require_group(os.path.dirname(name))[os.path.basename(name)] = h5py.ExternalLink(base,"/"+name)
+        if "overlay" in f:
+            del f["overlay"]
+        f.create_dataset("overlay/bases",data=[os.path.relpath(os.path.abspath(el),folder) for el in bases],dtype=h5py.string_dtype())
+    return
+
+
+def get_bases(path):
+    '''
+    Base files of an overlay (see overlay), from the lowest to the topmost layer. Empty for the other files.
+    '''
+    if get_backend(path) is not HDF5Backend:
+        return []
+    with _unlocked(lambda: _open_read(path)) as f:
+        if "overlay/bases" not in f:
+            return []
+        bases = [el.decode() if isinstance(el,bytes) else el for el in f["overlay/bases"][()]]
+    return [os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(path)),el)) for el in bases]
+
+
+def get_source(f,path):
+    '''
+    File where the object *path* of the open file *f* is stored: the file itself, or the base file of an overlay.
+    '''
+    if isinstance(f,h5py.File):
+        parts = [el for el in path.split("/") if el != ""]
+        for i in range(1,len(parts)+1):
+            link = f.get("/".join(parts[:i]),getlink=True)
+            if isinstance(link,h5py.ExternalLink):
+                return os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(f.filename)),link.filename))
+    return f.filename if isinstance(f,h5py.File) else f.name
+
+
+def materialize(f,path):
+    '''
+    Replace the external links (see overlay) along *path* in the file *f*, open in write mode, with copies of the
+    linked objects, so that they can be modified without touching the base files (copy on write).
+    Nothing happens if the objects are already in the file.
+    '''
+    if isinstance(f,h5py.File) is False:
+        return
+    parts = [el for el in path.split("/") if el != ""]
+    for i in range(1,len(parts)+1):
+        name = "/".join(parts[:i])
+        link = f.get(name,getlink=True)
+        if link is None:
+            return
+        if isinstance(link,h5py.ExternalLink):
+            lapl = h5py.h5p.create(h5py.h5p.LINK_ACCESS)
+            lapl.set_elink_acc_flags(h5py.h5f.ACC_RDONLY) # the base is never opened in write mode
+            oid = h5py.h5o.open(f.id,name.encode(),lapl=lapl)
+            source = h5py.Group(oid) if isinstance(oid,h5py.h5g.GroupID) else h5py.Dataset(oid)
+            del f[name]
+            parent = f.require_group("/".join(parts[:i-1])) if i > 1 else f
+            f.copy(source,parent,name=parts[i-1],expand_external=True)
+    return
+
+
+def is_latest(path):
+    '''
+    True if the HDF5 file is written in the format of HDF5 >= 1.10 (superblock version >= 3), needed by SWMR.
+    '''
+    with _open_read(path) as f:
+        return f.id.get_create_plist().get_version()[0] >= 3
+
+
+def _rewrite(source,dest):
+    for name in source.keys():
+        link = source.get(name,getlink=True)
+        if isinstance(link,h5py.ExternalLink): # overlay (see overlay)
+            dest[name] = h5py.ExternalLink(link.filename,link.path)
+            continue
+        node = source[name]
+        if isinstance(node,h5py.Group):
+            _rewrite(node,dest.create_group(name))
+            continue
+        string = h5py.check_string_dtype(node.dtype) is not None
+        chunked = (node.chunks is not None) and (node.maxshape != node.shape)
+        dest.create_dataset(name,data=node[()],dtype=h5py.string_dtype() if string else node.dtype,
+                            maxshape=node.maxshape if chunked else None,chunks=node.chunks if chunked else None)
+    return
+
+
+def upgrade(path):
+    '''
+    Rewrite the HDF5 file *path* in the format of HDF5 >= 1.10 (see is_latest), if it is not already. The objects are
+    read and written again in a temporary file, which then replaces the file; the external links are kept.
+    '''
+    if is_latest(path):
+        return
+    handle, temp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)),prefix=".tmp",suffix=".lazy")
+    os.close(handle)
+    try:
+        with h5py.File(path,"r") as f, h5py.File(temp,"w",libver="latest") as out:
+            _rewrite(f,out)
+        os.replace(temp,path)
+    except BaseException:
+        os.remove(temp)
+        raise
+    return
+
+
+def open_swmr(path):
+    '''
+    Open the HDF5 file *path* for a SWMR (single writer, multiple readers) session: while the writer is in SWMR mode
+    (f.swmr_mode = True), other processes can open the file for reading (see HDF5Backend.open) and see the data
+    flushed by the writer. The file is created if it does not exist, and rewritten with upgrade if it is older.
+
+    In SWMR mode no object (group or dataset) can be created or deleted: only the existing datasets can be written
+    and resized (see LazyWriter.start_swmr).
+    '''
+    if get_backend(path) is not HDF5Backend:
+        raise ValueError("SWMR needs an HDF5 file, "+path+" is not")
+    if os.path.isfile(path) is False:
+        h5py.File(path,"w",libver="latest").close()
+    upgrade(path)
+    return _unlocked(lambda: h5py.File(path,"a",libver="latest"))
+
+
+def convert(source,destination,backend="directory"):
+    '''
+    Copy the .lazy file *source* (any backend) into *destination*, written with *backend*.
+    '''
+    with open_file(source,"r") as f, open_file(destination,"a",backend=backend) as out:
+        for key in f.keys():
+            if key == "overlay": # the objects of an overlay are copied (see copy), the file is not an overlay
+                continue
+            if key in out:
+                del out[key]
+            copy(f[key],out,key)
+    return
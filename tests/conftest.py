@@ -0,0 +1,4 @@
+import sys
+import os
+
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.abspath(__file__)),"..","src"))
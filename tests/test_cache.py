@@ -0,0 +1,71 @@
+'''
+Tests of the cache of the Betashape results (process/cache.py).
+'''
+import numpy as np
+import time
+import os
+import pytest
+
+from process import cache as result_cache
+from process.cache import ResultCache
+
+
+def output(seed):
+    rng = np.random.default_rng(seed)
+    return {0 : [{"label" : ["E", "dN/dE"], "data_beta" : rng.random((100,2)), "data_nu" : rng.random((100,2)),
+                  "output_message" : ["line"]}]}
+
+
+def files(path,suffix):
+    return sorted([el.name for el in os.scandir(path) if el.name.endswith(suffix)])
+
+
+def test_put_get(tmp_path):
+    cache = ResultCache(str(tmp_path))
+    cache.put("a",output(0))
+    result = cache.get("a")
+    assert np.array_equal(result[0][0]["data_nu"],output(0)[0][0]["data_nu"])
+    assert result[0][0]["label"] == ["E", "dN/dE"]
+    assert cache.get("b") is None
+    cache.put("c",{0 : []}) # empty outputs are not stored
+    assert files(str(tmp_path),".npz") == ["a.npz"]
+
+
+def test_failed_write(tmp_path,monkeypatch):
+    cache = ResultCache(str(tmp_path))
+    def broken(f,**arrays):
+        f.write(b"partial")
+        raise KeyboardInterrupt
+    monkeypatch.setattr(result_cache.np,"savez_compressed",broken)
+    with pytest.raises(KeyboardInterrupt):
+        cache.put("a",output(0))
+    assert os.listdir(str(tmp_path)) == []
+
+
+def test_evict(tmp_path,monkeypatch):
+    ResultCache(str(tmp_path)).put("a",output(0))
+    size = os.path.getsize(str(tmp_path/"a.npz"))
+    ResultCache(str(tmp_path),max_size=0).put("b",output(1))
+    assert files(str(tmp_path),".npz") == []
+
+    cache = ResultCache(str(tmp_path),max_size=int(2.5*size))
+    scans = []
+    evict = ResultCache.evict
+    monkeypatch.setattr(ResultCache,"evict",lambda self: scans.append(1) or evict(self))
+    for i, key in enumerate(["a","b"]):
+        cache.put(key,output(i))
+        os.utime(str(tmp_path/(key+".npz")),(time.time()-10+i,time.time()-10+i))
+    assert len(scans) == 1 # only the first put, then the size is estimated
+    cache.get("a") # now b is the least recently used
+    cache.put("c",output(2))
+    assert len(scans) == 2
+    assert files(str(tmp_path),".npz") == ["a.npz","c.npz"]
+
+
+def test_stale_temporary_files(tmp_path):
+    cache = ResultCache(str(tmp_path))
+    for name, age in [("old.tmp",2*ResultCache.TMP_AGE),("new.tmp",0)]:
+        open(str(tmp_path/name),"wb").close()
+        os.utime(str(tmp_path/name),(time.time()-age,time.time()-age))
+    cache.evict()
+    assert files(str(tmp_path),".tmp") == ["new.tmp"]
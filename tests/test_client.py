@@ -0,0 +1,195 @@
+'''
+Tests of the HTTP client (process/client.py) against a local stand-in of the live chart API, serving the recorded
+CSVs in tests/data (ground_states_<nuclide>.csv).
+'''
+import http.server
+import urllib.parse
+import urllib.error
+import threading
+import types
+import time
+import os
+import pytest
+
+from process import client as http_client
+from process.client import HttpClient, ResponseCache
+from process.wrappers import CmdNuChart
+
+
+DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)),"data")
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    '''
+    GET /data?fields=ground_states&nuclides=<name>: the recorded CSV, 404 if missing.
+    The statuses in server.failures[name] are answered first (503 with Retry-After: 1), and each request waits
+    server.delays.get(name,0) seconds.
+    '''
+
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        query = dict(urllib.parse.parse_qsl(urllib.parse.urlsplit(self.path).query))
+        name = query.get("nuclides","")
+        server = self.server
+        with server.lock:
+            server.requests.append((name,self.client_address))
+            server.active += 1
+            server.max_active = max(server.max_active,server.active)
+            status = server.failures[name].pop(0) if len(server.failures.get(name,[])) > 0 else 200
+        time.sleep(server.delays.get(name,0))
+        fname = os.path.join(DATA,"ground_states_"+name+".csv")
+        if (status == 200) and (os.path.exists(fname) is False):
+            status = 404
+        with server.lock:
+            server.active -= 1
+        if status != 200:
+            self.send_response(status)
+            if status == 503:
+                self.send_header("Retry-After","1")
+            self.send_header("Content-Length","0")
+            self.end_headers()
+            return
+        with open(fname,"rb") as f:
+            body = f.read()
+        self.send_response(200)
+        self.send_header("Content-Type","text/csv; charset=utf-8")
+        self.send_header("Content-Length",str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self,format,*args):
+        return
+
+
+@pytest.fixture
+def server():
+    server = http.server.ThreadingHTTPServer(("127.0.0.1",0),_Handler)
+    server.daemon_threads = True
+    server.lock = threading.Lock()
+    server.requests = []
+    server.failures = {}
+    server.delays = {}
+    server.active = 0
+    server.max_active = 0
+    server.url = "http://127.0.0.1:"+str(server.server_address[1])+"/data?"
+    threading.Thread(target=server.serve_forever,daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def recorded(name):
+    with open(os.path.join(DATA,"ground_states_"+name+".csv"),encoding="utf-8") as f:
+        return f.read()
+
+
+def test_retry_after(server,monkeypatch):
+    delays = []
+    monkeypatch.setattr(http_client,"time",types.SimpleNamespace(sleep=delays.append,time=time.time))
+    server.failures["87br"] = [503,503]
+    client = HttpClient(server.url,backoff=30.,retries=3)
+    assert client.get(CmdNuChart.nu_chart_query("87br")) == recorded("87br")
+    assert delays == [1.,1.] # the Retry-After of the server, not the backoff
+    assert len(server.requests) == 3
+
+
+def test_retries_exhausted(server,monkeypatch):
+    monkeypatch.setattr(http_client,"time",types.SimpleNamespace(sleep=lambda delay: None,time=time.time))
+    server.failures["87br"] = [503,503,503]
+    client = HttpClient(server.url,retries=2)
+    with pytest.raises(urllib.error.HTTPError) as error:
+        client.get(CmdNuChart.nu_chart_query("87br"))
+    assert error.value.code == 503
+    assert len(server.requests) == 3
+
+
+def test_no_retry_on_404(server):
+    client = HttpClient(server.url,retries=3)
+    with pytest.raises(urllib.error.HTTPError) as error:
+        client.get(CmdNuChart.nu_chart_query("1h"))
+    assert error.value.code == 404
+    assert len(server.requests) == 1
+
+
+def test_keep_alive(server):
+    client = HttpClient(server.url,max_connections=2)
+    for _ in range(5):
+        assert client.get(CmdNuChart.nu_chart_query("92rb")) == recorded("92rb")
+    assert len(set([el[1] for el in server.requests])) == 1
+    client.close()
+
+
+def test_max_connections(server):
+    server.delays["87br"] = 0.05
+    client = HttpClient(server.url,max_connections=2)
+    results = client.get_many([CmdNuChart.nu_chart_query("87br")]*12)
+    assert results == [recorded("87br")]*12
+    assert server.max_active <= 2
+    assert len(set([el[1] for el in server.requests])) <= 2
+    client.close()
+
+
+def test_get_many_order(server):
+    server.delays["87br"] = 0.1 # the first answer arrives last
+    client = HttpClient(server.url,max_connections=3,retries=0)
+    names = ["87br","1h","92rb"]
+    results = client.get_many([CmdNuChart.nu_chart_query(el) for el in names])
+    assert results[0] == recorded("87br")
+    assert isinstance(results[1],urllib.error.HTTPError) and (results[1].code == 404)
+    assert results[2] == recorded("92rb")
+
+
+def test_cache_ttl(tmp_path):
+    cache = ResponseCache(str(tmp_path),ttl=10)
+    cache.put("url","text")
+    assert cache.get("url") == "text"
+    fname = [el.path for el in os.scandir(str(tmp_path))][0]
+    os.utime(fname,(time.time()-11,time.time()-11))
+    assert cache.get("url") is None
+    assert cache.get("url",expired=True) == "text"
+    assert ResponseCache(str(tmp_path)).get("url") == "text" # no ttl
+
+
+def test_cache_default_path(monkeypatch,tmp_path):
+    monkeypatch.setattr(ResponseCache.__init__,"__defaults__",(str(tmp_path/"http"),None))
+    cache = ResponseCache()
+    cache.put("url","text")
+    assert os.path.isdir(cache.get_path()) and (cache.get("url") == "text")
+
+
+def test_offline(server,tmp_path):
+    query = CmdNuChart.nu_chart_query("87br")
+    HttpClient(server.url,cache=ResponseCache(str(tmp_path))).get(query)
+    assert len(server.requests) == 1
+
+    cache = ResponseCache(str(tmp_path),ttl=0) # expired, but still used offline
+    client = HttpClient(server.url,cache=cache,offline=True)
+    assert client.get(query) == recorded("87br")
+    with pytest.raises(ConnectionError):
+        client.get(CmdNuChart.nu_chart_query("92rb"))
+    assert len(server.requests) == 1
+
+
+def test_prefetch(server):
+    chart = CmdNuChart(server.url)
+    names = ["87br","1h","92rb"]
+    failed = chart.prefetch([CmdNuChart.nu_chart_query(el) for el in names])
+    assert failed == [CmdNuChart.nu_chart_query("1h")]
+    n_requests = len(server.requests)
+    chart.get_nu_chart("92rb")
+    assert len(server.requests) == n_requests # served from the prefetched responses
+    assert list(chart.get_df()["symbol"]) == ["Rb"]
+    chart.get_nu_chart("92rb") # used only once
+    assert len(server.requests) == n_requests+1
+
+
+def test_set_client(server,tmp_path):
+    chart = CmdNuChart(server.url)
+    chart.set_client(HttpClient(server.url,cache=ResponseCache(str(tmp_path)),offline=True))
+    with pytest.raises(ConnectionError):
+        chart.get_nu_chart("92rb")
+    chart.set_client() # back to the default client of the url
+    chart.get_nu_chart("92rb")
+    assert list(chart.get_df()["symbol"]) == ["Rb"]
+    assert len(server.requests) == 1
@@ -0,0 +1,84 @@
+'''
+Tests of LazyReader (rw/lazy_handler.py) on small .lazy files written in a temporary directory.
+'''
+import numpy as np
+import pytest
+
+from rw.lazy_handler import LazyWriter, LazyReader
+
+
+# two transitions: BRs 0.75(3) and 0.25(2), spectra summing to the BRs
+TRANSITIONS = {"transition_intensity" : np.array([0.75,0.25]), "transition_unc_intensity" : np.array([3,2]),
+               "transition_dN_dE_values" : np.array([0.3,0.3,0.15,0.1,0.15]),
+               "transition_unc_dN_dE_values" : np.array([0.03,0.03,0.015,0.01,0.01]),
+               "transition_offsets" : np.array([0,3,5])}
+# sum over the transitions of (spectrum/BR*unc_BR)**2 + unc_spectrum**2, bin by bin
+BR_UNC = np.array([(0.3/0.75*0.03)**2+0.03**2+(0.1/0.25*0.02)**2+0.01**2,
+                   (0.3/0.75*0.03)**2+0.03**2+(0.15/0.25*0.02)**2+0.01**2,
+                   (0.15/0.75*0.03)**2+0.015**2,0.,0.,0.])**0.5
+
+
+@pytest.fixture
+def lazy_file(tmp_path):
+    fname = str(tmp_path/"test.lazy")
+    LW = LazyWriter(fname=fname)
+    LW.set_general_info({"E_step" : 1.})
+    spectrum = np.array([0.4,0.45,0.15,0.,0.,0.])
+    for name, data in [("A",dict(TRANSITIONS,dN_dE_tot=spectrum)),("B",{"dN_dE_tot" : spectrum})]:
+        LW.write_nuclide_data(nuclide_name=name,dtype="info",dictionary={"z" : 1})
+        LW.write_nuclide_data(nuclide_name=name,dtype="data",dictionary=data)
+    return fname
+
+
+def test_br_uncertainty(lazy_file):
+    LR = LazyReader(lazy_file)
+    names = LR.get_nuclides_list()
+    _, spectra, spectra_er, posOK, _ = LR.get_nu_spectra(E_max=6,force_normalization=False,default_unc=0.2)
+    A, B = [list(posOK).index(names.index(el)) for el in ["A","B"]]
+    assert np.allclose(spectra_er[A],BR_UNC,rtol=1e-12,atol=0)
+    assert np.allclose(spectra_er[B],0.2*spectra[B],rtol=1e-12,atol=0) # no transitions: default_unc
+
+    _, _, spectra_er, _, _ = LR.get_nu_spectra(E_min=1,E_max=6,force_normalization=False,nuclides=["A"])
+    assert np.allclose(spectra_er[0],BR_UNC[1:],rtol=1e-12,atol=0)
+
+
+def test_br_uncertainty_errors_raised(lazy_file,monkeypatch):
+    def broken(self,loc,thr=0.2,transitions=None):
+        raise TypeError("broken")
+    monkeypatch.setattr(LazyReader,"_evaluate_total_spectrum",broken)
+    with pytest.raises(TypeError):
+        LazyReader(lazy_file).get_nu_spectra(E_max=6,nuclides=["A"])
+
+
+def test_positions(lazy_file):
+    LR = LazyReader(lazy_file)
+    names = LR.get_nuclides_list()
+    _, spectra, _, posOK, _ = LR.get_nu_spectra(E_max=6,nuclides=["B",np.int64(names.index("A"))])
+    assert list(posOK) == [names.index("B"),names.index("A")]
+    assert list(LR.get_nu_spectra(E_max=6,nuclides=np.array([False,True]))[3]) == [1]
+    for nuclides in [[-1],[10**6],["C"],[0,0],["A",names.index("A")],np.array([True])]:
+        with pytest.raises(ValueError):
+            LR.get_nu_spectra(E_max=6,nuclides=nuclides)
+    with pytest.raises(ValueError):
+        LR.get_total_spectrum(labels=["z"],labels_unc=["z"],ffs=[1.],nuclides=[0,0])
+
+
+def test_total_spectrum_fast(lazy_file,monkeypatch):
+    LR = LazyReader(lazy_file)
+    reads = []
+    get_nu_spectra = LazyReader.get_nu_spectra
+    monkeypatch.setattr(LazyReader,"get_nu_spectra",lambda self,**kwargs: reads.append(kwargs) or get_nu_spectra(self,**kwargs))
+    options = {"labels" : ["z"], "labels_unc" : ["z"]}
+    _, spectra, spectra_er, posOK, _ = get_nu_spectra(LR,E_max=6)
+    for ffs in [[1.],[2.],[1.]]:
+        spectrum, spectrum_err, bound, kept = LR.get_total_spectrum_fast(tol=0,ffs=ffs,E_max=6,**options)
+        reference = LR.get_total_spectrum(spectra=spectra,spectra_er=spectra_er,posOK=posOK,ffs=ffs,**options)
+        assert np.allclose(spectrum,reference[0],rtol=1e-12,atol=0) and np.allclose(spectrum_err,reference[1],rtol=1e-12,atol=0)
+        assert np.all(bound == 0) and (list(kept) == list(posOK))
+    assert len(reads) == 2 # the envelope, then the spectra of the kept nuclides (the same for every ffs)
+
+    LR.clear_cache()
+    monkeypatch.setattr(LazyReader,"KEPT_MEMORY",0) # no spectra cached
+    for _ in range(2):
+        LR.get_total_spectrum_fast(tol=0,ffs=[1.],E_max=6,**options)
+    assert len(reads) == 5
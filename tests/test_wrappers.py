@@ -0,0 +1,70 @@
+'''
+Tests of the Betashape wrappers (process/wrappers.py) with a stand-in of the Betashape binary: a shell script which
+prints $OUTPUT, writes the folder of the nuclide (if $FOLDER is not empty) and exits with $CODE.
+'''
+import subprocess
+import asyncio
+import time
+import os
+import pytest
+
+from process.wrappers import CmdBetaShape, AsyncBetaShape
+
+
+SCRIPT = """#!/bin/sh
+echo "$OUTPUT"
+if [ -n "$FOLDER" ]; then mkdir $FOLDER; echo 1 > $FOLDER/trans_myEstep.txt; fi
+exit $CODE
+"""
+
+
+@pytest.fixture
+def betashape(tmp_path):
+    os.makedirs(str(tmp_path/"betashape"))
+    with open(str(tmp_path/"betashape"/"betashape"),"w") as f:
+        f.write(SCRIPT)
+    os.chmod(str(tmp_path/"betashape"/"betashape"),0o755)
+    os.makedirs(str(tmp_path/"out"))
+    with open(str(tmp_path/"input.ensdf"),"w") as f:
+        f.write("input")
+    cmd = CmdBetaShape(str(tmp_path/"betashape"))
+    cmd.set_save_path(str(tmp_path/"out"))
+    return cmd
+
+
+@pytest.mark.parametrize("output, folder, code, state",[
+    ("Calculation of allowed transition","87Br",0,"file processed"),
+    ("Error function table: 4.3e-2","87Br",0,"file processed"), # "error" in the output of a good run
+    ("","87Br",0,"file processed"),
+    ("Calculation of allowed transition","87Br",1,"file not processed"),
+    ("Calculation of allowed transition","",0,"file not processed"),
+    ("","",1,"file not found"),
+])
+def test_state(betashape,tmp_path,monkeypatch,output,folder,code,state):
+    monkeypatch.setenv("OUTPUT",output)
+    monkeypatch.setenv("FOLDER",folder)
+    monkeypatch.setenv("CODE",str(code))
+    betashape.run_betashape_isolated(fpath=str(tmp_path),fname="input.ensdf",verbose=False)
+    assert betashape.get_result_state() == state
+
+    runner = AsyncBetaShape(betashape)
+    save_path = str(tmp_path/"async")
+    os.makedirs(save_path)
+    assert asyncio.run(runner._run(save_path,str(tmp_path),"input.ensdf","")) == state
+
+
+def test_timeout(betashape,tmp_path):
+    with open(str(tmp_path/"betashape"/"betashape"),"w") as f:
+        f.write("#!/bin/sh\nexec sleep 30\n")
+    jobs = {i : {"ensdf_path" : str(tmp_path), "ensdf_name" : "input.ensdf"} for i in range(2)}
+    pool = betashape.start_workers(2)
+    try:
+        for _ in range(2):
+            start = time.perf_counter()
+            results = list(betashape.evaluate_decays(jobs,n_workers=2,timeout=1))
+            assert time.perf_counter()-start < 5 # the workers are already running
+            assert sorted([el[0] for el in results]) == [0,1]
+            assert all([isinstance(el[2],subprocess.TimeoutExpired) for el in results])
+            assert betashape.start_workers(2) is pool
+    finally:
+        betashape.close()